@@ -1,6 +1,7 @@
 import os
 import re
 import argparse
+from parquet_scan import DEFAULT_WORKERS, scan_directory, summarize, write_report
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -8,47 +9,64 @@ parser.add_argument(
     required=True,
     help="Exact data directory passed from bash"
 )
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=DEFAULT_WORKERS,
+    help="Number of threads inspecting files in parallel"
+)
+parser.add_argument(
+    "--report",
+    default=None,
+    help="Optional JSONL report path (one record per parquet file)"
+)
 
 args = parser.parse_args()
 
 target_folder = args.data_dir
 
-def scan_parquet_files(directory):
+TAIL_SIZE = 2000
+SNIPPET_PATTERN = re.compile(r'[a-zA-Z0-9_{}-]{5,}')
+
+
+def find_flag_snippets(buf, size):
+    # Only the tail is touched; the rest of the mapping is never paged in
+    read_size = min(size, TAIL_SIZE)
+    decoded = buf[size - read_size:size].decode('latin-1')
+
+    found_snippets = SNIPPET_PATTERN.findall(decoded)
+
+    return {"flags": [s for s in found_snippets if "CTF" in s or "flag" in s or "{" in s]}
+
+
+def scan_parquet_files(directory, workers=DEFAULT_WORKERS, report_path=None):
     print(f"Starting scan in: {directory}\n")
-    
-    files_found = 0
-    for root, dirs, files in os.walk(directory):
-        for filename in files:
-            if filename.endswith(".parquet"):
-                files_found += 1
-                full_path = os.path.join(root, filename)
-                
-                try:
-                    with open(full_path, 'rb') as f:
-                        file_size = os.path.getsize(full_path)
-
-                        read_size = min(file_size, 2000)
-                        f.seek(-read_size, os.SEEK_END)
-                        tail_data = f.read()
-                        
-                        decoded = tail_data.decode('latin-1')
-                        
-                        found_snippets = re.findall(r'[a-zA-Z0-9_{}-]{5,}', decoded)
-                        
-                        interesting_hits = [s for s in found_snippets if "CTF" in s or "flag" in s or "{" in s]
-                        
-                        if interesting_hits:
-                            print(f"\n[+] SUSPICIOUS FILE FOUND: {filename}")
-                            print(f"    Path: {full_path}")
-                            print("    Potential Flags:")
-                            for hit in interesting_hits:
-                                print(f"    -> {hit}")
-                            print("-" * 40)
-                            
-                except Exception as e:
-                    print(f"Error reading {filename}: {e}")
-
-    print(f"\nScan complete. Checked {files_found} parquet files.")
+
+    results = scan_directory(directory, workers=workers, extra=find_flag_snippets)
+
+    for record in results:
+        filename = os.path.basename(record["path"])
+
+        if record["reasons"] and record["reasons"][0].startswith("unreadable"):
+            print(f"Error reading {filename}: {record['reasons'][0]}")
+            continue
+
+        interesting_hits = record.get("flags", [])
+        if interesting_hits:
+            print(f"\n[+] SUSPICIOUS FILE FOUND: {filename}")
+            print(f"    Path: {record['path']}")
+            print("    Potential Flags:")
+            for hit in interesting_hits:
+                print(f"    -> {hit}")
+            print("-" * 40)
+
+    if report_path:
+        write_report(results, report_path)
+        print(f"\nReport written to: {report_path}")
+
+    counts = summarize(results)
+    print(f"\nScan complete. Checked {len(results)} parquet files. "
+          f"Healthy: {counts['healthy']}, Suspicious: {counts['suspicious']}, Corrupted: {counts['corrupted']}.")
 
 if __name__ == "__main__":
-    scan_parquet_files(target_folder)
\ No newline at end of file
+    scan_parquet_files(target_folder, workers=args.workers, report_path=args.report)
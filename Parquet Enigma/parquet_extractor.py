@@ -1,9 +1,17 @@
 import pandas as pd
-import struct
+import pyarrow as pa
+import pyarrow.parquet as pq
 import io
 import os
-import re
+import mmap
+import json
+import sys
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+from pipeline_metrics import stage, emit_summary
+from parquet_footer import find_footer_candidates, patch_footer
+from parquet_scan import DEFAULT_WORKERS, HEALTHY, scan_directory, summarize, write_report
 
 parser = argparse.ArgumentParser()
 parser.add_argument(
@@ -11,6 +19,27 @@ parser.add_argument(
     required=True,
     help="Exact data directory passed from bash"
 )
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=DEFAULT_WORKERS,
+    help="Number of threads used for the health scan"
+)
+parser.add_argument(
+    "--report",
+    default=None,
+    help="JSONL scan report path (default: processed_data/parquet_scan_report.jsonl)"
+)
+parser.add_argument(
+    "--all",
+    action="store_true",
+    help="Also pass healthy files through the repair path (re-export them as *_reconstructed.parquet)"
+)
+parser.add_argument(
+    "--salvage",
+    action="store_true",
+    help="If a footer is found but the full read fails, recover every row group/column chunk that still decodes"
+)
 
 args = parser.parse_args()
 target_folder = args.data_dir
@@ -20,13 +49,17 @@ PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 BASE_OUTPUT_DIR = os.path.join(PROJECT_ROOT, "processed_data")
 os.makedirs(BASE_OUTPUT_DIR, exist_ok=True)
 
+def reconstructed_name(original_path):
+    base_name = os.path.splitext(os.path.basename(original_path))[0]
+    return os.path.join(BASE_OUTPUT_DIR,f"{base_name}_reconstructed.parquet")
+
+
 def try_load_parquet(file_bytes, original_path, fix_type):
     try:
         virtual_file = io.BytesIO(file_bytes)
         df = pd.read_parquet(virtual_file)
 
-        base_name = os.path.splitext(os.path.basename(original_path))[0]
-        out_name = os.path.join(BASE_OUTPUT_DIR,f"{base_name}_reconstructed.parquet")
+        out_name = reconstructed_name(original_path)
 
         df.to_parquet(out_name, index=False)
 
@@ -36,6 +69,80 @@ def try_load_parquet(file_bytes, original_path, fix_type):
         return False
 
 
+def salvage_parquet(file_bytes, original_path, fix_type):
+    """Reads each row group and column chunk on its own, keeps whatever decodes and
+    writes the lost row ranges to a *_reconstructed.lost.json sidecar."""
+    try:
+        parquet_file = pq.ParquetFile(io.BytesIO(file_bytes))
+    except Exception:
+        return False
+
+    schema = parquet_file.schema_arrow
+    metadata = parquet_file.metadata
+
+    tables = []
+    lost = []
+    row_start = 0
+
+    for rg in range(metadata.num_row_groups):
+        num_rows = metadata.row_group(rg).num_rows
+        row_end = row_start + num_rows
+
+        arrays = []
+        bad_columns = []
+        for field in schema:
+            try:
+                column = parquet_file.read_row_group(rg, columns=[field.name]).column(0)
+                if len(column) != num_rows:
+                    raise ValueError("row count mismatch")
+                arrays.append(column)
+            except Exception:
+                # Keep the rest of the row group; this chunk becomes nulls
+                arrays.append(pa.nulls(num_rows, type=field.type))
+                bad_columns.append(field.name)
+
+        if len(bad_columns) == len(schema):
+            lost.append({"row_group": rg, "row_start": row_start, "row_end": row_end, "columns": "all"})
+        else:
+            if bad_columns:
+                lost.append({"row_group": rg, "row_start": row_start, "row_end": row_end, "columns": bad_columns})
+            tables.append(pa.Table.from_arrays(arrays, schema=schema))
+
+        row_start = row_end
+
+    if not tables:
+        return False
+
+    recovered = pa.concat_tables(tables)
+    out_name = reconstructed_name(original_path)
+    pq.write_table(recovered, out_name)
+
+    sidecar = os.path.splitext(out_name)[0] + ".lost.json"
+    with open(sidecar, 'w') as f:
+        json.dump({
+            "source": os.path.basename(original_path),
+            "strategy": fix_type,
+            "total_rows": metadata.num_rows,
+            "recovered_rows": recovered.num_rows,
+            "lost": lost,
+        }, f, indent=2)
+
+    print(f"    [+] PARTIAL ({fix_type})! Salvaged {recovered.num_rows}/{metadata.num_rows} rows; "
+          f"{len(lost)} damaged row groups listed in {os.path.basename(sidecar)}")
+    return True
+
+
+def decodes_fully(file_path):
+    """Decodes every row group, one at a time. The footer scan cannot see a bad data page behind an intact footer."""
+    try:
+        parquet_file = pq.ParquetFile(file_path)
+        for rg in range(parquet_file.metadata.num_row_groups):
+            parquet_file.read_row_group(rg)
+        return True
+    except Exception:
+        return False
+
+
 def repair_file(file_path):
     filename = os.path.basename(file_path)
     print(f"[*] Analyzing: {filename}...")
@@ -43,29 +150,20 @@ def repair_file(file_path):
     if "_reconstructed" in filename:
         return
 
-    with open(file_path, 'rb') as f:
-        raw_data = bytearray(f.read())
+    if os.path.getsize(file_path) == 0:
+        print("    [-] File could not be repaired.")
+        return
 
-    # Attempt 1: Trim garbage after PAR1
-    par1_locations = [m.start() for m in re.finditer(b'PAR1', raw_data)]
+    with open(file_path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as raw_data:
+        # Footer-first: decode the Thrift FileMetaData directly and only hand validated candidates to pandas
+        for candidate in find_footer_candidates(raw_data):
+            print(f"    [.] Valid footer candidate: {candidate.footer_length} bytes at offset {candidate.footer_start} ({candidate.strategy})")
 
-    for loc in par1_locations:
-        cut_point = loc + 4
-        if cut_point < len(raw_data):
-            trimmed_data = raw_data[:cut_point]
-            if try_load_parquet(trimmed_data, file_path, "Garbage Trimmed"):
+            patched = patch_footer(raw_data, candidate)
+            if try_load_parquet(patched, file_path, candidate.strategy):
                 return
 
-    # Attempt 2: Bruteforce metadata size
-    file_size = len(raw_data)
-
-    if raw_data[-4:] == b'PAR1':
-        print("    [.] File ends in PAR1. Attempting metadata size recovery...")
-
-        for candidate_length in range(1, file_size - 8):
-            struct.pack_into('<I', raw_data, file_size - 8, candidate_length)
-
-            if try_load_parquet(raw_data, file_path, f"Metadata Size Fixed: {candidate_length}"):
+            if args.salvage and salvage_parquet(patched, file_path, candidate.strategy):
                 return
 
     print("    [-] File could not be repaired.")
@@ -76,10 +174,40 @@ def main():
         print(f"Error: Folder not found: {target_folder}")
         return
 
-    for root, _, files in os.walk(target_folder):
-        for file in files:
-            if file.endswith(".parquet"):
-                repair_file(os.path.join(root, file))
+    # O(1)-per-file health scan first; only flagged files pay for the repair path
+    with stage("parquet_scan", workers=args.workers, unit="files") as st:
+        results = scan_directory(target_folder, workers=args.workers, skip_reconstructed=True)
+        st.rows = len(results)
+        st.bytes = sum(record["size"] or 0 for record in results)
+
+    report_path = args.report or os.path.join(BASE_OUTPUT_DIR, "parquet_scan_report.jsonl")
+    write_report(results, report_path)
+
+    counts = summarize(results)
+    print(f"[*] Scanned {len(results)} parquet files. Healthy: {counts['healthy']}, "
+          f"Suspicious: {counts['suspicious']}, Corrupted: {counts['corrupted']}. Report: {report_path}")
+
+    to_repair = {record["path"] for record in results if record["status"] != HEALTHY or args.all}
+
+    if args.salvage and not args.all:
+        # Healthy footers can still hide damaged pages; only a real decode finds those for salvage
+        healthy = [record["path"] for record in results if record["status"] == HEALTHY]
+        with stage("parquet_decode_check", workers=args.workers, unit="files") as st:
+            with ThreadPoolExecutor(max_workers=args.workers) as pool:
+                damaged = [path for path, ok in zip(healthy, pool.map(decodes_fully, healthy)) if not ok]
+            st.rows = len(healthy)
+        for path in damaged:
+            print(f"[!] {os.path.basename(path)}: footer is healthy but data pages fail to decode")
+        to_repair.update(damaged)
+
+    with stage("parquet_repair", unit="files") as st:
+        for record in results:
+            if record["path"] in to_repair:
+                repair_file(record["path"])
+                st.rows += 1
+                st.bytes += record["size"] or 0
+
+    emit_summary()
 
 
 if __name__ == "__main__":
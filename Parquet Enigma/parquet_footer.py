@@ -0,0 +1,316 @@
+import struct
+from collections import namedtuple
+
+MAGIC = b'PAR1'
+
+# Compact Thrift type ids
+CT_STOP = 0
+CT_TRUE = 1
+CT_FALSE = 2
+CT_BYTE = 3
+CT_I16 = 4
+CT_I32 = 5
+CT_I64 = 6
+CT_DOUBLE = 7
+CT_BINARY = 8
+CT_LIST = 9
+CT_SET = 10
+CT_MAP = 11
+CT_STRUCT = 12
+
+# Every writer emits FileMetaData.version (field 1, i32) first -> header byte 0x15,
+# then the schema (field 2, list<SchemaElement>) -> header byte 0x19
+FILE_METADATA_FIRST_BYTE = 0x15
+FILE_METADATA_SCHEMA_BYTE = 0x19
+# Format versions writers put in FileMetaData.version
+FILE_METADATA_VERSIONS = (1, 2)
+# The length scan looks at most this far back from the footer end; real footers are far smaller
+MAX_FOOTER_SIZE = 16 * 1024 * 1024
+
+# Guards so that parsing random bytes fails fast instead of allocating huge containers
+MAX_NESTING = 16
+MAX_CONTAINER_SIZE = 10_000_000
+
+FooterCandidate = namedtuple('FooterCandidate', ['strategy', 'end', 'footer_start', 'footer_length', 'metadata'])
+
+
+class ThriftError(ValueError):
+    pass
+
+
+class CompactReader:
+    """Minimal compact-protocol Thrift decoder. Structs decode to {field_id: value} dicts."""
+
+    def __init__(self, buf, pos, end):
+        self.buf = buf
+        self.pos = pos
+        self.end = end
+
+    def byte(self):
+        if self.pos >= self.end:
+            raise ThriftError("unexpected end of footer")
+        b = self.buf[self.pos]
+        self.pos += 1
+        return b
+
+    def varint(self):
+        result = 0
+        shift = 0
+        while True:
+            b = self.byte()
+            result |= (b & 0x7F) << shift
+            if not b & 0x80:
+                return result
+            shift += 7
+            if shift > 63:
+                raise ThriftError("varint too long")
+
+    def zigzag(self):
+        n = self.varint()
+        return (n >> 1) ^ -(n & 1)
+
+    def binary(self):
+        length = self.varint()
+        if self.pos + length > self.end:
+            raise ThriftError("binary runs past end of footer")
+        value = bytes(self.buf[self.pos:self.pos + length])
+        self.pos += length
+        return value
+
+    def value(self, ctype, depth):
+        if ctype == CT_TRUE:
+            return True
+        if ctype == CT_FALSE:
+            return False
+        if ctype == CT_BYTE:
+            return self.byte()
+        if ctype in (CT_I16, CT_I32, CT_I64):
+            return self.zigzag()
+        if ctype == CT_DOUBLE:
+            if self.pos + 8 > self.end:
+                raise ThriftError("double runs past end of footer")
+            value = struct.unpack_from('<d', self.buf, self.pos)[0]
+            self.pos += 8
+            return value
+        if ctype == CT_BINARY:
+            return self.binary()
+        if ctype in (CT_LIST, CT_SET):
+            return self.list(depth + 1)
+        if ctype == CT_MAP:
+            return self.map(depth + 1)
+        if ctype == CT_STRUCT:
+            return self.struct(depth + 1)
+        raise ThriftError(f"invalid type id {ctype}")
+
+    def list(self, depth):
+        header = self.byte()
+        size = header >> 4
+        elem_type = header & 0x0F
+        if size == 15:
+            size = self.varint()
+        if size > MAX_CONTAINER_SIZE or size > self.end - self.pos:
+            raise ThriftError("list size out of range")
+        if elem_type in (CT_TRUE, CT_FALSE):
+            # Booleans inside containers are one byte each
+            return [self.byte() == CT_TRUE for _ in range(size)]
+        return [self.value(elem_type, depth) for _ in range(size)]
+
+    def map(self, depth):
+        size = self.varint()
+        if size == 0:
+            return {}
+        if size > MAX_CONTAINER_SIZE or size > self.end - self.pos:
+            raise ThriftError("map size out of range")
+        types = self.byte()
+        key_type, val_type = types >> 4, types & 0x0F
+        return {self.value(key_type, depth): self.value(val_type, depth) for _ in range(size)}
+
+    def struct(self, depth=0):
+        if depth > MAX_NESTING:
+            raise ThriftError("struct nesting too deep")
+        fields = {}
+        last_id = 0
+        while True:
+            header = self.byte()
+            if header == CT_STOP:
+                return fields
+            delta = header >> 4
+            ctype = header & 0x0F
+            field_id = last_id + delta if delta else self.zigzag()
+            if field_id <= 0:
+                raise ThriftError("invalid field id")
+            fields[field_id] = self.value(ctype, depth)
+            last_id = field_id
+
+
+def parse_file_metadata(buf, start, end):
+    """Decodes a FileMetaData struct that must occupy exactly buf[start:end]."""
+    reader = CompactReader(buf, start, end)
+    metadata = reader.struct()
+    if reader.pos != end:
+        raise ThriftError("footer does not end where the length field says")
+    return metadata
+
+
+def validate_file_metadata(metadata, footer_start):
+    """Cheap structural checks (required fields, row counts, column chunk offsets in range) before a real read."""
+    # FileMetaData: 1 version, 2 schema, 3 num_rows, 4 row_groups
+    if not all(field in metadata for field in (1, 2, 3, 4)):
+        return False
+
+    schema, num_rows, row_groups = metadata[2], metadata[3], metadata[4]
+    if not isinstance(schema, list) or not schema or not isinstance(row_groups, list) or num_rows < 0:
+        return False
+
+    # SchemaElement field 5 is num_children; elements without it (other than the root) are leaf columns
+    if not all(isinstance(element, dict) for element in schema):
+        return False
+    leaf_count = sum(1 for element in schema[1:] if 5 not in element)
+
+    total_rows = 0
+    for row_group in row_groups:
+        # RowGroup: 1 columns, 3 num_rows
+        if not isinstance(row_group, dict) or 1 not in row_group or 3 not in row_group:
+            return False
+        columns = row_group[1]
+        if not isinstance(columns, list) or len(columns) != leaf_count:
+            return False
+        total_rows += row_group[3]
+
+        for chunk in columns:
+            # ColumnChunk.meta_data (3) -> ColumnMetaData: 7 total_compressed_size, 9 data_page_offset, 11 dictionary_page_offset
+            meta = chunk.get(3) if isinstance(chunk, dict) else None
+            if not isinstance(meta, dict) or 9 not in meta or 7 not in meta:
+                return False
+            data_offset = meta[9]
+            first_offset = meta.get(11) or data_offset
+            first_offset = min(first_offset, data_offset)
+            if first_offset < len(MAGIC) or data_offset >= footer_start:
+                return False
+            if meta[7] < 0 or first_offset + meta[7] > footer_start:
+                return False
+
+    return total_rows == num_rows
+
+
+def _check_footer(buf, end, footer_length):
+    """Returns parsed metadata if a footer of footer_length bytes ending at end - 8 is valid, else None."""
+    footer_end = end - 8
+    footer_start = footer_end - footer_length
+    if footer_length <= 0 or footer_start < len(MAGIC):
+        return None
+    try:
+        metadata = parse_file_metadata(buf, footer_start, footer_end)
+        valid = validate_file_metadata(metadata, footer_start)
+    except (ThriftError, TypeError, AttributeError):
+        # Garbage that happens to decode can still hold the wrong value types
+        return None
+    return metadata if valid else None
+
+
+def _looks_like_footer_start(buf, pos, footer_end):
+    """Cheap test of the first FileMetaData fields at pos: a known version, then a non-empty schema list
+    of structs. Rejects nearly every stray 0x15 in page data before a full parse is attempted."""
+    reader = CompactReader(buf, pos + 1, footer_end)
+    try:
+        if reader.zigzag() not in FILE_METADATA_VERSIONS or reader.byte() != FILE_METADATA_SCHEMA_BYTE:
+            return False
+        header = reader.byte()
+        size = header >> 4
+        if size == 15:
+            size = reader.varint()
+    except ThriftError:
+        return False
+    return header & 0x0F == CT_STRUCT and 0 < size <= MAX_CONTAINER_SIZE
+
+
+def _data_pages_end(buf, footer_end):
+    """End of the chain of page headers + page data starting right after the leading magic.
+
+    Column chunks are written back to back, so an intact chain ends where the footer (or the page index)
+    begins; a damaged page ends it earlier. Either way no FileMetaData can start before it."""
+    pos = len(MAGIC)
+    while pos < footer_end:
+        reader = CompactReader(buf, pos, footer_end)
+        try:
+            # PageHeader: 1 type, 2 uncompressed_page_size, 3 compressed_page_size
+            header = reader.struct()
+        except ThriftError:
+            return pos
+        page_type, compressed_size = header.get(1), header.get(3)
+        if not isinstance(page_type, int) or not 0 <= page_type <= 3 or not isinstance(compressed_size, int) \
+                or compressed_size < 0 or not isinstance(header.get(2), int) or reader.pos + compressed_size > footer_end:
+            return pos
+        pos = reader.pos + compressed_size
+    return pos
+
+
+def _scan_footer_start(buf, end):
+    """Walks backward from the footer end looking for where a valid FileMetaData begins.
+
+    The walk stays within MAX_FOOTER_SIZE of the end and above the last data page, and fully parses only
+    positions whose first fields look like a FileMetaData, so a file without a recoverable footer fails fast."""
+    footer_end = end - 8
+    # The FileMetaData struct always closes with a STOP byte
+    if footer_end <= len(MAGIC) or buf[footer_end - 1] != CT_STOP:
+        return None
+
+    floor = max(len(MAGIC), footer_end - MAX_FOOTER_SIZE, _data_pages_end(buf, footer_end))
+    pos = footer_end
+    while True:
+        pos = buf.rfind(bytes([FILE_METADATA_FIRST_BYTE]), floor, pos)
+        if pos < 0:
+            return None
+        if not _looks_like_footer_start(buf, pos, footer_end):
+            continue
+        metadata = _check_footer(buf, end, footer_end - pos)
+        if metadata is not None:
+            return pos, metadata
+
+
+def _cut_points(buf):
+    """Candidate file ends, last first: the real end if it is PAR1, then every earlier PAR1 trailer."""
+    cuts = []
+    pos = len(buf)
+    while True:
+        loc = buf.rfind(MAGIC, len(MAGIC), pos)
+        if loc < 0:
+            return cuts
+        cuts.append(loc + len(MAGIC))
+        pos = loc + len(MAGIC) - 1
+
+
+def find_footer_candidates(buf):
+    """Yields validated FooterCandidates, cheapest strategy first."""
+    file_size = len(buf)
+    cuts = _cut_points(buf)
+    seen = set()
+
+    # Strategy 1/2: trust the stored length field, at the real end or after trimming trailing garbage
+    for end in cuts:
+        footer_length = struct.unpack_from('<I', buf, end - 8)[0]
+        metadata = _check_footer(buf, end, footer_length)
+        if metadata is not None:
+            strategy = "Intact Footer" if end == file_size else "Garbage Trimmed"
+            seen.add((end, footer_length))
+            yield FooterCandidate(strategy, end, end - 8 - footer_length, footer_length, metadata)
+
+    # Strategy 3: the length field is corrupt -> recover it from where the Thrift footer actually starts
+    for end in cuts:
+        found = _scan_footer_start(buf, end)
+        if found is not None:
+            footer_start, metadata = found
+            footer_length = end - 8 - footer_start
+            if (end, footer_length) in seen:
+                continue
+            strategy = f"Metadata Size Fixed: {footer_length}"
+            if end != file_size:
+                strategy = f"Garbage Trimmed + {strategy}"
+            yield FooterCandidate(strategy, end, footer_start, footer_length, metadata)
+
+
+def patch_footer(buf, candidate):
+    """Returns the file bytes cut at the candidate end with the footer length field rewritten."""
+    patched = bytearray(buf[:candidate.end])
+    struct.pack_into('<I', patched, candidate.end - 8, candidate.footer_length)
+    return patched
@@ -0,0 +1,101 @@
+import os
+import mmap
+import json
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+MAGIC = b'PAR1'
+# Header magic + footer length field + trailer magic
+MIN_PARQUET_SIZE = 12
+# First byte of a compact-Thrift FileMetaData (version field) and its closing STOP byte
+FOOTER_FIRST_BYTE = 0x15
+FOOTER_STOP_BYTE = 0x00
+
+DEFAULT_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+
+HEALTHY = "healthy"
+SUSPICIOUS = "suspicious"
+CORRUPTED = "corrupted"
+
+
+def iter_parquet_files(directory):
+    for root, _, files in os.walk(directory):
+        for filename in files:
+            if filename.endswith(".parquet"):
+                yield os.path.join(root, filename)
+
+
+def classify_parquet(buf, size):
+    """O(1) structural check of the magic bytes and footer length. Returns (status, reasons, footer_length)."""
+    if size < MIN_PARQUET_SIZE:
+        return CORRUPTED, ["file too small"], None
+
+    reasons = []
+    if buf[:4] != MAGIC:
+        reasons.append("missing header magic")
+    if buf[size - 4:size] != MAGIC:
+        reasons.append("missing trailer magic (truncated or trailing garbage)")
+        return CORRUPTED, reasons, None
+
+    footer_length = struct.unpack_from('<I', buf, size - 8)[0]
+    footer_start = size - 8 - footer_length
+    if footer_length == 0 or footer_start < len(MAGIC):
+        reasons.append(f"footer length {footer_length} out of range")
+        return CORRUPTED, reasons, footer_length
+
+    if reasons:
+        return CORRUPTED, reasons, footer_length
+
+    # Length is in range, but does it point at something that looks like a Thrift footer?
+    if buf[footer_start] != FOOTER_FIRST_BYTE or buf[size - 9] != FOOTER_STOP_BYTE:
+        return SUSPICIOUS, ["footer length does not point at a FileMetaData struct"], footer_length
+
+    return HEALTHY, [], footer_length
+
+
+def inspect_parquet(path, extra=None):
+    """Memory-maps one file and classifies it. `extra(buf, size)` may add fields to the record."""
+    record = {"path": path, "size": None, "status": CORRUPTED, "reasons": [], "footer_length": None}
+
+    try:
+        size = os.path.getsize(path)
+        record["size"] = size
+        if size == 0:
+            record["reasons"] = ["empty file"]
+            return record
+
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            status, reasons, footer_length = classify_parquet(buf, size)
+            record.update(status=status, reasons=reasons, footer_length=footer_length)
+            if extra is not None:
+                record.update(extra(buf, size))
+
+    except (OSError, ValueError) as e:
+        record["reasons"] = [f"unreadable: {e}"]
+
+    return record
+
+
+def scan_directory(directory, workers=DEFAULT_WORKERS, extra=None, skip_reconstructed=False):
+    """Inspects every .parquet under directory on a thread pool. Results come back in walk order."""
+    paths = [
+        path for path in iter_parquet_files(directory)
+        if not (skip_reconstructed and "_reconstructed" in os.path.basename(path))
+    ]
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return list(pool.map(lambda path: inspect_parquet(path, extra), paths))
+
+
+def write_report(results, report_path):
+    os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+    with open(report_path, 'w') as f:
+        for record in results:
+            f.write(json.dumps(record) + "\n")
+
+
+def summarize(results):
+    counts = {HEALTHY: 0, SUSPICIOUS: 0, CORRUPTED: 0}
+    for record in results:
+        counts[record["status"]] += 1
+    return counts
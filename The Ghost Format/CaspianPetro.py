@@ -1,62 +1,193 @@
 import os
+import sys
+import mmap
 import struct
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import hashlib
+import json
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")))
+from pipeline_metrics import stage, emit_summary
+
+HEADER_SIZE = 16
+
+# Spec: WellID(4), Depth(4), Amp(4), Quality(1) -> packed little endian, 13 bytes
+TRACE_DTYPE = np.dtype([
+    ('well_id', '<u4'),
+    ('depth', '<f4'),
+    ('amplitude', '<f4'),
+    ('quality_flag', 'u1'),
+])
+
+# Rows per Parquet row group (and per decode batch) in streaming mode
+DEFAULT_ROW_GROUP_SIZE = 1_000_000
+
+# Incremental runs: per-source fingerprints are kept next to the reconstructed outputs
+MANIFEST_NAME = "sgx_manifest.json"
+FINGERPRINT_BLOCK = 64 * 1024
+
+# Same column types to_dataframe produces, so streamed and in-memory outputs are interchangeable
+RECONSTRUCTED_SCHEMA = pa.schema([
+    ('survey_id', pa.int64()),
+    ('well_id', pa.int64()),
+    ('depth', pa.float64()),
+    ('amplitude', pa.float64()),
+    ('quality_flag', pa.int64()),
+    ('ingest_source', pa.string()),
+    ('ingest_timestamp', pa.string()),
+])
+
+# Output profiles for reconstructed files. "standard" is the schema above (what every reader has always seen).
+# "compact" keeps the SGX-native widths (uint32 well, float32 depth/amplitude are exact; uint8 flag) and stores the
+# per-file constants as dictionaries, so neither the DataFrame nor the file repeats them per row.
+PROFILES = ["standard", "compact"]
+COMPACT_SCHEMA = pa.schema([
+    ('survey_id', pa.dictionary(pa.int32(), pa.int64())),
+    ('well_id', pa.uint32()),
+    ('depth', pa.float32()),
+    ('amplitude', pa.float32()),
+    ('quality_flag', pa.uint8()),
+    ('ingest_source', pa.dictionary(pa.int32(), pa.string())),
+    ('ingest_timestamp', pa.dictionary(pa.int32(), pa.string())),
+])
+COMPACT_DICTIONARY_COLUMNS = ['survey_id', 'well_id', 'quality_flag', 'ingest_source', 'ingest_timestamp']
+# Byte-stream-split groups the float bytes by significance, which zstd then packs far better than plain
+# (Parquet's delta encodings are integer-only, so this is also what sorted float depths get)
+COMPACT_FLOAT_ENCODING = {'depth': 'BYTE_STREAM_SPLIT', 'amplitude': 'BYTE_STREAM_SPLIT'}
+DEFAULT_COMPACT_CODEC = "zstd"
+DEFAULT_COMPACT_LEVEL = 3
+
+
+def output_schema(profile="standard"):
+    return COMPACT_SCHEMA if profile == "compact" else RECONSTRUCTED_SCHEMA
+
+
+def parquet_options(profile="standard", compression=None, compression_level=None):
+    """pyarrow writer options for a profile; compression/level override the profile's codec."""
+    if profile == "compact":
+        return {
+            'compression': compression or DEFAULT_COMPACT_CODEC,
+            'compression_level': compression_level if compression_level is not None
+                                 else (DEFAULT_COMPACT_LEVEL if (compression or DEFAULT_COMPACT_CODEC) == "zstd" else None),
+            'use_dictionary': COMPACT_DICTIONARY_COLUMNS,
+            'column_encoding': COMPACT_FLOAT_ENCODING,
+        }
+    options = {}
+    if compression:
+        options['compression'] = compression
+    if compression_level is not None:
+        options['compression_level'] = compression_level
+    return options
+
+
+def to_standard(table):
+    """Casts a reconstructed table of either profile to the standard column types (columns it has)."""
+    fields = [RECONSTRUCTED_SCHEMA.field(name) if name in RECONSTRUCTED_SCHEMA.names else table.schema.field(name)
+              for name in table.column_names]
+    return table.cast(pa.schema(fields)) if table.schema != pa.schema(fields) else table
 
 class CaspianSGX:
     def __init__(self, file_path):
         self.file_path = file_path
         self.filename = os.path.basename(file_path)
         self.header = {}
-        self.traces = []
+        self.traces = None
         self.raw_head = None
+        self._mmap = None
 
-    def read(self):
+    def read_header(self):
+        """Parses only the 16-byte header; cheap enough to call on every file during discovery."""
         file_size = os.path.getsize(self.file_path)
-        
+
         with open(self.file_path, 'rb') as f:
             # Spec: Magic(8s), SurveyID(I), TraceCount(I)
-            self.raw_head = f.read(16)
-            
-            if len(self.raw_head) < 16:
-                return False
-
-            magic, survey_id, trace_count = struct.unpack('<8sII', self.raw_head)
-            
-            if magic != b'CPETRO01':
-                return False
-
-            self.header = {
-                'survey_id': survey_id,
-                'trace_count': trace_count,
-                'file_size': file_size
-            }
+            self.raw_head = f.read(HEADER_SIZE)
+
+        if len(self.raw_head) < HEADER_SIZE:
+            return False
+
+        magic, survey_id, trace_count = struct.unpack('<8sII', self.raw_head)
+
+        if magic != b'CPETRO01':
+            return False
+
+        self.header = {
+            'survey_id': survey_id,
+            'trace_count': trace_count,
+            'file_size': file_size
+        }
+        return True
+
+    def read(self):
+        if not self.read_header():
+            return False
+
+        file_size = self.header['file_size']
+        trace_count = self.header['trace_count']
+
+        # Truncated tail: only decode the records that are fully present on disk
+        available = (file_size - HEADER_SIZE) // TRACE_DTYPE.itemsize
+        n_traces = min(trace_count, available)
 
-            # Spec: WellID(4), Depth(4), Amp(4), Quality(1)
-            for _ in range(trace_count):
-                record_bytes = f.read(13)
-                if len(record_bytes) != 13: break
-                
-                # Unpack Little Endian (<)
-                well_id, depth, amp, qual = struct.unpack('<IffB', record_bytes)
-                
-                self.traces.append({
-                    'survey_id': survey_id, # Link to header
-                    'well_id': well_id,
-                    'depth': depth,
-                    'amplitude': amp,
-                    'quality_flag': qual
-                })
-            
+        if n_traces == 0:
+            self.traces = np.empty(0, dtype=TRACE_DTYPE)
             return True
 
-    def to_dataframe(self):
-        if not self.traces:
+        # Map the file once and view the trace region as a packed record array (no per-record Python work)
+        with open(self.file_path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.traces = np.frombuffer(self._mmap, dtype=TRACE_DTYPE, count=n_traces, offset=HEADER_SIZE)
+
+        return True
+
+    def close(self):
+        self.traces = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                # A caller still holds a view of the mapping; it is released with that view
+                pass
+            self._mmap = None
+
+    def _columns(self, traces, profile="standard"):
+        # One contiguous gather per column straight out of the mapping.
+        if profile == "compact":
+            # Native record widths; survey_id is added by the caller as a dictionary column
+            return {
+                'well_id': traces['well_id'].copy(),
+                'depth': traces['depth'].copy(),
+                'amplitude': traces['amplitude'].copy(),
+                'quality_flag': traces['quality_flag'].copy(),
+            }
+        # Dtypes match the old struct.unpack output (int64/float64) so downstream hashes stay identical.
+        return {
+            'survey_id': np.full(len(traces), self.header['survey_id'], dtype=np.int64), # Link to header
+            'well_id': traces['well_id'].astype(np.int64),
+            'depth': traces['depth'].astype(np.float64),
+            'amplitude': traces['amplitude'].astype(np.float64),
+            'quality_flag': traces['quality_flag'].astype(np.int64),
+        }
+
+    def to_dataframe(self, profile="standard"):
+        if self.traces is None or len(self.traces) == 0:
             return pd.DataFrame()
 
-        # Convert list of dicts directly to DataFrame
-        df = pd.DataFrame(self.traces)
+        if profile == "compact":
+            # Constants become one-category columns: a code per row instead of an object per row
+            constant = lambda value: pd.Categorical.from_codes(np.zeros(len(self.traces), dtype=np.int8), [value])
+            df = pd.DataFrame({'survey_id': constant(self.header['survey_id'])})
+            for col, values in self._columns(self.traces, profile).items():
+                df[col] = values
+            df['ingest_source'] = constant(self.filename)
+            df['ingest_timestamp'] = constant(datetime.now().isoformat())
+            return df
+
+        df = pd.DataFrame(self._columns(self.traces), copy=False)
         
         # Add Provenance Metadata (Required for Ep2 Vault)
         df['ingest_source'] = self.filename
@@ -64,7 +195,169 @@ class CaspianSGX:
         
         return df
 
-def main(target_dir):
+    def iter_batches(self, batch_size=DEFAULT_ROW_GROUP_SIZE, profile="standard"):
+        """Yields Arrow record batches of at most batch_size traces; only one batch is materialized at a time."""
+        if self.traces is None:
+            return
+
+        ingest_timestamp = datetime.now().isoformat()
+        schema = output_schema(profile)
+
+        def constant(value, field, n):
+            if profile == "compact":
+                indices = pa.array(np.zeros(n, dtype=np.int32))
+                return pa.DictionaryArray.from_arrays(indices, pa.array([value], field.type.value_type))
+            return pa.repeat(pa.scalar(value, field.type), n)
+
+        for start in range(0, len(self.traces), batch_size):
+            chunk = self.traces[start:start + batch_size]
+            columns = self._columns(chunk, profile)
+            if profile == "compact":
+                columns = {'survey_id': constant(self.header['survey_id'], schema.field('survey_id'), len(chunk)), **columns}
+            arrays = [values if isinstance(values, pa.Array) else pa.array(values) for values in columns.values()]
+            arrays.append(constant(self.filename, schema.field('ingest_source'), len(chunk)))
+            arrays.append(constant(ingest_timestamp, schema.field('ingest_timestamp'), len(chunk)))
+            yield pa.record_batch(arrays, schema=schema)
+
+    def write_parquet(self, out_path, row_group_size=DEFAULT_ROW_GROUP_SIZE, profile="standard",
+                      compression=None, compression_level=None):
+        """Streams the traces into out_path, one row group per batch, with min/max statistics for pruning."""
+        rows = 0
+        options = parquet_options(profile, compression, compression_level)
+        with pq.ParquetWriter(out_path, output_schema(profile), write_statistics=True, **options) as writer:
+            for batch in self.iter_batches(row_group_size, profile):
+                writer.write_batch(batch, row_group_size=row_group_size)
+                rows += batch.num_rows
+        return rows
+
+def reconstructed_path(full_path, output_dir):
+    base_name = os.path.splitext(os.path.basename(full_path))[0]
+    return os.path.join(output_dir, f"{base_name}_reconstructed.parquet")
+
+
+def convert_file(full_path, output_dir, streaming=False, row_group_size=DEFAULT_ROW_GROUP_SIZE,
+                 profile="standard", compression=None, compression_level=None):
+    """Converts one .sgx file. Returns (success, log_lines) so parallel workers never interleave output."""
+    file = os.path.basename(full_path)
+    lines = []
+
+    try:
+        loader = CaspianSGX(full_path)
+        if not loader.read():
+            return False, lines
+
+        lines.append(f"\n--- {file} ---")
+
+        # Print Header Info
+        magic = loader.raw_head[:8].decode()
+        sid = loader.header['survey_id']
+        t_count = loader.header['trace_count']
+
+        lines.append(f"File Signature: {magic},    ID   : Survey {sid}")
+        lines.append(f"  {'Trace Count':<12} : {t_count} records")
+
+        # Print Data Range
+        file_end = loader.header['file_size']
+        lines.append(f" - Data Range: Bytes 16 - {file_end}")
+        lines.append(f" - Structure : 13-byte records (WellID, Depth, Amp, Quality)")
+
+        # Convert & Save
+        out_name = reconstructed_path(full_path, output_dir)
+
+        if streaming:
+            loader.write_parquet(out_name, row_group_size, profile, compression, compression_level)
+        else:
+            df = loader.to_dataframe(profile)
+            df.to_parquet(out_name, index=False, **parquet_options(profile, compression, compression_level))
+
+        loader.close()
+
+        lines.append(f"Converted -> {os.path.basename(out_name)}")
+        return True, lines
+
+    except Exception as e:
+        lines.append(f"Failed {file}: {e}")
+        return False, lines
+
+
+def source_fingerprint(full_path):
+    """Fast content hash: file size + the first block (covers the header) + the last block (covers the tail)."""
+    size = os.path.getsize(full_path)
+    digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+
+    with open(full_path, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BLOCK))
+        if size > FINGERPRINT_BLOCK:
+            f.seek(max(FINGERPRINT_BLOCK, size - FINGERPRINT_BLOCK))
+            digest.update(f.read())
+
+    return digest.hexdigest()
+
+
+def manifest_entry(full_path, output_dir, profile="standard"):
+    stat = os.stat(full_path)
+    return {
+        'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns,
+        'fingerprint': source_fingerprint(full_path),
+        'output': os.path.basename(reconstructed_path(full_path, output_dir)),
+        'profile': profile,
+    }
+
+
+def load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path) as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[!] Ignoring unreadable manifest {manifest_path}: {e}")
+        return {}
+
+
+def save_manifest(manifest, manifest_path):
+    # Write-then-rename so an interrupted run never leaves a half-written manifest
+    tmp_path = manifest_path + ".tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def is_unchanged(full_path, entry, output_dir, profile="standard"):
+    """True when the source matches its manifest entry and its output, in this profile, is still on disk."""
+    if entry is None or not os.path.exists(reconstructed_path(full_path, output_dir)):
+        return False
+    if entry.get('profile', 'standard') != profile:
+        return False
+
+    stat = os.stat(full_path)
+    if stat.st_size != entry['size']:
+        return False
+    if stat.st_mtime_ns == entry['mtime_ns']:
+        return True
+
+    # Touched but possibly identical: fall back to the content fingerprint
+    return source_fingerprint(full_path) == entry['fingerprint']
+
+
+def discover_sgx_files(target_dir):
+    """Lists .sgx files under target_dir, largest first (by the header's file_size) to balance the pool."""
+    found = []
+    for root, dirs, files in os.walk(target_dir):
+        for file in files:
+            if file.endswith(".sgx"):
+                full_path = os.path.join(root, file)
+                loader = CaspianSGX(full_path)
+                size = loader.header['file_size'] if loader.read_header() else 0
+                found.append((size, full_path))
+
+    found.sort(key=lambda item: item[0], reverse=True)
+    return [path for _, path in found]
+
+
+def main(target_dir, streaming=False, row_group_size=DEFAULT_ROW_GROUP_SIZE, workers=1, force=False,
+         profile="standard", compression=None, compression_level=None):
     if not os.path.exists(target_dir):
         print(f"Error: Directory not found at {target_dir}")
         return
@@ -74,46 +367,60 @@ def main(target_dir):
     BASE_OUTPUT_DIR = os.path.join(PROJECT_ROOT, "processed_data")
     os.makedirs(BASE_OUTPUT_DIR, exist_ok=True)
 
-    count = 0
+    manifest_path = os.path.join(BASE_OUTPUT_DIR, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
     success_count = 0
 
     print("Scanning...")
 
-    for root, dirs, files in os.walk(target_dir):
-        for file in files:
-            if file.endswith(".sgx"):
-                count += 1
-                full_path = os.path.join(root, file)
-                
-                try:
-                    loader = CaspianSGX(full_path)
-                    if loader.read():
-                        print(f"\n--- {file} ---")
-                        
-                        # Print Header Info
-                        magic = loader.raw_head[:8].decode()
-                        sid = loader.header['survey_id']
-                        t_count = loader.header['trace_count']
-                        
-                        print(f"File Signature: {magic},    ID   : Survey {sid}") 
-                        print(f"  {'Trace Count':<12} : {t_count} records")
-
-                        # Print Data Range
-                        file_end = loader.header['file_size']
-                        print(f" - Data Range: Bytes 16 - {file_end}")
-                        print(f" - Structure : 13-byte records (WellID, Depth, Amp, Quality)")
-
-                        # Convert & Save
-                        
-                        df = loader.to_dataframe()
-                        base_name = os.path.splitext(os.path.basename(full_path))[0]
-                        out_name = os.path.join(BASE_OUTPUT_DIR,f"{base_name}_reconstructed.parquet")
-                        df.to_parquet(out_name, index=False)
-                        
-                        print(f"Converted -> {os.path.basename(out_name)}")
-                        success_count += 1
-                    
-                except Exception as e:
-                    print(f"Failed {file}: {e}")
-
-    print(f"\nDONE. Found {count} files. Converted {success_count}.")
+    with stage("sgx_discover") as st:
+        sgx_files = discover_sgx_files(target_dir)
+        count = len(sgx_files)
+
+        pending = []
+        for path in sgx_files:
+            key = os.path.abspath(path)
+            if not force and is_unchanged(path, manifest.get(key), BASE_OUTPUT_DIR, profile):
+                # Refresh mtime so a touched-but-identical file is a stat-only check next time
+                if os.stat(path).st_mtime_ns != manifest[key]['mtime_ns']:
+                    manifest[key] = manifest_entry(path, BASE_OUTPUT_DIR, profile)
+            else:
+                pending.append(path)
+        st.rows = count
+
+    skipped_count = count - len(pending)
+    if skipped_count:
+        print(f"[*] Skipping {skipped_count} unchanged files (use --force to reconvert).")
+
+    with stage("sgx_convert", workers=workers, streaming=streaming, profile=profile) as st:
+        st.bytes = sum(os.path.getsize(path) for path in pending)
+
+        def record(path, ok, lines):
+            for line in lines:
+                print(line)
+            if ok:
+                manifest[os.path.abspath(path)] = manifest_entry(path, BASE_OUTPUT_DIR, profile)
+                st.rows += pq.ParquetFile(reconstructed_path(path, BASE_OUTPUT_DIR)).metadata.num_rows
+            return ok
+
+        if workers > 1 and len(pending) > 1:
+            print(f"[*] Converting {len(pending)} files with {workers} workers...")
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(convert_file, path, BASE_OUTPUT_DIR, streaming, row_group_size,
+                                profile, compression, compression_level): path
+                    for path in pending
+                }
+                # Each file's log block is printed whole, in completion order
+                for future in as_completed(futures):
+                    success_count += record(futures[future], *future.result())
+        else:
+            for path in pending:
+                success_count += record(path, *convert_file(path, BASE_OUTPUT_DIR, streaming, row_group_size,
+                                                            profile, compression, compression_level))
+
+    save_manifest(manifest, manifest_path)
+
+    print(f"\nDONE. Found {count} files. Converted {success_count}. Skipped {skipped_count} unchanged.")
+    emit_summary()
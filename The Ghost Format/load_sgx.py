@@ -7,9 +7,50 @@ parser.add_argument(
     required=True,
     help="Exact data directory passed from bash"
 )
+parser.add_argument(
+    "--stream",
+    action="store_true",
+    help="Convert in fixed-size batches with bounded memory instead of loading whole files"
+)
+parser.add_argument(
+    "--row-group-size",
+    type=int,
+    default=CaspianPetro.DEFAULT_ROW_GROUP_SIZE,
+    help="Rows per Parquet row group in streaming mode"
+)
+parser.add_argument(
+    "--workers",
+    type=int,
+    default=1,
+    help="Number of worker processes converting files in parallel"
+)
+parser.add_argument(
+    "--force",
+    action="store_true",
+    help="Reconvert every file even if the manifest says it is unchanged"
+)
+
+parser.add_argument(
+    "--profile",
+    choices=CaspianPetro.PROFILES,
+    default="standard",
+    help="Output schema: standard (int64/float64/strings) or compact (native widths, dictionary provenance, zstd)"
+)
+parser.add_argument(
+    "--compression",
+    default=None,
+    help="Parquet codec (e.g. zstd, snappy, gzip, none); default: snappy, or zstd for --profile compact"
+)
+parser.add_argument(
+    "--compression-level",
+    type=int,
+    default=None,
+    help="Codec level, e.g. 1-22 for zstd"
+)
 
 args = parser.parse_args()
 
 DATA_DIR = args.data_dir
 
-CaspianPetro.main(DATA_DIR)
\ No newline at end of file
+CaspianPetro.main(DATA_DIR, streaming=args.stream, row_group_size=args.row_group_size, workers=args.workers, force=args.force,
+                  profile=args.profile, compression=args.compression, compression_level=args.compression_level)
\ No newline at end of file
@@ -0,0 +1,486 @@
+import os
+import sys
+import mmap
+import glob
+import time
+import hashlib
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from CaspianPetro import (
+    HEADER_SIZE, TRACE_DTYPE, MANIFEST_NAME, CaspianSGX, discover_sgx_files, load_manifest, to_standard,
+)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
+sys.path.insert(0, os.path.join(PROJECT_ROOT, "solutions"))
+from vault_io import vault_table_files
+
+# Depth-window queries for one (survey, well) without scanning whole surveys.
+# The index maps every (survey, well) to the units holding its traces, with their depth range:
+#   sgx           the well's slice of the .sgx positions files: its record numbers in the file, sorted by depth
+#   reconstructed row groups of *_reconstructed.parquet
+#   vault         row groups of raw_vault/sat_seismic_data (keyed by link_survey_well_key)
+# A query reads only the units whose depth range overlaps the window. For .sgx, a binary search on the
+# well's depths finds the window, and only those records are read from the mmap'd file, however the survey
+# interleaves its wells.
+
+PROCESSED_DIR = os.path.join(PROJECT_ROOT, "processed_data")
+INDEX_NAME = "trace_index.parquet"
+# Per-.sgx positions files (<name>.<hash>.depth.npy / .record.npy), next to the index
+POSITIONS_DIR = "trace_positions"
+# Bumped when entries change meaning; an index of another version is rebuilt from scratch
+INDEX_VERSION = "2"
+
+# A query reads from the source with the fewest rows to scan in the window; ties go in this order
+SOURCES = ["sgx", "reconstructed", "vault"]
+TRACE_COLUMNS = ["survey_id", "well_id", "depth", "amplitude", "quality_flag"]
+
+INDEX_SCHEMA = pa.schema([
+    ('source', pa.string()),
+    ('path', pa.string()),
+    ('file_size', pa.int64()),
+    ('file_mtime_ns', pa.int64()),
+    ('survey_id', pa.int64()),
+    ('well_id', pa.int64()),
+    ('link_survey_well_key', pa.string()),
+    ('unit', pa.int64()),          # row group (parquet); 0 for sgx
+    ('row_start', pa.int64()),     # sgx: first position of the well in the positions files
+    ('row_count', pa.int64()),
+    ('byte_offset', pa.int64()),   # sgx: the well's slice of the .record.npy data
+    ('byte_length', pa.int64()),
+    ('depth_min', pa.float64()),
+    ('depth_max', pa.float64()),
+    ('traces', pa.int64()),        # traces of this well inside the unit
+])
+
+
+def _row_group_span(metadata, rg):
+    """(byte_offset, byte_length) of a row group: from its first page over all of its column chunks."""
+    row_group = metadata.row_group(rg)
+    starts = []
+    length = 0
+    for i in range(row_group.num_columns):
+        col = row_group.column(i)
+        offsets = [col.data_page_offset]
+        if col.has_dictionary_page and col.dictionary_page_offset:
+            offsets.append(col.dictionary_page_offset)
+        starts.append(min(offsets))
+        length += col.total_compressed_size
+    return min(starts), length
+
+
+def _file_info(path):
+    stat = os.stat(path)
+    return {"source": None, "path": os.path.abspath(path), "file_size": stat.st_size, "file_mtime_ns": stat.st_mtime_ns}
+
+
+def positions_paths(index_path, sgx_path):
+    """(depth, record) positions files of one .sgx: named after the file, plus a hash of its path as two
+    directories may hold the same file name."""
+    digest = hashlib.md5(os.path.abspath(sgx_path).encode()).hexdigest()[:12]
+    base = os.path.join(os.path.dirname(os.path.abspath(index_path)), POSITIONS_DIR,
+                        f"{os.path.splitext(os.path.basename(sgx_path))[0]}.{digest}")
+    return base + ".depth.npy", base + ".record.npy"
+
+
+def index_sgx(path, index_path):
+    """Index rows for one .sgx file, one per well, and its positions files: every record number sorted by
+    (well_id, depth), and the depths in the same order. A truncated tail is indexed up to the last complete record."""
+    loader = CaspianSGX(path)
+    if not loader.read():
+        return []
+    info = dict(_file_info(path), source="sgx")
+    survey_id = loader.header['survey_id']
+    try:
+        well_ids = loader.traces['well_id']
+        depths = loader.traces['depth']
+        order = np.lexsort((depths, well_ids))
+        sorted_depths = depths[order]
+        records = order.astype(np.uint32 if len(order) < 2**32 else np.uint64)
+        wells = well_ids[order]
+    finally:
+        loader.close()
+
+    # Separate files keep each column contiguous, so a binary search on the depths maps only a few pages
+    for target, values in zip(positions_paths(index_path, path), (sorted_depths, records)):
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        # Write-then-rename: a query still mapping the previous file keeps reading it until it is done
+        tmp_path = target + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            np.save(f, values)
+        os.replace(tmp_path, target)
+
+    if len(order) == 0:
+        return []
+    starts = np.flatnonzero(np.r_[True, wells[1:] != wells[:-1]])
+    counts = np.diff(np.r_[starts, len(order)])
+    # fmin/fmax skip NaN depths, which the sort put at the end of their well
+    depth_min = np.fmin.reduceat(sorted_depths, starts)
+    depth_max = np.fmax.reduceat(sorted_depths, starts)
+    itemsize = records.dtype.itemsize
+    return [dict(info, survey_id=survey_id, well_id=int(wells[start]), link_survey_well_key=None, unit=0,
+                 row_start=int(start), row_count=int(count),
+                 byte_offset=int(start) * itemsize, byte_length=int(count) * itemsize,
+                 depth_min=float(lo), depth_max=float(hi), traces=int(count))
+            for start, count, lo, hi in zip(starts, counts, depth_min, depth_max)]
+
+
+def _index_parquet(path, source, key_columns, resolve):
+    """Index rows per row group of one Parquet file. resolve(table) -> DataFrame of survey_id, well_id, link key, depth."""
+    pf = pq.ParquetFile(path)
+    metadata = pf.metadata
+    info = dict(_file_info(path), source=source)
+    rows = []
+    row_start = 0
+    for rg in range(metadata.num_row_groups):
+        n = metadata.row_group(rg).num_rows
+        byte_offset, byte_length = _row_group_span(metadata, rg)
+        df = resolve(pf.read_row_group(rg, columns=key_columns + ["depth"]))
+        stats = df.groupby(["survey_id", "well_id", "link_survey_well_key"], dropna=False, sort=True)["depth"] \
+                  .agg(["min", "max", "count"]).reset_index()
+        for survey_id, well_id, link_key, depth_min, depth_max, count in stats.itertuples(index=False):
+            if pd.isna(survey_id) or pd.isna(well_id):
+                continue
+            rows.append(dict(info, survey_id=int(survey_id), well_id=int(well_id),
+                             link_survey_well_key=None if pd.isna(link_key) else link_key, unit=rg,
+                             row_start=row_start, row_count=n, byte_offset=byte_offset, byte_length=byte_length,
+                             depth_min=depth_min, depth_max=depth_max, traces=int(count)))
+        row_start += n
+    return rows
+
+
+def index_reconstructed(path):
+    if not {"survey_id", "well_id"} <= set(pq.ParquetFile(path).schema_arrow.names):
+        # e.g. repaired sensor batches from the Parquet extractor, which carry no survey/well keys
+        print(f"[-] Skipping {os.path.basename(path)}: no survey_id/well_id columns")
+        return []
+
+    def resolve(table):
+        df = to_standard(table).to_pandas()
+        df["link_survey_well_key"] = None
+        return df
+    return _index_parquet(path, "reconstructed", ["survey_id", "well_id"], resolve)
+
+
+def vault_link_map(raw_vault_dir):
+    """link_survey_well_key -> (survey_id, well_id) from the raw vault link and hubs."""
+    def read(table, columns):
+        files = vault_table_files(raw_vault_dir, table)
+        if not files:
+            return pd.DataFrame(columns=columns)
+        return pd.concat([pd.read_parquet(f, columns=columns) for f in files], ignore_index=True).drop_duplicates()
+
+    links = read("link_survey_well", ["link_survey_well_key", "hub_survey_key", "hub_well_key"])
+    surveys = read("hub_survey", ["hub_survey_key", "survey_type_id"]).rename(columns={"survey_type_id": "survey_id"})
+    wells = read("hub_well", ["hub_well_key", "well_id"])
+    return links.merge(surveys, on="hub_survey_key").merge(wells, on="hub_well_key") \
+                [["link_survey_well_key", "survey_id", "well_id"]].drop_duplicates("link_survey_well_key")
+
+
+def index_vault(path, link_map):
+    def resolve(table):
+        return table.to_pandas().merge(link_map, on="link_survey_well_key", how="inner")
+    return _index_parquet(path, "vault", ["link_survey_well_key"], resolve)
+
+
+class TraceIndex:
+    """Persisted (survey, well) -> depth-range index with depth-window queries on top.
+
+    Open files (Parquet handles, .sgx mappings) are kept between queries; call close() when done."""
+
+    def __init__(self, index_path=None):
+        self.index_path = index_path or os.path.join(PROCESSED_DIR, INDEX_NAME)
+        self.entries = pd.DataFrame({f.name: pd.Series(dtype=f.type.to_pandas_dtype()) for f in INDEX_SCHEMA})
+        self._by_key = None
+        self._signatures_by_path = {}
+        self._handles = {}
+        self.last_stats = {}
+
+    # --- persistence ---
+
+    def load(self):
+        if os.path.exists(self.index_path):
+            table = pq.read_table(self.index_path)
+            version = (table.schema.metadata or {}).get(b"trace_index_version", b"1").decode()
+            if version == INDEX_VERSION:
+                self.entries = table.to_pandas()
+            else:
+                print(f"[!] {self.index_path} has index version {version}, expected {INDEX_VERSION}; "
+                      f"every file is re-indexed on the next --build.")
+        self._by_key = None
+        return self
+
+    def save(self):
+        table = pa.Table.from_pandas(self.entries, schema=INDEX_SCHEMA, preserve_index=False)
+        table = table.replace_schema_metadata({"trace_index_version": INDEX_VERSION})
+        # Write-then-rename so a concurrent reader never sees a half-written index
+        tmp_path = self.index_path + ".tmp"
+        pq.write_table(table, tmp_path)
+        os.replace(tmp_path, self.index_path)
+
+    # --- building ---
+
+    def _signatures(self):
+        if self._by_key is None:
+            self._by_key = {key: df for key, df in self.entries.groupby(["survey_id", "well_id"])}
+            files = self.entries.drop_duplicates("path")
+            self._signatures_by_path = dict(zip(files["path"], zip(files["file_size"], files["file_mtime_ns"])))
+        return self._signatures_by_path
+
+    def is_fresh(self, path):
+        """True when the file still has the size and mtime it was indexed with."""
+        indexed = self._signatures().get(path)
+        if indexed is None or not os.path.exists(path):
+            return False
+        stat = os.stat(path)
+        return (stat.st_size, stat.st_mtime_ns) == indexed
+
+    def _positions_paths(self, path):
+        return positions_paths(self.index_path, path)
+
+    def _index_file(self, source, path, link_map=None):
+        if source == "sgx":
+            return index_sgx(path, self.index_path)
+        if source == "reconstructed":
+            return index_reconstructed(path)
+        return index_vault(path, link_map)
+
+    def build(self, sgx_dir=None, processed_dir=PROCESSED_DIR, raw_vault_dir=None, force=False):
+        """(Re)indexes new or changed files; entries of unchanged files are kept, those of deleted files dropped.
+
+        processed_dir=None only refreshes the files already in the index (plus new parts under raw_vault_dir)."""
+        sources = []
+        sgx_files = set(discover_sgx_files(sgx_dir)) if sgx_dir else set()
+        if processed_dir:
+            # Originals converted earlier are listed in the conversion manifest
+            sgx_files.update(p for p in load_manifest(os.path.join(processed_dir, MANIFEST_NAME)) if os.path.exists(p))
+            sources += [("reconstructed", os.path.abspath(p)) for p in sorted(glob.glob(os.path.join(processed_dir, "*_reconstructed.parquet")))]
+            raw_vault_dir = raw_vault_dir or os.path.join(processed_dir, "raw_vault")
+        sources += [("sgx", os.path.abspath(p)) for p in sorted(sgx_files)]
+        if raw_vault_dir:
+            sources += [("vault", os.path.abspath(p)) for p in vault_table_files(raw_vault_dir, "sat_seismic_data")]
+
+        # Files indexed earlier (e.g. from another --data-dir) stay in the index while they exist
+        listed = {path for _, path in sources}
+        known = self.entries.drop_duplicates("path")
+        sources += [(source, path) for source, path in zip(known["source"], known["path"])
+                    if path not in listed and os.path.exists(path)]
+
+        wanted = {path for _, path in sources}
+        keep = self.entries[self.entries["path"].isin(wanted)]
+        fresh = set() if force else {p for p in keep["path"].unique() if self.is_fresh(p)}
+        # An .sgx whose positions file went missing is indexed again
+        fresh -= {p for p in keep.loc[keep["source"] == "sgx", "path"].unique()
+                  if not all(os.path.exists(f) for f in self._positions_paths(p))}
+
+        todo = [(source, path) for source, path in sources if path not in fresh]
+        # Vault link keys only resolve with the current link/hub tables, so re-resolve every vault file together
+        link_map = None
+        if any(source == "vault" for source, _ in todo):
+            link_map = vault_link_map(raw_vault_dir)
+            vault_files = {path for source, path in sources if source == "vault"}
+            todo += [("vault", p) for p in sorted(vault_files & fresh)]
+            fresh -= vault_files
+
+        rows = []
+        for source, path in todo:
+            try:
+                rows += self._index_file(source, path, link_map)
+                print(f"[+] Indexed {source}: {os.path.basename(path)}")
+            except Exception as e:
+                print(f"[ERROR] Could not index {path}: {e}")
+
+        new = pd.DataFrame(rows, columns=INDEX_SCHEMA.names)
+        parts = [df for df in (keep[keep["path"].isin(fresh)], new) if not df.empty]
+        self.entries = (pd.concat(parts, ignore_index=True) if parts else new) \
+            .sort_values(["survey_id", "well_id", "source", "path", "unit"], kind="stable").reset_index(drop=True)
+        self._by_key = None
+        self.close()
+        self._remove_orphaned_positions()
+        print(f"[*] {len(todo)} file(s) indexed, {len(fresh)} unchanged. Index: {len(self.entries)} entries.")
+        return self
+
+    def _remove_orphaned_positions(self):
+        """Deletes positions files of .sgx files no longer in the index."""
+        referenced = {f for p in self.entries.loc[self.entries["source"] == "sgx", "path"].unique() for f in self._positions_paths(p)}
+        for path in glob.glob(os.path.join(os.path.dirname(os.path.abspath(self.index_path)), POSITIONS_DIR, "*.npy")):
+            if path not in referenced:
+                os.remove(path)
+
+    # --- querying ---
+
+    def _entries_for(self, survey_id, well_id):
+        self._signatures()
+        return self._by_key.get((survey_id, well_id))
+
+    def _sgx_view(self, path):
+        if path not in self._handles:
+            with open(path, 'rb') as f:
+                self._handles[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._handles[path]
+
+    def _positions(self, path):
+        key = ("positions", path)
+        if key not in self._handles:
+            self._handles[key] = tuple(np.load(f, mmap_mode='r') for f in self._positions_paths(path))
+        return self._handles[key]
+
+    def _parquet(self, path):
+        if path not in self._handles:
+            self._handles[path] = pq.ParquetFile(path)
+        return self._handles[path]
+
+    def _read_sgx(self, path, units, survey_id, well_id, depth_min, depth_max):
+        """Returns (traces, bytes read): the window's positions by binary search, then just those records."""
+        mm = self._sgx_view(path)
+        depths, record_numbers = self._positions(path)
+        # Zero-copy view of the complete records; indexing it below touches only the pages of the hits
+        traces = np.frombuffer(mm, dtype=TRACE_DTYPE, count=(len(mm) - HEADER_SIZE) // TRACE_DTYPE.itemsize, offset=HEADER_SIZE)
+        parts = []
+        for row_start, row_count in units[["row_start", "row_count"]].itertuples(index=False):
+            start, end = int(row_start), int(row_start) + int(row_count)
+            lo = start + np.searchsorted(depths[start:end], depth_min, side='left')
+            hi = start + np.searchsorted(depths[start:end], depth_max, side='right')
+            parts.append(traces[np.asarray(record_numbers[lo:hi])])
+        records = np.concatenate(parts) if parts else np.empty(0, dtype=TRACE_DTYPE)
+        # Records plus their depth and record number; the binary search itself touches a few pages
+        bytes_read = len(records) * (TRACE_DTYPE.itemsize + depths.dtype.itemsize + record_numbers.dtype.itemsize)
+        return pd.DataFrame({
+            'survey_id': np.full(len(records), survey_id, dtype=np.int64),
+            'well_id': records['well_id'].astype(np.int64),
+            'depth': records['depth'].astype(np.float64),
+            'amplitude': records['amplitude'].astype(np.float64),
+            'quality_flag': records['quality_flag'].astype(np.int64),
+        }), bytes_read
+
+    def _read_parquet(self, source, path, units, survey_id, well_id, depth_min, depth_max):
+        pf = self._parquet(path)
+        if source == "vault":
+            key = units["link_survey_well_key"].iloc[0]
+            table = pf.read_row_groups(sorted(units["unit"].unique()), columns=["link_survey_well_key", "depth", "amplitude", "quality_flag"])
+            mask = pc.equal(table["link_survey_well_key"], key)
+        else:
+            table = to_standard(pf.read_row_groups(sorted(units["unit"].unique()), columns=TRACE_COLUMNS))
+            mask = pc.and_(pc.equal(table["survey_id"], survey_id), pc.equal(table["well_id"], well_id))
+        mask = pc.and_(mask, pc.and_(pc.greater_equal(table["depth"], depth_min), pc.less_equal(table["depth"], depth_max)))
+        df = table.filter(mask).to_pandas()
+        if source == "vault":
+            df = df.drop(columns=["link_survey_well_key"])
+            df.insert(0, "well_id", np.int64(well_id))
+            df.insert(0, "survey_id", np.int64(survey_id))
+        return df
+
+    def query(self, survey_id, well_id, depth_min=-np.inf, depth_max=np.inf, source=None):
+        """Traces of one well in one survey with depth_min <= depth <= depth_max, sorted by depth.
+
+        source picks sgx / reconstructed / vault; by default the one whose matching units hold the fewest
+        rows (row groups prune only as well as the physical record order allows; .sgx reads only the window).
+        Files changed since indexing are re-indexed before they are read."""
+        started = time.perf_counter()
+        entries = self._entries_for(survey_id, well_id)
+        if entries is None:
+            self.last_stats = {"source": None, "units": 0, "bytes": 0, "rows": 0, "seconds": time.perf_counter() - started}
+            return pd.DataFrame(columns=TRACE_COLUMNS)
+
+        window = (entries["depth_max"] >= depth_min) & (entries["depth_min"] <= depth_max)
+        if source is None:
+            cost = entries[window].drop_duplicates(["path", "unit"]).groupby("source")["row_count"].sum()
+            available = [s for s in SOURCES if (entries["source"] == s).any()]
+            source = min(available, key=lambda s: (cost.get(s, 0), SOURCES.index(s)))
+        entries = entries[entries["source"] == source]
+
+        stale = [p for p in entries["path"].unique() if not self.is_fresh(p)]
+        if stale:
+            print(f"[!] {len(stale)} file(s) changed since indexing; re-indexing {source} sources.")
+            self.build(processed_dir=None, raw_vault_dir=self._raw_vault_dir()).save()
+            return self.query(survey_id, well_id, depth_min, depth_max, source)
+
+        hits = entries[(entries["depth_max"] >= depth_min) & (entries["depth_min"] <= depth_max)]
+        frames = []
+        bytes_read = 0
+        for path, units in hits.groupby("path", sort=False):
+            if source == "sgx":
+                df, n = self._read_sgx(path, units, survey_id, well_id, depth_min, depth_max)
+                frames.append(df)
+                bytes_read += n
+            else:
+                frames.append(self._read_parquet(source, path, units, survey_id, well_id, depth_min, depth_max))
+                bytes_read += int(units.drop_duplicates("unit")["byte_length"].sum())
+
+        df = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=TRACE_COLUMNS)
+        df = df[TRACE_COLUMNS].sort_values("depth", kind="stable").reset_index(drop=True)
+        self.last_stats = {
+            "source": source,
+            "units": len(hits),
+            "units_total": len(entries),
+            "bytes": bytes_read,
+            "rows": len(df),
+            "seconds": time.perf_counter() - started,
+        }
+        return df
+
+    def _raw_vault_dir(self):
+        vault = self.entries.loc[self.entries["source"] == "vault", "path"]
+        if vault.empty:
+            return None
+        # <raw_vault>/sat_seismic_data.parquet or <raw_vault>/sat_seismic_data/<partitions>/part-*.parquet
+        path = vault.iloc[0]
+        marker = os.sep + "sat_seismic_data"
+        return path[:path.rindex(marker)] if marker in path else os.path.dirname(path)
+
+    def close(self):
+        for handle in self._handles.values():
+            if isinstance(handle, mmap.mmap):
+                try:
+                    handle.close()
+                except BufferError:
+                    # A returned frame still references the mapping; it is released with it
+                    pass
+        self._handles = {}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--build', action='store_true', help="Build or refresh the index, then exit")
+    parser.add_argument('--data-dir', default=None, help="Directory with the original .sgx files to index (with --build)")
+    parser.add_argument('--processed-dir', default=PROCESSED_DIR, help="Reconstructed outputs and sgx_manifest.json")
+    parser.add_argument('--raw-vault-dir', default=None, help="Raw vault to index (default: <processed-dir>/raw_vault)")
+    parser.add_argument('--force', action='store_true', help="Re-index every file")
+    parser.add_argument('--index', default=None, help=f"Index file (default: <processed-dir>/{INDEX_NAME})")
+    parser.add_argument('--survey', type=int, help="Survey ID to query")
+    parser.add_argument('--well', type=int, help="Well ID to query")
+    parser.add_argument('--depth-min', type=float, default=-np.inf)
+    parser.add_argument('--depth-max', type=float, default=np.inf)
+    parser.add_argument('--source', choices=SOURCES, default=None, help="Read from this source only")
+    parser.add_argument('--output', default=None, help="Write the traces to this .csv or .parquet file")
+    args = parser.parse_args()
+
+    index = TraceIndex(args.index or os.path.join(args.processed_dir, INDEX_NAME)).load()
+
+    if args.build:
+        index.build(args.data_dir, args.processed_dir, args.raw_vault_dir, args.force).save()
+        print(f"[+] Index written to {index.index_path}")
+        sys.exit(0)
+
+    if args.survey is None or args.well is None:
+        parser.error("--survey and --well are required for a query (or pass --build)")
+
+    df = index.query(args.survey, args.well, args.depth_min, args.depth_max, args.source)
+    stats = index.last_stats
+    print(f"[QUERY] survey {args.survey}, well {args.well}, depth [{args.depth_min}, {args.depth_max}]: "
+          f"{stats['rows']} traces from {stats['source']} ({stats['units']}/{stats.get('units_total', 0)} units, "
+          f"{stats['bytes']:,} bytes) in {stats['seconds'] * 1000:.1f} ms")
+
+    if args.output:
+        if args.output.endswith(".csv"):
+            df.to_csv(args.output, index=False)
+        else:
+            df.to_parquet(args.output, index=False)
+        print(f"[+] Traces written to {args.output}")
+    else:
+        print(df.head(20).to_string(index=False))
+    index.close()
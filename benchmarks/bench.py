@@ -0,0 +1,278 @@
+import os; import sys
+import glob
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+import pyarrow.parquet as pq
+
+from synthetic_data import generate
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_ROOT = os.path.abspath(os.path.join(BENCH_DIR, ".."))
+
+# Run in this order; each stage consumes the previous one's output (fused_vault reads only the generated input)
+STAGES = ["sgx_convert", "parquet_repair", "build_vault", "marts", "fused_vault"]
+DEFAULT_ROWS = [100_000, 1_000_000]
+DEFAULT_MAX_REGRESSION = 0.25
+
+
+def parquet_rows(paths):
+    return sum(pq.ParquetFile(p).metadata.num_rows for p in paths)
+
+
+# --- Stage bodies: each runs in its own process so peak RSS is per stage ---
+
+def stage_sgx_convert(workdir, db):
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "The Ghost Format"))
+    import CaspianPetro
+
+    out_dir = os.path.join(workdir, "reconstructed")
+    os.makedirs(out_dir, exist_ok=True)
+    for path in CaspianPetro.discover_sgx_files(os.path.join(workdir, "input", "sgx")):
+        ok, lines = CaspianPetro.convert_file(path, out_dir, streaming=True)
+        print("\n".join(lines))
+        if not ok:
+            raise RuntimeError(f"conversion failed: {path}")
+
+    # build_vault reads the master CSVs from the same data dir as the reconstructed files
+    for csv in glob.glob(os.path.join(workdir, "input", "sgx", "master_*.csv")):
+        shutil.copy(csv, out_dir)
+    return parquet_rows(glob.glob(os.path.join(out_dir, "*_reconstructed.parquet")))
+
+
+def stage_parquet_repair(workdir, db):
+    corrupt_dir = os.path.join(workdir, "input", "corrupted")
+    # parquet_extractor parses its CLI at import time
+    sys.argv = ["parquet_extractor.py", "--data-dir", corrupt_dir]
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "Parquet Enigma"))
+    import parquet_extractor
+
+    out_dir = os.path.join(workdir, "repaired")
+    os.makedirs(out_dir, exist_ok=True)
+    parquet_extractor.BASE_OUTPUT_DIR = out_dir
+    for path in sorted(glob.glob(os.path.join(corrupt_dir, "*.parquet"))):
+        parquet_extractor.repair_file(path)
+    return parquet_rows(glob.glob(os.path.join(out_dir, "*_reconstructed.parquet")))
+
+
+def stage_build_vault(workdir, db):
+    sys.path.insert(0, PROJECT_ROOT)
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "solutions"))
+    import task2_build
+    from vault_io import vault_table_files
+
+    if not db:
+        # Parquet-only run; --db benchmarks the COPY load as well
+        task2_build.get_db_engine = lambda: None
+    # build_vault writes under ./processed_data/raw_vault
+    os.chdir(workdir)
+    task2_build.build_vault(os.path.join(workdir, "reconstructed"))
+    return parquet_rows(vault_table_files(os.path.join(workdir, "processed_data", "raw_vault"), "sat_seismic_data"))
+
+
+def stage_fused_vault(workdir, db):
+    """SGX straight into the raw vault (task2_build --from-sgx); compare with sgx_convert + build_vault."""
+    sys.path.insert(0, PROJECT_ROOT)
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "solutions"))
+    import task2_build
+    from vault_io import vault_table_files
+
+    if not db:
+        task2_build.get_db_engine = lambda: None
+    # Own processed_data, so the two-step vault that marts reads is left alone
+    fused_dir = os.path.join(workdir, "fused")
+    os.makedirs(fused_dir, exist_ok=True)
+    os.chdir(fused_dir)
+    task2_build.build_vault(os.path.join(workdir, "input", "sgx"), from_sgx=True)
+    return parquet_rows(vault_table_files(os.path.join(fused_dir, "processed_data", "raw_vault"), "sat_seismic_data"))
+
+
+def stage_marts(workdir, db):
+    sys.path.insert(0, PROJECT_ROOT)
+    sys.path.insert(0, os.path.join(PROJECT_ROOT, "solutions"))
+    import mart_etl
+
+    if not db:
+        mart_etl.get_db_engine = lambda: None
+    mart_etl.MART_VAULT_DIR = os.path.join(workdir, "mart_vault")
+    raw_vault_dir = os.path.join(workdir, "processed_data", "raw_vault")
+    mart_etl.build_marts_parquet(os.path.join(workdir, "processed_data"))
+    return parquet_rows(mart_etl.vault_table_files(raw_vault_dir, "sat_seismic_data"))
+
+
+STAGE_FUNCS = {
+    "sgx_convert": stage_sgx_convert,
+    "parquet_repair": stage_parquet_repair,
+    "build_vault": stage_build_vault,
+    "marts": stage_marts,
+    "fused_vault": stage_fused_vault,
+}
+
+
+def run_stage_child(stage, workdir, db):
+    """Entry point of a stage process: times the stage body and leaves its result next to the log."""
+    started = time.perf_counter()
+    rows = STAGE_FUNCS[stage](workdir, db)
+    seconds = time.perf_counter() - started
+    with open(os.path.join(workdir, f"{stage}.result.json"), 'w') as f:
+        json.dump({"rows": rows, "seconds": seconds}, f)
+
+
+def _max_rss_mb(usage):
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    return usage.ru_maxrss / (1024 * 1024) if sys.platform == "darwin" else usage.ru_maxrss / 1024
+
+
+def run_stage(stage, workdir, db=False):
+    cmd = [sys.executable, os.path.abspath(__file__), "--stage", stage, "--workdir", workdir]
+    if db:
+        cmd.append("--db")
+
+    log_path = os.path.join(workdir, f"{stage}.log")
+    started = time.perf_counter()
+    with open(log_path, 'w') as log:
+        proc = subprocess.Popen(cmd, stdout=log, stderr=subprocess.STDOUT, cwd=BENCH_DIR)
+        # wait4 returns the resource usage of exactly this child
+        _, status, usage = os.wait4(proc.pid, 0)
+        proc.returncode = os.waitstatus_to_exitcode(status)
+    wall = time.perf_counter() - started
+
+    record = {"stage": stage, "ok": proc.returncode == 0, "wall_seconds": round(wall, 3),
+              "peak_rss_mb": round(_max_rss_mb(usage), 1), "log": log_path}
+    if proc.returncode != 0:
+        print(f"[-] {stage} failed (exit {proc.returncode}), see {log_path}")
+        return record
+
+    with open(os.path.join(workdir, f"{stage}.result.json")) as f:
+        result = json.load(f)
+    record.update(
+        rows=result["rows"],
+        seconds=round(result["seconds"], 3),
+        rows_per_sec=round(result["rows"] / result["seconds"], 1) if result["seconds"] > 0 else None,
+    )
+    print(f"[+] {stage:<15} {record['rows']:>12,} rows  {record['seconds']:>9.2f}s  "
+          f"{record['rows_per_sec'] or 0:>14,.0f} rows/sec  peak RSS {record['peak_rss_mb']:,.0f} MB")
+    return record
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=PROJECT_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(row_counts, workdir, stages=STAGES, db=False, surveys=3, wells=20, keep=False):
+    results = {
+        "commit": git_commit(),
+        "created_at": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "db": db,
+        "runs": [],
+    }
+
+    for rows in row_counts:
+        run_dir = os.path.join(workdir, f"rows_{rows}")
+        shutil.rmtree(run_dir, ignore_errors=True)
+        print(f"\n{'='*50}\n{f'BENCHMARK: {rows:,} ROWS':^50}\n{'='*50}")
+
+        started = time.perf_counter()
+        generate(os.path.join(run_dir, "input"), rows, n_surveys=surveys, n_wells=wells)
+        print(f"[*] Generated synthetic inputs in {time.perf_counter() - started:.2f}s")
+
+        run = {"rows_requested": rows, "stages": []}
+        for stage in stages:
+            record = run_stage(stage, run_dir, db)
+            run["stages"].append(record)
+            if not record["ok"]:
+                break
+        results["runs"].append(run)
+
+        # A failed run keeps its inputs and stage logs for inspection
+        if not keep and all(stage["ok"] for stage in run["stages"]):
+            shutil.rmtree(run_dir, ignore_errors=True)
+
+    return results
+
+
+def compare(results, baseline, max_regression=DEFAULT_MAX_REGRESSION):
+    """Stages whose rows/sec dropped by more than max_regression against the baseline at the same size."""
+    base = {
+        (run["rows_requested"], stage["stage"]): stage.get("rows_per_sec")
+        for run in baseline["runs"] for stage in run["stages"]
+    }
+    regressions = []
+    for run in results["runs"]:
+        for stage in run["stages"]:
+            before = base.get((run["rows_requested"], stage["stage"]))
+            after = stage.get("rows_per_sec")
+            if not before or after is None:
+                continue
+            change = after / before - 1
+            print(f"[*] {stage['stage']:<15} @ {run['rows_requested']:>12,} rows: {change:+.1%} rows/sec vs {baseline.get('commit')}")
+            if change < -max_regression:
+                regressions.append((run["rows_requested"], stage["stage"], change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', default=",".join(str(r) for r in DEFAULT_ROWS),
+                        help="Comma-separated trace counts to benchmark, e.g. 100000,1000000,10000000")
+    parser.add_argument('--stages', default=",".join(STAGES), help=f"Subset of {','.join(STAGES)} (in this order)")
+    parser.add_argument('--workdir', default=None, help="Scratch directory (default: a temp dir)")
+    parser.add_argument('--output', default=None, help="Results JSON (default: benchmarks/results/<commit>_<timestamp>.json)")
+    parser.add_argument('--baseline', default=None, help="Earlier results JSON to compare rows/sec against")
+    parser.add_argument('--max-regression', type=float, default=DEFAULT_MAX_REGRESSION,
+                        help="Fail when a stage is this much slower than the baseline (0.25 = 25%%)")
+    parser.add_argument('--surveys', type=int, default=3)
+    parser.add_argument('--wells', type=int, default=20)
+    parser.add_argument('--db', action='store_true', help="Also load PostgreSQL (uses db_utils.get_db_engine)")
+    parser.add_argument('--keep', action='store_true', help="Keep the generated data and stage outputs")
+    # Internal: run one stage in this process
+    parser.add_argument('--stage', default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        run_stage_child(args.stage, args.workdir, args.db)
+        return
+
+    row_counts = [int(r) for r in args.rows.split(",") if r.strip()]
+    stages = [s for s in STAGES if s in args.stages.split(",")]
+    workdir = args.workdir or tempfile.mkdtemp(prefix="caspian_bench_")
+    os.makedirs(workdir, exist_ok=True)
+
+    results = run_benchmarks(row_counts, workdir, stages, args.db, args.surveys, args.wells, args.keep)
+
+    output = args.output or os.path.join(
+        BENCH_DIR, "results", f"{results['commit'] or 'nocommit'}_{datetime.now().strftime('%Y%m%dT%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\n[+] Results written to {output}")
+
+    failed = any(not stage["ok"] for run in results["runs"] for stage in run["stages"])
+    if not args.workdir and not args.keep and not failed:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            for rows, stage, change in regressions:
+                print(f"[-] REGRESSION: {stage} at {rows:,} rows is {-change:.1%} slower than the baseline")
+            sys.exit(1)
+        print("[+] No regressions against the baseline.")
+
+
+if __name__ == "__main__":
+    main()
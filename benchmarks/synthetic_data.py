@@ -0,0 +1,127 @@
+import os; import sys
+import struct
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "The Ghost Format"))
+from CaspianPetro import HEADER_SIZE, TRACE_DTYPE
+
+# Synthetic inputs for the benchmark suite: CPETRO01 surveys, the master CSVs they join to,
+# and Parquet files broken the ways the extractor has to repair.
+
+MAGIC = b'CPETRO01'
+SURVEY_TYPES = ["Acoustic_2D", "Acoustic_3D", "Acoustic_VS", "Seismic_4D"]
+CHUNK_TRACES = 1_000_000
+
+CORRUPTIONS = ["bad_footer_length", "trailing_garbage", "garbage_and_bad_length"]
+
+
+def write_sgx(path, survey_id, n_traces, n_wells, truncate_bytes=0, seed=0):
+    """Writes n_traces packed 13-byte records in chunks (memory stays flat at any size).
+    truncate_bytes cuts the tail mid-record, like the damaged field tapes."""
+    rng = np.random.default_rng(seed)
+    with open(path, 'wb') as f:
+        f.write(struct.pack('<8sII', MAGIC, survey_id, n_traces))
+        written = 0
+        while written < n_traces:
+            n = min(CHUNK_TRACES, n_traces - written)
+            records = np.empty(n, dtype=TRACE_DTYPE)
+            records['well_id'] = rng.integers(1, n_wells + 1, n)
+            records['depth'] = (np.arange(written, written + n) % 10_000) * 0.5
+            records['amplitude'] = rng.normal(0.0, 1.0, n)
+            records['quality_flag'] = rng.random(n) < 0.05
+            f.write(records.tobytes())
+            written += n
+
+    if truncate_bytes:
+        size = HEADER_SIZE + n_traces * TRACE_DTYPE.itemsize
+        os.truncate(path, max(HEADER_SIZE, size - truncate_bytes))
+
+
+def write_master_csvs(out_dir, survey_ids, n_wells):
+    pd.DataFrame({
+        "survey_type_id": survey_ids,
+        "survey_type": [SURVEY_TYPES[i % len(SURVEY_TYPES)] for i in range(len(survey_ids))],
+    }).to_csv(os.path.join(out_dir, "master_surveys.csv"), index=False)
+
+    wells = np.arange(1, n_wells + 1)
+    pd.DataFrame({
+        "well_id": wells,
+        "well_name": [f"CASPIAN-{w:03d}" for w in wells],
+        "location_lat": 40.0 + wells * 0.01,
+        "location_long": 50.0 + wells * 0.01,
+        "operator": "CaspianPetro Synthetic",
+        "spud_date": "2000-01-01",
+    }).to_csv(os.path.join(out_dir, "master_wells.csv"), index=False)
+
+
+def corrupt_parquet(path, kind, seed=0):
+    """Damages a healthy Parquet file in place: wrong footer length field, appended garbage, or both."""
+    rng = np.random.default_rng(seed)
+    with open(path, 'r+b') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        if kind in ("bad_footer_length", "garbage_and_bad_length"):
+            f.seek(size - 8)
+            f.write(struct.pack('<I', int(rng.integers(size, 2 ** 31))))
+        if kind in ("trailing_garbage", "garbage_and_bad_length"):
+            f.seek(0, os.SEEK_END)
+            f.write(rng.bytes(int(rng.integers(16, 4096))))
+
+
+def write_corrupted_parquet(out_dir, n_rows, n_wells, row_group_size=100_000, seed=0):
+    """One file per corruption kind, n_rows split between them. Returns {path: kind}."""
+    rng = np.random.default_rng(seed)
+    per_file = max(1, n_rows // len(CORRUPTIONS))
+    files = {}
+    for i, kind in enumerate(CORRUPTIONS):
+        table = pa.table({
+            "well_id": rng.integers(1, n_wells + 1, per_file),
+            "depth": np.arange(per_file) * 0.5,
+            "amplitude": rng.normal(0.0, 1.0, per_file),
+            "quality_flag": (rng.random(per_file) < 0.05).astype("int64"),
+        })
+        path = os.path.join(out_dir, f"synthetic_{kind}.parquet")
+        pq.write_table(table, path, row_group_size=row_group_size)
+        corrupt_parquet(path, kind, seed + i)
+        files[path] = kind
+    return files
+
+
+def generate(out_dir, n_traces, n_surveys=3, n_wells=20, truncated=1, corrupt_rows=None, seed=0):
+    """Benchmark input tree: out_dir/sgx (surveys + master CSVs) and out_dir/corrupted (broken Parquet)."""
+    sgx_dir = os.path.join(out_dir, "sgx")
+    corrupt_dir = os.path.join(out_dir, "corrupted")
+    os.makedirs(sgx_dir, exist_ok=True)
+    os.makedirs(corrupt_dir, exist_ok=True)
+
+    survey_ids = [101 + i for i in range(n_surveys)]
+    per_survey = max(1, n_traces // n_surveys)
+    for i, survey_id in enumerate(survey_ids):
+        # The first `truncated` surveys lose half a record at the tail
+        cut = TRACE_DTYPE.itemsize // 2 if i < truncated else 0
+        write_sgx(os.path.join(sgx_dir, f"synthetic_survey_{survey_id}.sgx"), survey_id, per_survey, n_wells, cut, seed + i)
+
+    write_master_csvs(sgx_dir, survey_ids, n_wells)
+    write_corrupted_parquet(corrupt_dir, corrupt_rows if corrupt_rows is not None else n_traces, n_wells, seed=seed)
+
+    return sgx_dir, corrupt_dir
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--out-dir', required=True, help="Where to write the synthetic sgx/ and corrupted/ trees")
+    parser.add_argument('--traces', type=int, default=100_000, help="Total traces over all surveys")
+    parser.add_argument('--surveys', type=int, default=3)
+    parser.add_argument('--wells', type=int, default=20)
+    parser.add_argument('--truncated', type=int, default=1, help="How many surveys get a truncated tail")
+    parser.add_argument('--corrupt-rows', type=int, default=None, help="Rows over the corrupted Parquet files (default: --traces)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sgx_dir, corrupt_dir = generate(args.out_dir, args.traces, args.surveys, args.wells, args.truncated, args.corrupt_rows, args.seed)
+    print(f"[+] Synthetic SGX surveys and master CSVs: {sgx_dir}")
+    print(f"[+] Corrupted Parquet files: {corrupt_dir}")
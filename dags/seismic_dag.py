@@ -1,7 +1,10 @@
 from __future__ import annotations
 
+import sys
+
 import pendulum
 
+from airflow.decorators import task
 from airflow.models.dag import DAG
 from airflow.operators.bash import BashOperator
 
@@ -9,6 +12,16 @@ from airflow.operators.bash import BashOperator
 SOLUTION_DIR = "/opt/airflow/solutions"
 DATA_DIR = "/opt/airflow/processed_data"
 
+# Every script prints per-stage [METRICS] JSON lines (also appended to this file) and ends with a
+# JSON summary line, which BashOperator pushes to XCom (do_xcom_push) under return_value
+METRICS_ENV = {"PIPELINE_METRICS_FILE": f"{DATA_DIR}/pipeline_metrics.jsonl"}
+
+# Ingest shards run in this pool; its slot count caps how many load the vault at once.
+# The airflow_init service in docker-compose.yml creates it (VAULT_INGEST_SLOTS, default 4)
+INGEST_POOL = "vault_ingest"
+# Reconstructed Parquet per shard; one survey is never split, a bigger survey gets a shard of its own
+SHARD_BYTES = 256 * 1024 * 1024
+
 with DAG(
     dag_id="seismic_reckoning_pipeline",
     start_date=pendulum.datetime(2025, 1, 1, tz="UTC"),
@@ -16,22 +29,82 @@ with DAG(
     catchup=False,
     tags=["hackathon", "data_vault", "etl"],
 ) as dag:
-    
-    # Task 1: Ingests the raw data into the Data Vault (Runs task2_build.py)
-    ingesting_vault = BashOperator(
-        task_id="ingesting_vault",
-        bash_command=f"python {SOLUTION_DIR}/task2_build.py --data-dir {DATA_DIR}",
-        cwd="/opt/airflow", 
+
+    # Task 1: Loads the hubs and their satellites from the master CSVs, once per run
+    loading_metadata = BashOperator(
+        task_id="loading_metadata",
+        bash_command=f"python {SOLUTION_DIR}/task2_build.py --data-dir {DATA_DIR} --phase metadata",
+        cwd="/opt/airflow",
+        env=METRICS_ENV,
+        append_env=True,
+        do_xcom_push=True,
+        execution_timeout=pendulum.duration(minutes=5)
+    )
+
+    # Task 2: Lists the reconstructed files and packs them, survey by survey, into shards
+    @task
+    def discovering_shards():
+        sys.path[:0] = [SOLUTION_DIR, "/opt/airflow"]
+        from task2_build import plan_shards
+
+        shards = plan_shards(DATA_DIR, SHARD_BYTES)
+        for shard in shards:
+            print(f"[*] {shard['shard_id']}: surveys {shard['surveys']}, {len(shard['files'])} files, {shard['bytes']:,} bytes")
+        # One env per mapped ingest task; the XCom keeps the plan fixed for retries of this run
+        return [
+            {**METRICS_ENV, "SHARD_ID": shard["shard_id"], "SHARD_FILES": ",".join(shard["files"])}
+            for shard in shards
+        ]
+
+    # Task 3: One insert-only ingest per shard (Runs task2_build.py --phase shard), mapped at run time.
+    # Each shard appends its own raw-vault parts and stages its links; a failed shard retries alone.
+    ingesting_shards = BashOperator.partial(
+        task_id="ingesting_shard",
+        bash_command=(
+            f'python {SOLUTION_DIR}/task2_build.py --data-dir {DATA_DIR} --phase shard '
+            '--shard-id "$SHARD_ID" --files "$SHARD_FILES"'
+        ),
+        cwd="/opt/airflow",
+        append_env=True,
+        do_xcom_push=True,
+        pool=INGEST_POOL,
+        retries=2,
+        retry_delay=pendulum.duration(seconds=30),
+        map_index_template="{{ task.env['SHARD_ID'] }}",
+        execution_timeout=pendulum.duration(minutes=5)
+    ).expand(env=discovering_shards())
+
+    # Task 4: Deduplicates the staged links of all shards into link_survey_well
+    merging_links = BashOperator(
+        task_id="merging_links",
+        bash_command=f"python {SOLUTION_DIR}/task2_build.py --data-dir {DATA_DIR} --phase merge",
+        cwd="/opt/airflow",
+        env=METRICS_ENV,
+        append_env=True,
+        do_xcom_push=True,
         execution_timeout=pendulum.duration(minutes=5)
     )
 
-    # Task 2: Transforms the Raw Vault into the Aggregated Information Marts (Runs mart_etl.py)
+    # Task 5: Transforms the Raw Vault into the Aggregated Information Marts (Runs mart_etl.py)
+    # Reads the raw_vault Parquet written by the shards in-process; Postgres is only the sink.
+    # --incremental folds in only the new raw-vault parts (full build when the vault was fully reloaded)
     building_marts = BashOperator(
         task_id="building_marts",
-        bash_command=f"python {SOLUTION_DIR}/mart_etl.py --data-dir {DATA_DIR}",
+        bash_command=f"python {SOLUTION_DIR}/mart_etl.py --data-dir {DATA_DIR} --incremental",
+        cwd="/opt/airflow",
+        env=METRICS_ENV,
+        append_env=True,
+        do_xcom_push=True,
+        execution_timeout=pendulum.duration(minutes=5)
+    )
+
+    # Task 6: Compacts, checkpoints and vacuums the mart Delta tables (Runs delta_maintenance.py)
+    maintaining_marts = BashOperator(
+        task_id="maintaining_marts",
+        bash_command=f"python {SOLUTION_DIR}/delta_maintenance.py --report {DATA_DIR}/mart_vault/maintenance_report.json",
         cwd="/opt/airflow",
         execution_timeout=pendulum.duration(minutes=5)
     )
 
-    # Define the dependency flow: Marts must wait for the Raw Vault
-    ingesting_vault >> building_marts
+    # Shards start once the hubs are in; links and marts wait for every shard
+    loading_metadata >> ingesting_shards >> merging_links >> building_marts >> maintaining_marts
@@ -1,20 +1,314 @@
 import os
-from sqlalchemy import create_engine
+import io
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import DBAPIError, OperationalError
 
 POSTGRES_HOST = os.getenv('POSTGRES_HOST', 'postgres_db')
 POSTGRES_DB = os.getenv('POSTGRES_DB', 'caspian_db')
 POSTGRES_USER = os.getenv('POSTGRES_USER', 'user')
 POSTGRES_PASSWORD = os.getenv('POSTGRES_PASSWORD', 'password')
 
+# Connection layer tuning (environment overrides)
+POOL_SIZE = int(os.getenv('POSTGRES_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.getenv('POSTGRES_MAX_OVERFLOW', '5'))
+POOL_RECYCLE = int(os.getenv('POSTGRES_POOL_RECYCLE', '1800'))
+CONNECT_TIMEOUT = int(os.getenv('POSTGRES_CONNECT_TIMEOUT', '10'))
+# 0 = no server-side limit (the bulk COPY loads can legitimately run long); run_queries takes its own
+STATEMENT_TIMEOUT_MS = int(os.getenv('POSTGRES_STATEMENT_TIMEOUT_MS', '0'))
+# Kept low: scripts fall back to Parquet-only when Postgres is down, and every retry delays that fallback
+CONNECT_RETRIES = int(os.getenv('POSTGRES_CONNECT_RETRIES', '1'))
+RETRY_BACKOFF = float(os.getenv('POSTGRES_RETRY_BACKOFF', '0.5'))
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def is_retryable(e):
+    # OperationalError covers refused/reset connections; SQL errors are not worth retrying
+    if not isinstance(e, DBAPIError):
+        return False
+    if getattr(e.orig, "pgcode", None) == "57014":
+        # statement_timeout / cancel is an OperationalError too, but running it again only doubles the wait
+        return False
+    return isinstance(e, OperationalError) or e.connection_invalidated
+
+
+def with_retry(fn, retries=CONNECT_RETRIES, backoff=RETRY_BACKOFF, what="database call"):
+    """Calls fn(), retrying connection-level failures with exponential backoff (backoff, 2*backoff, ...)."""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except DBAPIError as e:
+            if not is_retryable(e) or attempt == retries:
+                raise
+            delay = backoff * (2 ** attempt)
+            print(f"[DB UTIL] {what} failed ({e.__class__.__name__}), retry {attempt + 1}/{retries} in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def _create_engine():
+    DB_URI = f'postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}'
+    connect_args = {"connect_timeout": CONNECT_TIMEOUT}
+    if STATEMENT_TIMEOUT_MS > 0:
+        connect_args["options"] = f"-c statement_timeout={STATEMENT_TIMEOUT_MS}"
+    return create_engine(
+        DB_URI,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        # Drops connections the busy server closed under us instead of failing the first query
+        pool_pre_ping=True,
+        pool_recycle=POOL_RECYCLE,
+        connect_args=connect_args,
+    )
+
+
 def get_db_engine():
-    try:
-        DB_URI = f'postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}'
-        engine = create_engine(DB_URI)
-        
-        with engine.connect():
+    """Process-wide pooled engine, created (and probed, with retries) on first use. Returns None if Postgres is unreachable."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            return _engine
+        try:
+            engine = _create_engine()
+
+            def probe():
+                with engine.connect():
+                    pass
+
+            with_retry(probe, what="connect")
             print(f"[DB UTIL] Successfully connected to PostgreSQL at {POSTGRES_HOST}/{POSTGRES_DB}")
-        
-        return engine
+            _engine = engine
+            return engine
+        except Exception as e:
+            print(f"[DB UTIL ERROR] Could not create database engine: {e}")
+            return None
+
+
+def close_db_engine():
+    """Closes the pooled connections and forgets the cached engine."""
+    global _engine
+    with _engine_lock:
+        if _engine is not None:
+            _engine.dispose()
+            _engine = None
+
+
+def _run_on(conn, name, sql, params, timeout_ms):
+    try:
+        # Explicit transaction per query: Connection.commit()/rollback() only exist on SQLAlchemy 2.x,
+        # the Airflow image ships 1.4. The block rolls back on error, a lost connection is discarded by the pool.
+        with conn.begin():
+            if timeout_ms:
+                # SET LOCAL ends with the transaction, so pooled connections come back without it
+                conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+            return pd.read_sql(text(sql), conn, params=params)
     except Exception as e:
-        print(f"[DB UTIL ERROR] Could not create database engine: {e}")
+        if is_retryable(e):
+            # Lost connection: let with_retry run the query again on a fresh one
+            raise
+        print(f"[DB QUERY ERROR] {name} failed: {e}")
         return None
+
+
+def run_queries(queries, engine=None, parallel=False, max_workers=None, params=None, timeout_ms=None):
+    """Runs {name: sql} and returns {name: DataFrame or None on error}.
+
+    Sequential mode uses one connection for the whole batch. parallel=True spreads the queries over
+    pooled connections (at most pool_size + max_overflow at once), for independent slow reads."""
+    engine = engine or get_db_engine()
+    if engine is None:
+        return {name: None for name in queries}
+    params = params or {}
+
+    if not parallel:
+        def run_all():
+            with engine.connect() as conn:
+                return {name: _run_on(conn, name, sql, params.get(name), timeout_ms) for name, sql in queries.items()}
+        try:
+            return with_retry(run_all, what="query batch")
+        except DBAPIError as e:
+            print(f"[DB QUERY ERROR] query batch failed after retries: {e}")
+            return {name: None for name in queries}
+
+    def run_one(item):
+        name, sql = item
+        def run():
+            with engine.connect() as conn:
+                return _run_on(conn, name, sql, params.get(name), timeout_ms)
+        try:
+            return name, with_retry(run, what=name)
+        except DBAPIError as e:
+            print(f"[DB QUERY ERROR] {name} failed after retries: {e}")
+            return name, None
+
+    workers = max_workers or min(len(queries), POOL_SIZE + MAX_OVERFLOW) or 1
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(run_one, queries.items()))
+
+
+def _to_arrow(data):
+    table = data if isinstance(data, pa.Table) else pa.Table.from_pandas(data, preserve_index=False)
+    # Postgres timestamps stop at microseconds
+    return table.cast(pa.schema([
+        pa.field(f.name, pa.timestamp('us', tz=f.type.tz)) if pa.types.is_timestamp(f.type) else f
+        for f in table.schema
+    ]))
+
+
+def _copy_into(cur, table, target_name, chunk_rows):
+    columns = ", ".join(f'"{name}"' for name in table.column_names)
+    copy_sql = f'COPY "{target_name}" ({columns}) FROM STDIN WITH (FORMAT csv)'
+    for batch in table.to_batches(max_chunksize=chunk_rows):
+        buf = io.BytesIO()
+        pa_csv.write_csv(batch, buf, pa_csv.WriteOptions(include_header=False))
+        buf.seek(0)
+        cur.copy_expert(copy_sql, buf)
+
+
+def _report(table_name, rows, started, verb="COPY"):
+    elapsed = time.perf_counter() - started
+    rate = rows / elapsed if elapsed > 0 else float('inf')
+    print(f"[DB LOAD] {verb} {rows} rows into {table_name} in {elapsed:.2f}s ({rate:,.0f} rows/sec)")
+
+
+def table_exists(engine, table_name):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("SELECT to_regclass(%s)", (table_name,)).scalar() is not None
+
+
+def _index_sql(table_name, columns):
+    column_list = ", ".join(f'"{c}"' for c in columns)
+    return f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_{"_".join(columns)}" ON "{table_name}" ({column_list})'
+
+
+class CopyLoader:
+    """Streaming form of copy_load: write() COPYs record batches into a staging table as they
+    arrive; close() swaps it in place of table_name in one transaction. indexes is a list of
+    column lists, (re)created on the swapped-in table."""
+
+    def __init__(self, engine, table_name, schema, chunk_rows=500_000, indexes=None):
+        self.table_name = table_name
+        self.indexes = indexes or []
+        self.staging_name = f"{table_name}_staging"
+        self.schema = _to_arrow(schema.empty_table()).schema
+        self.chunk_rows = chunk_rows
+        self.rows = 0
+        self.started = time.perf_counter()
+
+        # Same column types to_sql would have created
+        create_sql = pd.io.sql.get_schema(self.schema.empty_table().to_pandas(), self.staging_name, con=engine)
+
+        self.conn = engine.raw_connection()
+        try:
+            self.cur = self.conn.cursor()
+            self.cur.execute(f'DROP TABLE IF EXISTS "{self.staging_name}"')
+            self.cur.execute(create_sql)
+        except Exception:
+            self.abort()
+            raise
+
+    def write(self, data):
+        table = _to_arrow(data).cast(self.schema)
+        _copy_into(self.cur, table, self.staging_name, self.chunk_rows)
+        self.rows += table.num_rows
+
+    def close(self):
+        try:
+            # DDL is transactional in Postgres: readers see either the old table or the new one
+            self.cur.execute(f'DROP TABLE IF EXISTS "{self.table_name}"')
+            self.cur.execute(f'ALTER TABLE "{self.staging_name}" RENAME TO "{self.table_name}"')
+            for columns in self.indexes:
+                self.cur.execute(_index_sql(self.table_name, columns))
+            self.conn.commit()
+        except Exception:
+            self.abort()
+            raise
+        self.conn.close()
+        _report(self.table_name, self.rows, self.started)
+        return self.rows
+
+    def abort(self):
+        try:
+            self.conn.rollback()
+        finally:
+            self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+def copy_load(engine, data, table_name, chunk_rows=500_000, indexes=None):
+    """Bulk-loads a DataFrame or Arrow table with COPY FROM STDIN (CSV chunks) into a staging
+    table, then swaps it in place of table_name in one transaction. Returns the rows loaded."""
+    table = _to_arrow(data)
+    with CopyLoader(engine, table_name, table.schema, chunk_rows, indexes) as loader:
+        loader.write(table)
+    return loader.rows
+
+
+def copy_insert_new(engine, data, table_name, key_columns, null_safe=False, chunk_rows=500_000):
+    """Insert-only load: COPYs into a temp table and inserts only rows whose key columns are not
+    stored yet. Creates the table on first use and keeps an index on the key columns. Returns rows inserted.
+    null_safe matches NULL keys too, at the cost of the index (only for small descriptive tables).
+    Safe to run from several processes at once (e.g. ingest shards) on the same table: the COPYs into the
+    temp tables run in parallel, the NOT EXISTS insert holds a per-table advisory lock."""
+    key_list = ", ".join(f'"{c}"' for c in key_columns)
+    index_sql = f'CREATE INDEX IF NOT EXISTS "ix_{table_name}_keys" ON "{table_name}" ({key_list})'
+
+    table = _to_arrow(data)
+
+    if not table_exists(engine, table_name):
+        # Loaders that all find the table missing would each create it; the advisory lock lets
+        # exactly one do so, the others wait for it and then insert like any later load
+        create_sql = pd.io.sql.get_schema(table.schema.empty_table().to_pandas(), table_name, con=engine)
+        with engine.begin() as conn:
+            conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext(%s))", (table_name,))
+            conn.exec_driver_sql(create_sql.replace("CREATE TABLE", "CREATE TABLE IF NOT EXISTS", 1))
+            conn.exec_driver_sql(index_sql)
+
+    staging_name = f"{table_name}_incoming"
+    columns = ", ".join(f'"{name}"' for name in table.column_names)
+    op = "IS NOT DISTINCT FROM" if null_safe else "="
+    key_match = " AND ".join(f't."{c}" {op} s."{c}"' for c in key_columns)
+    insert_sql = (
+        f'INSERT INTO "{table_name}" ({columns}) SELECT {columns} FROM "{staging_name}" s '
+        f'WHERE NOT EXISTS (SELECT 1 FROM "{table_name}" t WHERE {key_match})'
+    )
+
+    started = time.perf_counter()
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        # CREATE INDEX locks out concurrent inserts even when the index exists, so only run it when missing
+        cur.execute("SELECT to_regclass(%s)", (f'"ix_{table_name}_keys"',))
+        if cur.fetchone()[0] is None:
+            cur.execute(index_sql)
+        cur.execute(f'CREATE TEMP TABLE "{staging_name}" (LIKE "{table_name}") ON COMMIT DROP')
+        _copy_into(cur, table, staging_name, chunk_rows)
+        # Two loaders inserting the same keys would both pass NOT EXISTS under READ COMMITTED; one at a time,
+        # each INSERT's snapshot (taken after the lock) sees what the previous one committed
+        cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (table_name,))
+        cur.execute(insert_sql)
+        inserted = cur.rowcount
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+    _report(table_name, inserted, started, verb="INSERT (new only)")
+    return inserted
@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import time
+import resource
+import cProfile
+from contextlib import contextmanager
+from datetime import datetime
+
+# Stage metrics shared by the pipeline scripts. Every stage prints one "[METRICS] {json}" line;
+# emit_summary() prints all stages of the run as the script's last stdout line, which the
+# Airflow BashOperator pushes to XCom.
+METRICS_FILE_ENV = "PIPELINE_METRICS_FILE"   # also append the JSON lines to this file
+PROFILE_DIR_ENV = "PIPELINE_PROFILE_DIR"     # dump a cProfile .prof per stage into this directory
+
+_stages = []
+
+
+def peak_rss_mb():
+    """High-water mark of this process so far (ru_maxrss is KiB on Linux, bytes on macOS)."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+def _script_name():
+    return os.path.splitext(os.path.basename(sys.argv[0] or "python"))[0]
+
+
+def _write(record):
+    line = json.dumps(record, default=str)
+    print(f"[METRICS] {line}", flush=True)
+    path = os.environ.get(METRICS_FILE_ENV)
+    if path:
+        with open(path, 'a') as f:
+            f.write(line + "\n")
+
+
+class Stage:
+    """Counters for one stage; the body adds rows/bytes as it goes (st.rows += n)."""
+
+    def __init__(self, name, rows=0, bytes=0, **fields):
+        self.name = name
+        self.rows = rows
+        self.bytes = bytes
+        self.fields = fields
+
+    def record(self, seconds, status):
+        record = {
+            "event": "stage",
+            "script": _script_name(),
+            "stage": self.name,
+            "status": status,
+            "seconds": round(seconds, 3),
+            "rows": self.rows,
+            "bytes": self.bytes,
+            "rows_per_sec": round(self.rows / seconds, 1) if self.rows and seconds > 0 else None,
+            "mb_per_sec": round(self.bytes / seconds / (1024 * 1024), 2) if self.bytes and seconds > 0 else None,
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "finished_at": datetime.now().isoformat(),
+        }
+        record.update(self.fields)
+        return record
+
+
+@contextmanager
+def stage(name, rows=0, bytes=0, **fields):
+    """Times a block and records rows, bytes and peak RSS. Extra keyword fields go into the record as-is.
+
+    With PIPELINE_PROFILE_DIR set, the block also runs under cProfile (open the .prof with
+    snakeviz or pstats). py-spy needs no hook: `py-spy record -- python <script>` and match the stage timestamps."""
+    st = Stage(name, rows, bytes, **fields)
+
+    profile_dir = os.environ.get(PROFILE_DIR_ENV)
+    profiler = None
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    started = time.perf_counter()
+    status = "ok"
+    try:
+        yield st
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(os.path.join(profile_dir, f"{_script_name()}_{name}_{os.getpid()}.prof"))
+        record = st.record(seconds, status)
+        _stages.append(record)
+        _write(record)
+
+
+def stages():
+    return list(_stages)
+
+
+def emit_summary():
+    """Prints every stage of this run as one JSON line. Call last: BashOperator pushes the final stdout line to XCom."""
+    summary = {
+        "script": _script_name(),
+        "total_seconds": round(sum(s["seconds"] for s in _stages), 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stages": {s["stage"]: {k: s[k] for k in ("seconds", "rows", "rows_per_sec", "peak_rss_mb", "status")} for s in _stages},
+    }
+    print(json.dumps(summary, default=str), flush=True)
+    return summary
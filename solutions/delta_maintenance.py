@@ -0,0 +1,163 @@
+import os; import sys
+import glob
+import json
+import argparse
+from datetime import datetime
+import pyarrow as pa
+from deltalake import DeltaTable
+sys.path.insert(0, "/opt/airflow")
+from mart_etl import MART_VAULT_DIR, MART_ZORDER, MAINTENANCE_OPERATIONS
+
+# Files older than this (and no longer referenced by the latest version) are removed by vacuum.
+# Time travel only reaches versions whose files are still inside the window. 168h is the Delta default.
+DEFAULT_RETENTION_HOURS = 168
+# Compaction target per file; the marts are tiny, so this folds each table into a single part
+DEFAULT_TARGET_SIZE = 128 * 1024 * 1024
+
+
+def delta_tables(mart_dir):
+    return sorted(path for path in glob.glob(os.path.join(mart_dir, "*_delta")) if os.path.isdir(os.path.join(path, "_delta_log")))
+
+
+def table_stats(path):
+    """Latest version, log length and the live (latest version) vs on-disk file count and size."""
+    dt = DeltaTable(path)
+    actions = pa.table(dt.get_add_actions(flatten=True)).to_pydict()
+
+    disk_files = disk_bytes = 0
+    for root, dirs, files in os.walk(path):
+        dirs[:] = [d for d in dirs if d != "_delta_log"]
+        for filename in files:
+            if filename.endswith(".parquet"):
+                disk_files += 1
+                disk_bytes += os.path.getsize(os.path.join(root, filename))
+
+    log_dir = os.path.join(path, "_delta_log")
+    return {
+        "version": dt.version(),
+        "log_versions": len(glob.glob(os.path.join(log_dir, "*.json"))),
+        "checkpoints": len(glob.glob(os.path.join(log_dir, "*.checkpoint.parquet"))),
+        "live_files": len(actions.get("path", [])),
+        "live_bytes": sum(actions.get("size_bytes", [])),
+        "disk_files": disk_files,
+        "disk_bytes": disk_bytes,
+    }
+
+
+def optimize_reason(dt):
+    """Why the table needs compaction, or None when another optimize would only rewrite unchanged data
+    (already one live file per partition, or no data committed since the last OPTIMIZE)."""
+    actions = pa.table(dt.get_add_actions(flatten=True))
+    partition_columns = [name for name in actions.column_names if name.startswith("partition.")]
+    partitions = len(actions.group_by(partition_columns).aggregate([])) if partition_columns else min(actions.num_rows, 1)
+    if actions.num_rows <= partitions:
+        return None
+
+    for commit in dt.history():
+        # Newest first: stop at the last OPTIMIZE
+        if commit.get("operation") == "OPTIMIZE":
+            return None
+        if commit.get("operation") not in MAINTENANCE_OPERATIONS:
+            return f"{actions.num_rows} live files in {partitions} partition(s)"
+    return f"{actions.num_rows} live files, never optimized"
+
+
+def maintain_table(path, retention_hours=DEFAULT_RETENTION_HOURS, target_size=DEFAULT_TARGET_SIZE, dry_run=False):
+    """Compact -> checkpoint -> expire old log entries -> vacuum. Returns the before/after report for one table."""
+    before = table_stats(path)
+    report = {"table": os.path.basename(path), "before": before}
+
+    dt = DeltaTable(path)
+    if dry_run:
+        report["would_vacuum"] = len(dt.vacuum(retention_hours=retention_hours, dry_run=True, enforce_retention_duration=False))
+        return report
+
+    # 1. Compaction: rewrite the small per-run parts into target_size files (a new version, old parts become tombstones).
+    #    Tables with Z-order columns are clustered on them at the same time so file statistics prune point lookups.
+    #    Skipped when nothing new was written, so a scheduled run does not rewrite unchanged data into a new version.
+    zorder = MART_ZORDER.get(os.path.basename(path)[:-len("_delta")])
+    reason = optimize_reason(dt)
+    if reason is None:
+        report["compaction"] = {"files_removed": 0, "files_added": 0, "z_order": zorder, "skipped": True}
+    else:
+        if zorder:
+            compacted = dt.optimize.z_order(zorder, target_size=target_size)
+        else:
+            compacted = dt.optimize.compact(target_size=target_size)
+        report["compaction"] = {"files_removed": compacted["numFilesRemoved"], "files_added": compacted["numFilesAdded"],
+                                "z_order": zorder, "skipped": False, "reason": reason}
+
+    # 2. Checkpoint: readers load the state from one Parquet file instead of replaying every JSON commit
+    dt = DeltaTable(path)
+    dt.create_checkpoint()
+    dt.cleanup_metadata()
+
+    # 3. Vacuum: delete tombstoned parts older than the retention window
+    report["vacuumed_files"] = len(dt.vacuum(retention_hours=retention_hours, dry_run=False, enforce_retention_duration=False))
+
+    report["after"] = table_stats(path)
+    return report
+
+
+def _mb(n):
+    return f"{n / (1024 * 1024):.2f} MB"
+
+
+def print_report(report):
+    before, after = report["before"], report.get("after")
+    print(f"[MAINT] {report['table']}: version {before['version']}, {before['log_versions']} log versions, "
+          f"{before['disk_files']} files / {_mb(before['disk_bytes'])} on disk ({before['live_files']} live)")
+    if after is None:
+        print(f"[MAINT]   dry run: vacuum would remove {report['would_vacuum']} file(s)")
+        return
+    compaction = report['compaction']
+    if compaction['skipped']:
+        print(f"[MAINT]   compaction skipped (no new data since the last optimize), vacuumed {report['vacuumed_files']} file(s)")
+    else:
+        zorder = f" (z-order {', '.join(compaction['z_order'])})" if compaction['z_order'] else ""
+        print(f"[MAINT]   compacted {compaction['files_removed']} -> {compaction['files_added']} file(s){zorder} "
+              f"[{compaction['reason']}], vacuumed {report['vacuumed_files']} file(s)")
+    print(f"[MAINT]   now version {after['version']}, {after['log_versions']} log versions, {after['checkpoints']} checkpoint(s), "
+          f"{after['disk_files']} files / {_mb(after['disk_bytes'])} on disk")
+
+
+def main(mart_dir=MART_VAULT_DIR, retention_hours=DEFAULT_RETENTION_HOURS, target_size=DEFAULT_TARGET_SIZE,
+         dry_run=False, report_path=None):
+    print(f"\n{'='*50}\n{'DELTA LAKE MAINTENANCE':^50}\n{'='*50}")
+
+    tables = delta_tables(mart_dir)
+    if not tables:
+        print(f"[-] No Delta tables found in {mart_dir}")
+        return []
+
+    reports = []
+    for path in tables:
+        try:
+            report = maintain_table(path, retention_hours, target_size, dry_run)
+        except Exception as e:
+            print(f"[ERROR] Maintenance failed for {path}: {e}")
+            continue
+        print_report(report)
+        reports.append(report)
+
+    if report_path:
+        os.makedirs(os.path.dirname(os.path.abspath(report_path)), exist_ok=True)
+        with open(report_path, 'w') as f:
+            json.dump({"run_at": datetime.now().isoformat(), "retention_hours": retention_hours, "tables": reports}, f, indent=2)
+        print(f"[+] Report written to {report_path}")
+
+    print(f"\nMAINTENANCE COMPLETE: {len(reports)}/{len(tables)} Delta tables processed.")
+    return reports
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--mart-dir', default=MART_VAULT_DIR, help="Directory holding the *_delta tables")
+    parser.add_argument('--retention-hours', type=int, default=DEFAULT_RETENTION_HOURS,
+                        help="Vacuum files unreferenced for longer than this. Time travel cannot go further back.")
+    parser.add_argument('--target-size', type=int, default=DEFAULT_TARGET_SIZE, help="Compaction target file size in bytes")
+    parser.add_argument('--dry-run', action='store_true', help="Only report what vacuum would remove")
+    parser.add_argument('--report', default=None, help="Write the before/after report as JSON to this path")
+    args = parser.parse_args()
+
+    main(args.mart_dir, args.retention_hours, args.target_size, args.dry_run, args.report)
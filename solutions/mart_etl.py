@@ -1,144 +1,518 @@
 import os; import sys
+import json
 import argparse
 import pandas as pd
 from datetime import datetime
 # Python utility imports for Delta Lake and Arrow
 import pyarrow as pa
-from deltalake import write_deltalake 
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from deltalake import DeltaTable, write_deltalake 
 sys.path.insert(0, "/opt/airflow")
-from db_utils import get_db_engine 
+from db_utils import get_db_engine, close_db_engine, run_queries
+from vault_io import scan_vault_table, vault_table_files
+from mart_serving import publish_mart
+from pipeline_metrics import stage, emit_summary
 
 # --- OUTPUT CONFIGURATION ---
 # The target directory where the final Delta Lake files will be stored
 MART_VAULT_DIR = "/opt/airflow/processed_data/mart_vault"
+# Per-link partial aggregates and the sat_seismic_data files already folded into them (incremental refresh)
+PARTIALS_TABLE = "mart_link_partials"
+MART_STATE_NAME = "mart_state.json"
+# Delta commits that only reorganize files (delta_maintenance.py); the table's data is unchanged by them
+MAINTENANCE_OPERATIONS = {"OPTIMIZE", "VACUUM START", "VACUUM END"}
 
+MART_TABLES = ["mart_well_performance", "mart_sensor_analysis", "mart_survey_summary"]
+# Group keys of each mart, used as the Delta MERGE condition
+MART_KEYS = {
+    "mart_well_performance": ["well_id", "source_format"],
+    "mart_sensor_analysis": ["survey_type"],
+    "mart_survey_summary": ["survey_type", "source_format"],
+}
+# Layout for the columns dashboards filter on: Delta partitions for low-cardinality survey_type,
+# Z-order (applied by delta_maintenance.py) for high-cardinality keys, Postgres indexes for Superset
+# (built on every versioned serving table, see mart_serving.py)
+MART_PARTITIONS = {
+    "mart_sensor_analysis": ["survey_type"],
+    "mart_survey_summary": ["survey_type"],
+}
+MART_ZORDER = {
+    "mart_well_performance": ["well_id"],
+    PARTIALS_TABLE: ["link_survey_well_key"],
+}
+MART_INDEXES = {
+    "mart_well_performance": [["well_id"]],
+    "mart_sensor_analysis": [["survey_type"]],
+    "mart_survey_summary": [["survey_type"]],
+}
+SEISMIC_PARTIAL_INPUTS = ["link_survey_well_key", "depth", "amplitude", "quality_flag", "ingest_timestamp"]
 
-def write_mart_table(df, table_name, engine):
-    """Writes a DataFrame to PostgreSQL and the final Mart Delta Lake file for time travel."""
-    os.makedirs(MART_VAULT_DIR, exist_ok=True)
-    
-    # 1. Write to PostgreSQL 
+
+def write_postgres_mart(df, table_name, engine, delta_version):
+    """Publishes the mart to Superset as the given Delta version: versioned table, then an atomic view swap."""
     if engine:
         try:
-            df.to_sql(table_name, engine, if_exists='replace', index=False)
-            print(f"[DB LOAD] Wrote {len(df)} rows to PostgreSQL table: {table_name}")
+            publish_mart(engine, df, table_name, delta_version, indexes=MART_INDEXES.get(table_name))
         except Exception as e:
             print(f"[DB ERROR] Failed to write to PostgreSQL {table_name}: {e}")
-            
-    # 2. Write final output to Delta Lake format for Time Travel (BONUS)
+
+
+def write_mart_table(df, table_name, engine):
+    """Writes the final Mart Delta Lake file for time travel, then publishes that version to PostgreSQL."""
+    os.makedirs(MART_VAULT_DIR, exist_ok=True)
+
+    # 1. Write final output to Delta Lake format for Time Travel (BONUS)
     delta_path = os.path.join(MART_VAULT_DIR, f"{table_name}_delta") 
     
     # Convert Pandas DataFrame to Arrow Table
     arrow_table = pa.Table.from_pandas(df) 
     
     # Write to Delta Lake format, enabling versioning/time travel
-    write_deltalake(
-        delta_path, 
-        arrow_table, 
-        mode='overwrite', 
-    )
+    with stage(f"mart_delta_{table_name}", rows=len(df), bytes=arrow_table.nbytes):
+        write_deltalake(
+            delta_path, 
+            arrow_table, 
+            mode='overwrite', 
+            partition_by=MART_PARTITIONS.get(table_name),
+            # Lets an overwrite change the partition layout of an existing table
+            schema_mode='overwrite',
+        )
     print(f"[FILE LOAD] Wrote {len(df)} rows to Delta Lake (Time Travel Enabled): {delta_path}")
 
+    # 2. Serve the version just written (the Delta version is the serving cache key)
+    with stage(f"mart_postgres_{table_name}", rows=len(df)):
+        write_postgres_mart(df, table_name, engine, DeltaTable(delta_path).version())
+
+
+def is_delta_table(path):
+    return os.path.isdir(os.path.join(path, "_delta_log"))
+
+
+def merge_delta(path, df, keys):
+    """Upserts df into the Delta table at path on keys. Matched rows are only rewritten when a value changed."""
+    on = " AND ".join(f"(t.{k} IS NOT DISTINCT FROM s.{k})" for k in keys)
+    changed = " OR ".join(f"(t.{c} IS DISTINCT FROM s.{c})" for c in df.columns if c not in keys)
+    return (
+        DeltaTable(path)
+        .merge(pa.Table.from_pandas(df, preserve_index=False), predicate=on, source_alias="s", target_alias="t")
+        .when_matched_update_all(predicate=changed)
+        .when_not_matched_insert_all()
+        .execute()
+    )
+
+
+def merge_mart_table(df, table_name, engine):
+    """Incremental counterpart of write_mart_table: Delta MERGE on the mart's group keys instead of an overwrite."""
+    delta_path = os.path.join(MART_VAULT_DIR, f"{table_name}_delta")
+    if not is_delta_table(delta_path):
+        write_mart_table(df, table_name, engine)
+        return
+
+    with stage(f"mart_delta_merge_{table_name}", rows=len(df)):
+        metrics = merge_delta(delta_path, df, MART_KEYS[table_name])
+    print(f"[FILE LOAD] Merged into Delta Lake: {metrics['num_target_rows_updated']} updated, "
+          f"{metrics['num_target_rows_inserted']} inserted: {delta_path}")
+
+    # The Postgres mart is a few dozen rolled-up rows, a full versioned table per Delta version stays cheap
+    with stage(f"mart_postgres_{table_name}", rows=len(df)):
+        write_postgres_mart(df, table_name, engine, DeltaTable(delta_path).version())
+
+
+def read_vault_arrow(raw_vault_dir, table_name, columns, filter=None, partition_filter=None):
+    """Arrow table over a raw-vault table (base file, incremental parts, hive partitions), reading only `columns`.
+    The filters are passed on to vault_io.scan_vault_table."""
+    table = scan_vault_table(raw_vault_dir, table_name, columns, filter=filter, partition_filter=partition_filter)
+    if table is None:
+        raise FileNotFoundError(f"{table_name} not found in {raw_vault_dir}")
+    return table
+
+
+# Mergeable per-link partial aggregates; every mart metric is derived from these
+PARTIAL_COLUMNS = ["readings", "amplitude_sum", "amplitude_count", "quality_flags", "earliest_timestamp", "latest_timestamp"]
+
+
+def link_partials_frame(df_seismic_sat):
+    """Single pass over the seismic rows (pandas): group on an integer surrogate of the link key."""
+    codes, link_keys = pd.factorize(df_seismic_sat["link_survey_well_key"])
+    is_flagged = (df_seismic_sat["quality_flag"] == 1).astype("int64")
+
+    partials = pd.DataFrame({
+        "code": codes,
+        "depth": df_seismic_sat["depth"].to_numpy(),
+        "amplitude": df_seismic_sat["amplitude"].to_numpy(),
+        "is_flagged": is_flagged.to_numpy(),
+        "ingest_timestamp": df_seismic_sat["ingest_timestamp"].to_numpy(),
+    }).groupby("code", sort=False).agg(
+        readings=("depth", "count"),
+        amplitude_sum=("amplitude", "sum"),
+        amplitude_count=("amplitude", "count"),
+        quality_flags=("is_flagged", "sum"),
+        earliest_timestamp=("ingest_timestamp", "min"),
+        latest_timestamp=("ingest_timestamp", "max"),
+    )
+
+    partials.insert(0, "link_survey_well_key", link_keys[partials.index.to_numpy()])
+    return partials.reset_index(drop=True)
+
+
+def link_partials_arrow(seismic_table):
+    """Single pass over the seismic rows (Arrow): dictionary-encode the link key and group on the int indices."""
+    encoded = pc.dictionary_encode(seismic_table["link_survey_well_key"]).combine_chunks()
+    table = pa.table({
+        "code": encoded.indices,
+        "depth": seismic_table["depth"],
+        "amplitude": seismic_table["amplitude"],
+        # (quality_flag == 1) as a summable column instead of a Python lambda per group
+        "is_flagged": pc.cast(pc.equal(seismic_table["quality_flag"], 1), pa.int64()),
+        "ingest_timestamp": seismic_table["ingest_timestamp"],
+    })
+
+    aggregations = [
+        ("depth", "count"), ("amplitude", "sum"), ("amplitude", "count"),
+        ("is_flagged", "sum"), ("ingest_timestamp", "min"), ("ingest_timestamp", "max"),
+    ]
+    grouped = table.group_by("code").aggregate(aggregations)
+
+    partials = pd.DataFrame({
+        "link_survey_well_key": encoded.dictionary.take(grouped["code"]).to_numpy(zero_copy_only=False),
+        **{name: grouped[f"{col}_{func}"].to_numpy(zero_copy_only=False) for name, (col, func) in zip(PARTIAL_COLUMNS, aggregations)},
+    })
+    # Arrow sums of all-null groups are null, pandas gives 0
+    partials[["amplitude_sum", "quality_flags"]] = partials[["amplitude_sum", "quality_flags"]].fillna(0)
+    return partials
+
+
+def rollup_marts(partials, df_link, df_well_hub, df_survey_hub, df_survey_sat):
+    """Rolls the per-link partials up to the three marts with Arrow joins and group_by.
+    Only small dimension tables are joined; the marts come back as DataFrames sorted by their keys."""
+    def arrow(df):
+        return pa.Table.from_pandas(df, preserve_index=False)
+
+    def distinct(table, keys):
+        return table.group_by(keys).aggregate([])
+
+    # Link -> well_id / survey_type_id / survey_type / source_format (a few rows per survey/well pair)
+    dims = distinct(arrow(df_link), ["link_survey_well_key", "hub_survey_key", "hub_well_key"])
+    dims = dims.join(arrow(df_well_hub), "hub_well_key", join_type="inner")
+    dims = dims.join(arrow(df_survey_hub), "hub_survey_key", join_type="inner")
+    dims = dims.join(arrow(df_survey_sat), "survey_type_id", join_type="left outer")
+
+    parts = arrow(partials).join(dims, "link_survey_well_key", join_type="inner")
+
+    def sort(table, keys):
+        return table.sort_by([(k, "ascending") for k in keys])
+
+    def ratio(num, den):
+        # Float division like pandas (x / 0 -> inf/nan instead of an error)
+        return pc.divide(pc.cast(num, pa.float64()), pc.cast(den, pa.float64()))
+
+    def rollup(keys):
+        # Rows with a null group key are left out, as in a pandas groupby
+        valid = parts
+        for k in keys:
+            valid = valid.filter(pc.is_valid(valid[k]))
+        mart = valid.group_by(keys).aggregate([
+            ("readings", "sum"), ("amplitude_sum", "sum"), ("amplitude_count", "sum"),
+            ("quality_flags", "sum"), ("earliest_timestamp", "min"), ("latest_timestamp", "max"),
+        ])
+        mart = pa.table({
+            **{k: mart[k] for k in keys},
+            "total_readings": mart["readings_sum"],
+            "amplitude_sum": mart["amplitude_sum_sum"],
+            "amplitude_count": mart["amplitude_count_sum"],
+            "total_quality_flags": mart["quality_flags_sum"],
+            "earliest_timestamp": mart["earliest_timestamp_min"],
+            "latest_timestamp": mart["latest_timestamp_max"],
+        })
+        mart = mart.append_column("avg_amplitude", ratio(mart["amplitude_sum"], mart["amplitude_count"]))
+        mart = mart.append_column("data_quality_rate", ratio(mart["total_quality_flags"], mart["total_readings"]))
+        return sort(mart, keys)
+
+    # --- mart_well_performance (Well Performance Summary) ---
+    mart_well = rollup(["well_id", "source_format"]).select(
+        ["well_id", "source_format", "total_readings", "avg_amplitude", "data_quality_rate"]
+    ).to_pandas()
+
+    # --- mart_sensor_analysis: 'survey_type' acts as a proxy for 'sensor type' ---
+    mart_sensor = rollup(["survey_type"]).select(
+        ["survey_type", "total_readings", "avg_amplitude", "data_quality_rate"]
+    ).to_pandas()
+
+    # --- mart_survey_summary (Data Acquisition Summary) ---
+    # Wells surveyed per survey type come from the link table, not from the traces
+    link_wells = distinct(arrow(df_link), ["hub_survey_key", "hub_well_key"])
+    link_wells = link_wells.join(arrow(df_survey_hub), "hub_survey_key", join_type="inner")
+    wells_surveyed = link_wells.group_by("survey_type_id").aggregate([("hub_well_key", "count_distinct")]) \
+        .rename_columns(["survey_type_id", "wells_surveyed_count"])
+
+    survey_keys = ["survey_type", "source_format", "survey_type_id"]
+    mart_survey_metrics = rollup(survey_keys)
+    # Joins do not keep row order, so sort by the rollup keys again
+    mart_survey_summary = sort(mart_survey_metrics.join(wells_surveyed, "survey_type_id", join_type="left outer"), survey_keys).select([
+        'survey_type', 'source_format', 'wells_surveyed_count', 'total_readings',
+        'avg_amplitude', 'earliest_timestamp', 'latest_timestamp'
+    ]).to_pandas()
+
+    return mart_well, mart_sensor, mart_survey_summary
+
+
+def merge_partials(*frames):
+    """Folds partial aggregates for the same link together (sums add up, min/max of the timestamps)."""
+    combined = pd.concat([f for f in frames if f is not None and not f.empty], ignore_index=True)
+    return combined.groupby("link_survey_well_key", sort=False).agg(
+        readings=("readings", "sum"),
+        amplitude_sum=("amplitude_sum", "sum"),
+        amplitude_count=("amplitude_count", "sum"),
+        quality_flags=("quality_flags", "sum"),
+        earliest_timestamp=("earliest_timestamp", "min"),
+        latest_timestamp=("latest_timestamp", "max"),
+    ).reset_index()
+
+
+def read_dimensions(raw_vault_dir):
+    """(df_link, df_well_hub, df_survey_hub, df_survey_sat) in the order rollup_marts takes them."""
+    df_well_hub = read_vault_arrow(raw_vault_dir, "hub_well", ["hub_well_key", "well_id"]).to_pandas()
+    df_survey_hub = read_vault_arrow(raw_vault_dir, "hub_survey", ["hub_survey_key", "survey_type_id"]).to_pandas()
+    df_link = read_vault_arrow(raw_vault_dir, "link_survey_well", ["link_survey_well_key", "hub_survey_key", "hub_well_key"]).to_pandas()
+    df_survey_sat = read_vault_arrow(raw_vault_dir, "sat_survey_details", ["survey_type_id", "survey_type", "source_format"]).to_pandas().drop_duplicates()
+    return df_link, df_well_hub, df_survey_hub, df_survey_sat
+
+
+def count_rows(files):
+    # Footer metadata only, no data pages are read
+    return ds.dataset(files, format="parquet").count_rows()
+
+
+def seismic_partials(files):
+    """Per-link partials over the given sat_seismic_data files, aggregated in one Arrow pass."""
+    return link_partials_arrow(ds.dataset(files, format="parquet").to_table(columns=SEISMIC_PARTIAL_INPUTS))
+
+
+def file_signature(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns]
+
+
+def load_mart_state():
+    path = os.path.join(MART_VAULT_DIR, MART_STATE_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def seismic_file_signatures(raw_vault_dir, seismic_files):
+    # Keyed by path relative to raw_vault: partitioned parts share their file names
+    return {os.path.relpath(f, raw_vault_dir): file_signature(f) for f in seismic_files}
+
+
+def save_partials(partials, raw_vault_dir, seismic_files):
+    """Persists the full per-link partials and the files they cover, so the next --incremental run can start from them."""
+    os.makedirs(MART_VAULT_DIR, exist_ok=True)
+    partials_path = os.path.join(MART_VAULT_DIR, f"{PARTIALS_TABLE}_delta")
+    write_deltalake(partials_path, pa.Table.from_pandas(partials, preserve_index=False), mode='overwrite')
+    save_mart_state(raw_vault_dir, seismic_files, DeltaTable(partials_path).version())
+
+
+def save_mart_state(raw_vault_dir, seismic_files, partials_version):
+    """Records the folded files with the partials version that covers them. Written last: a run that fails
+    earlier leaves the previous state, and the next run rewinds the partials to its version (rewind_partials)."""
+    path = os.path.join(MART_VAULT_DIR, MART_STATE_NAME)
+    state = {"sat_seismic_data": seismic_file_signatures(raw_vault_dir, seismic_files), "partials_version": partials_version}
+    with open(path + ".tmp", 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(path + ".tmp", path)
+
+
+def rewind_partials(partials_path, version):
+    """Brings the partials back to the version the mart state was saved with. Newer data commits come from
+    a run that failed after its partials merge; left in place, their files would be folded in twice.
+    Returns False when that version can no longer be restored (e.g. vacuumed)."""
+    dt = DeltaTable(partials_path)
+    later = [c for c in dt.history() if c.get("version", -1) > version]
+    if all(c.get("operation") in MAINTENANCE_OPERATIONS for c in later):
+        return True
+    print(f"[*] Mart partials changed after the last recorded refresh (version {version} -> {dt.version()}). Restoring version {version}.")
+    try:
+        dt.restore(version)
+    except Exception as e:
+        print(f"[-] Could not restore the mart partials to version {version}: {e}")
+        return False
+    return True
+
+
+def build_marts_parquet(data_dir):
+    """Parquet-native mode: compute in-process from raw_vault Parquet, use Postgres only as a sink."""
+    engine = get_db_engine()
+    raw_vault_dir = os.path.join(data_dir, "raw_vault")
+
+    print(f"\n{'='*50}\n{'BUILDING AGGREGATED ANALYTICS MARTS':^50}\n{'='*50}")
+
+    try:
+        print(f"[*] Reading Raw Data Vault Parquet from {raw_vault_dir}...")
+        with stage("mart_read_dimensions"):
+            dims = read_dimensions(raw_vault_dir)
+        seismic_files = vault_table_files(raw_vault_dir, "sat_seismic_data")
+        if not seismic_files:
+            raise FileNotFoundError(f"sat_seismic_data not found in {raw_vault_dir}")
+        with stage("mart_partials", files=len(seismic_files)) as st:
+            st.rows = count_rows(seismic_files)
+            partials = seismic_partials(seismic_files)
+        with stage("mart_rollup", rows=len(partials)):
+            marts = rollup_marts(partials, *dims)
+    except Exception as e:
+        print(f"[ERROR] Failed to build marts from raw vault Parquet: {e}. Ensure task2_build.py ran successfully.")
+        return False
+
+    for table_name, mart in zip(MART_TABLES, marts):
+        print(f"\n[*] Building {table_name}...")
+        write_mart_table(mart, table_name, engine)
+
+    save_partials(partials, raw_vault_dir, seismic_files)
+
+    if engine is not None:
+        close_db_engine()
+
+    print(f"\nINFORMATION MART BUILD COMPLETE: 3 Aggregation tables created with Delta Lake time travel enabled.")
+    return True
+
+
+def refresh_marts_incremental(data_dir):
+    """Folds only the sat_seismic_data files loaded since the last mart version into the stored partials,
+    then MERGEs the changed mart rows. Falls back to a full build when there is no usable state.
+    Returns False on failure; re-running is safe, the partials are rewound to the last recorded state first."""
+    raw_vault_dir = os.path.join(data_dir, "raw_vault")
+    partials_path = os.path.join(MART_VAULT_DIR, f"{PARTIALS_TABLE}_delta")
+
+    seismic_files = vault_table_files(raw_vault_dir, "sat_seismic_data")
+    state = load_mart_state()
+    folded = state.get("sat_seismic_data", {})
+    current = seismic_file_signatures(raw_vault_dir, seismic_files)
+
+    # A full vault load rewrites the base file and drops the increments, so the partials no longer apply.
+    # A state without partials_version predates it and cannot tell whether the partials match the files.
+    if (not folded or "partials_version" not in state or not is_delta_table(partials_path)
+            or any(current.get(name) != sig for name, sig in folded.items())):
+        print("[*] No reusable mart partials (first run or the raw vault was fully reloaded). Running a full build.")
+        return build_marts_parquet(data_dir)
+    if not rewind_partials(partials_path, state["partials_version"]):
+        print("[*] Running a full build instead.")
+        return build_marts_parquet(data_dir)
+
+    new_files = [f for f in seismic_files if os.path.relpath(f, raw_vault_dir) not in folded]
+
+    print(f"\n{'='*50}\n{'REFRESHING ANALYTICS MARTS (INCREMENTAL)':^50}\n{'='*50}")
+    if not new_files:
+        print("[*] No sat_seismic_data loaded since the last mart refresh. Marts are up to date.")
+        return True
+
+    engine = get_db_engine()
+    try:
+        print(f"[*] Folding {len(new_files)} new sat_seismic_data file(s) into the mart partials...")
+        with stage("mart_partials", files=len(new_files), incremental=True) as st:
+            st.rows = count_rows(new_files)
+            delta = seismic_partials(new_files)
+            partials = merge_partials(DeltaTable(partials_path).to_pandas(), delta)
+            touched = partials[partials["link_survey_well_key"].isin(delta["link_survey_well_key"])]
+
+            metrics = merge_delta(partials_path, touched, ["link_survey_well_key"])
+        print(f"[FILE LOAD] Merged {len(touched)} link partials ({metrics['num_target_rows_inserted']} new links): {partials_path}")
+
+        with stage("mart_read_dimensions"):
+            dims = read_dimensions(raw_vault_dir)
+        with stage("mart_rollup", rows=len(partials)):
+            marts = rollup_marts(partials, *dims)
+    except Exception as e:
+        print(f"[ERROR] Incremental mart refresh failed: {e}. Re-run to retry from the last recorded state.")
+        return False
+
+    for table_name, mart in zip(MART_TABLES, marts):
+        print(f"\n[*] Refreshing {table_name}...")
+        merge_mart_table(mart, table_name, engine)
+
+    save_mart_state(raw_vault_dir, seismic_files, DeltaTable(partials_path).version())
+
+    if engine is not None:
+        close_db_engine()
+
+    print(f"\nINFORMATION MART REFRESH COMPLETE: folded {len(new_files)} new file(s) into 3 Aggregation tables.")
+    return True
+
 
 def build_aggregated_marts(data_dir):
     engine = get_db_engine()
     if not engine:
-        return
+        return False
 
     print(f"\n{'='*50}\n{'BUILDING AGGREGATED ANALYTICS MARTS':^50}\n{'='*50}")
 
     # 1. READ REQUIRED RDV TABLES
     try:
         print("[*] Reading Raw Data Vault tables from PostgreSQL...")
-        # Hubs for keys
-        df_well_hub = pd.read_sql("SELECT hub_well_key, well_id FROM hub_well", engine)
-        df_survey_hub = pd.read_sql("SELECT hub_survey_key, survey_type_id FROM hub_survey", engine)
-        # Satellites for metrics and link
-        df_seismic_sat = pd.read_sql("SELECT link_survey_well_key, depth, amplitude, quality_flag, ingest_timestamp FROM sat_seismic_data", engine)
-        df_link = pd.read_sql("SELECT * FROM link_survey_well", engine)
-        df_survey_sat = pd.read_sql("SELECT survey_type_id, survey_type, source_format FROM sat_survey_details", engine).drop_duplicates()
+        with stage("mart_read_postgres") as st:
+            # Independent reads, each on its own pooled connection
+            tables = run_queries({
+                # Hubs for keys
+                "hub_well": "SELECT hub_well_key, well_id FROM hub_well",
+                "hub_survey": "SELECT hub_survey_key, survey_type_id FROM hub_survey",
+                # Satellites for metrics and link
+                "sat_seismic_data": "SELECT link_survey_well_key, depth, amplitude, quality_flag, ingest_timestamp FROM sat_seismic_data",
+                "link_survey_well": "SELECT * FROM link_survey_well",
+                "sat_survey_details": "SELECT survey_type_id, survey_type, source_format FROM sat_survey_details",
+            }, engine, parallel=True)
+            failed = [name for name, df in tables.items() if df is None]
+            if failed:
+                raise RuntimeError(f"could not read {', '.join(failed)}")
+
+            df_well_hub = tables["hub_well"]
+            df_survey_hub = tables["hub_survey"]
+            df_seismic_sat = tables["sat_seismic_data"]
+            df_link = tables["link_survey_well"]
+            df_survey_sat = tables["sat_survey_details"].drop_duplicates()
+            st.rows = len(df_seismic_sat)
         
     except Exception as e:
         print(f"[ERROR] Failed to read required RDV tables: {e}. Ensure task2_build.py ran successfully.")
-        return
+        return False
         
-    # --- MERGE CORE DATASETS FOR MART BUILDING ---
-    
-    # 1. Join Seismic Data to Link to get Hub Keys
-    df_core = pd.merge(df_seismic_sat, df_link, on='link_survey_well_key', how='inner')
-    
-    # 2. Join Hub Keys to Well and Survey IDs/Types
-    df_core = pd.merge(df_core, df_well_hub, on='hub_well_key', how='inner')
-    df_core = pd.merge(df_core, df_survey_hub, on='hub_survey_key', how='inner')
-    
-    # 3. Join Survey Type ID to get source format
-    df_core = pd.merge(df_core, df_survey_sat, on='survey_type_id', how='left')
+    # --- FUSED AGGREGATION: one pass over the seismic rows, then roll up the per-link partials ---
+    with stage("mart_partials", rows=len(df_seismic_sat)):
+        partials = link_partials_frame(df_seismic_sat)
+    with stage("mart_rollup", rows=len(partials)):
+        mart_well, mart_sensor, mart_survey_summary = rollup_marts(partials, df_link, df_well_hub, df_survey_hub, df_survey_sat)
 
-
-    # --- 2. BUILD mart_well_performance (Well Performance Summary) ---
     print("\n[*] Building mart_well_performance...")
-    
-    mart_well = df_core.groupby(['well_id', 'source_format']).agg(
-        total_readings=('depth', 'count'),
-        avg_amplitude=('amplitude', 'mean'),
-        total_quality_flags=('quality_flag', lambda x: (x == 1).sum()) # Count where flag is 1
-    ).reset_index()
-
-    # Calculate Data Quality Rate (DQR)
-    mart_well['data_quality_rate'] = mart_well['total_quality_flags'] / mart_well['total_readings']
-    mart_well = mart_well.drop(columns=['total_quality_flags']) 
-    
     write_mart_table(mart_well, "mart_well_performance", engine)
 
-
-    # --- 3. BUILD mart_sensor_analysis (Sensor Reliability Summary) ---
     print("\n[*] Building mart_sensor_analysis...")
-    
-    # 'survey_type' acts as a proxy for 'sensor type' for aggregation
-    mart_sensor = df_core.groupby('survey_type').agg(
-        total_readings=('depth', 'count'),
-        avg_amplitude=('amplitude', 'mean'),
-        total_quality_flags=('quality_flag', lambda x: (x == 1).sum())
-    ).reset_index()
-
-    mart_sensor['data_quality_rate'] = mart_sensor['total_quality_flags'] / mart_sensor['total_readings']
-    mart_sensor = mart_sensor.drop(columns=['total_quality_flags'])
-
     write_mart_table(mart_sensor, "mart_sensor_analysis", engine)
 
-
-    # --- 4. BUILD mart_survey_summary (Data Acquisition Summary) ---
     print("\n[*] Building mart_survey_summary...")
-    
-    # Calculate wells surveyed per survey type (must use link table before group by)
-    df_link_wells = df_link[['hub_survey_key', 'hub_well_key']].drop_duplicates()
-    df_link_wells = pd.merge(df_link_wells, df_survey_hub, on='hub_survey_key', how='inner')
-    wells_surveyed = df_link_wells.groupby('survey_type_id')['hub_well_key'].nunique().reset_index(name='wells_surveyed_count')
-    
-    # Calculate metrics grouped by survey type and source format
-    mart_survey_metrics = df_core.groupby(['survey_type', 'source_format', 'survey_type_id']).agg(
-        total_readings=('depth', 'count'),
-        avg_amplitude=('amplitude', 'mean'),
-        earliest_timestamp=('ingest_timestamp', 'min'),
-        latest_timestamp=('ingest_timestamp', 'max')
-    ).reset_index()
-
-    # Final merge to include well count
-    mart_survey_summary = pd.merge(mart_survey_metrics, wells_surveyed, on='survey_type_id', how='left')
-    
-    mart_survey_summary = mart_survey_summary[[
-        'survey_type', 'source_format', 'wells_surveyed_count', 'total_readings', 
-        'avg_amplitude', 'earliest_timestamp', 'latest_timestamp'
-    ]]
-    
     write_mart_table(mart_survey_summary, "mart_survey_summary", engine)
     
     print(f"\nINFORMATION MART BUILD COMPLETE: 3 Aggregation tables created with Delta Lake time travel enabled.")
+    return True
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--data-dir', required=True, help="Path to input data directory")
+    parser.add_argument('--source', choices=['postgres', 'parquet'], default='postgres',
+                        help="Read the Raw Vault from PostgreSQL, or straight from <data-dir>/raw_vault Parquet")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Fold only the raw_vault sat_seismic_data files loaded since the last mart build (implies --source parquet)")
     args = parser.parse_args()
     
-    build_aggregated_marts(args.data_dir)
+    if args.incremental:
+        ok = refresh_marts_incremental(args.data_dir)
+    elif args.source == 'parquet':
+        ok = build_marts_parquet(args.data_dir)
+    else:
+        ok = build_aggregated_marts(args.data_dir)
+
+    # Last stdout line: BashOperator pushes it to XCom
+    emit_summary()
+    # Non-zero so the Airflow task fails (and retries) instead of reporting success
+    if ok is False:
+        sys.exit(1)
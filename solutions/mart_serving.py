@@ -0,0 +1,204 @@
+import sys
+import re
+import time
+import argparse
+from collections import OrderedDict
+sys.path.insert(0, "/opt/airflow")
+from db_utils import get_db_engine, close_db_engine, copy_load, run_queries
+
+# Serving layer for the Postgres marts Superset reads. Every publish loads a mart into its own
+# versioned table (<mart>__v<delta version>), indexes it, and then repoints the view <mart> at it in one
+# short transaction. Dashboards keep querying the same name and never see an empty or half-loaded mart.
+SERVING_REGISTRY = "mart_serving_versions"
+# Versioned tables kept per mart: the current one plus the previous one that in-flight reads may still use
+KEEP_VERSIONS = 2
+# Wait at most this long for dashboard reads to let go of a view/table before giving up on a swap or cleanup
+LOCK_TIMEOUT_MS = 5000
+MAX_CACHE_ENTRIES = 256
+
+REGISTRY_SQL = f'''
+CREATE TABLE IF NOT EXISTS "{SERVING_REGISTRY}" (
+    mart TEXT NOT NULL,
+    delta_version BIGINT NOT NULL,
+    table_name TEXT NOT NULL,
+    row_count BIGINT,
+    published_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+    is_current BOOLEAN NOT NULL DEFAULT false,
+    PRIMARY KEY (mart, delta_version)
+)'''
+
+_cache = OrderedDict()
+
+
+def version_table(mart, delta_version):
+    return f"{mart}__v{delta_version}"
+
+
+def _columns(conn, relation):
+    return conn.exec_driver_sql(
+        "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+        "WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped ORDER BY attnum",
+        (f'"{relation}"',),
+    ).fetchall()
+
+
+def current_versions(engine=None):
+    """{mart: delta version} of the published marts ({} before the first publish)."""
+    engine = engine or get_db_engine()
+    if engine is None:
+        return {}
+    with engine.connect() as conn:
+        if conn.exec_driver_sql("SELECT to_regclass(%s)", (SERVING_REGISTRY,)).scalar() is None:
+            return {}
+        rows = conn.exec_driver_sql(f'SELECT mart, delta_version FROM "{SERVING_REGISTRY}" WHERE is_current').fetchall()
+    return {mart: version for mart, version in rows}
+
+
+def publish_mart(engine, df, mart, delta_version, indexes=None):
+    """Publishes df as Delta version delta_version of mart: versioned table, indexes, ANALYZE, then the view swap.
+    A version that is already current is skipped, so re-runs without a new Delta version leave the serving layer alone.
+    Returns True when a new version went live."""
+    if current_versions(engine).get(mart) == delta_version:
+        print(f"[*] {mart} v{delta_version} is already being served.")
+        return False
+
+    target = version_table(mart, delta_version)
+    # Nobody reads the versioned table yet, so the load and the index builds block no dashboard
+    copy_load(engine, df, target, indexes=indexes)
+
+    with engine.begin() as conn:
+        conn.exec_driver_sql(f'ANALYZE "{target}"')
+
+    with engine.begin() as conn:
+        # One publisher at a time; the swap itself only waits for reads that are already running
+        conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext(%s))", (SERVING_REGISTRY,))
+        conn.exec_driver_sql(f"SET LOCAL lock_timeout = {LOCK_TIMEOUT_MS}")
+        conn.exec_driver_sql(REGISTRY_SQL)
+
+        kind = conn.exec_driver_sql("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (f'"{mart}"',)).scalar()
+        if kind in ("r", "p"):
+            # Plain mart table from before the serving layer
+            conn.exec_driver_sql(f'DROP TABLE "{mart}"')
+        elif kind == "v" and _columns(conn, mart) != _columns(conn, target):
+            # CREATE OR REPLACE VIEW cannot drop or retype columns
+            conn.exec_driver_sql(f'DROP VIEW "{mart}"')
+        conn.exec_driver_sql(f'CREATE OR REPLACE VIEW "{mart}" AS SELECT * FROM "{target}"')
+
+        conn.exec_driver_sql(f'UPDATE "{SERVING_REGISTRY}" SET is_current = false WHERE mart = %s', (mart,))
+        conn.exec_driver_sql(
+            f'INSERT INTO "{SERVING_REGISTRY}" (mart, delta_version, table_name, row_count, is_current) '
+            "VALUES (%s, %s, %s, %s, true) ON CONFLICT (mart, delta_version) DO UPDATE "
+            "SET table_name = EXCLUDED.table_name, row_count = EXCLUDED.row_count, published_at = now(), is_current = true",
+            (mart, delta_version, target, len(df)),
+        )
+    print(f"[DB LOAD] {mart} now serves Delta version {delta_version} ({target}, {len(df)} rows)")
+
+    prune_versions(engine, mart)
+    return True
+
+
+def prune_versions(engine, mart, keep=KEEP_VERSIONS):
+    """Drops versioned tables beyond the newest `keep`. Best-effort: a table still busy is retried on the next publish."""
+    with engine.connect() as conn:
+        stale = conn.exec_driver_sql(
+            f'SELECT delta_version, table_name FROM "{SERVING_REGISTRY}" WHERE mart = %s AND NOT is_current '
+            "ORDER BY published_at DESC OFFSET %s",
+            (mart, keep - 1),
+        ).fetchall()
+
+    for delta_version, table_name in stale:
+        try:
+            with engine.begin() as conn:
+                conn.exec_driver_sql(f"SET LOCAL lock_timeout = {LOCK_TIMEOUT_MS}")
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{table_name}"')
+                conn.exec_driver_sql(f'DELETE FROM "{SERVING_REGISTRY}" WHERE mart = %s AND delta_version = %s',
+                                     (mart, delta_version))
+        except Exception as e:
+            print(f"[DB ERROR] Could not drop old serving table {table_name}: {e}")
+
+
+def query_mart(mart, filters=None, columns=None, engine=None):
+    """Dashboard read: equality / IN filters ({column: value or list}) on the published version of mart.
+
+    Results are cached per (mart, Delta version, filters). A publish changes the current version, so the
+    next call misses and reads the new table; entries of superseded versions are evicted then."""
+    engine = engine or get_db_engine()
+    version = current_versions(engine).get(mart)
+    if version is None:
+        raise LookupError(f"{mart} has not been published yet")
+
+    filters = filters or {}
+    for name in list(filters) + list(columns or []):
+        if not re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", name):
+            raise ValueError(f"Invalid column name: {name!r}")
+
+    key = (mart, version, tuple(columns or ()),
+           tuple(sorted((k, tuple(v) if isinstance(v, (list, tuple)) else v) for k, v in filters.items())))
+    if key in _cache:
+        _cache.move_to_end(key)
+        return _cache[key]
+
+    # Superseded versions will never be asked for again
+    for stale in [k for k in _cache if k[0] == mart and k[1] != version]:
+        del _cache[stale]
+
+    select = ", ".join(f'"{c}"' for c in columns) if columns else "*"
+    where, params = [], {}
+    for i, (name, value) in enumerate(sorted(filters.items())):
+        if isinstance(value, (list, tuple)):
+            # One literal per value, so each is coerced to the column type like a single value is
+            names = [f"p{i}_{j}" for j in range(len(value))]
+            where.append(f'"{name}" IN ({", ".join(":" + n for n in names)})')
+            params.update(zip(names, value))
+        else:
+            where.append(f'"{name}" = :p{i}')
+            params[f"p{i}"] = value
+    # The versioned table rather than the view: the result matches the version it is cached under
+    sql = f'SELECT {select} FROM "{version_table(mart, version)}"' + (f" WHERE {' AND '.join(where)}" if where else "")
+
+    df = run_queries({mart: sql}, engine, params={mart: params})[mart]
+    if df is None:
+        raise RuntimeError(f"Query on {mart} v{version} failed")
+
+    _cache[key] = df
+    if len(_cache) > MAX_CACHE_ENTRIES:
+        _cache.popitem(last=False)
+    return df
+
+
+def parse_filters(specs):
+    """["well_id=3", "survey_type=2D,3D"] -> {"well_id": "3", "survey_type": ["2D", "3D"]}"""
+    filters = {}
+    for spec in specs:
+        name, _, value = spec.partition("=")
+        values = value.split(",")
+        filters[name.strip()] = values if len(values) > 1 else value
+    return filters
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Published mart versions and cached dashboard reads")
+    parser.add_argument('--status', action='store_true', help="List the Delta version each mart view serves")
+    parser.add_argument('--mart', help="Mart to query, e.g. mart_well_performance")
+    parser.add_argument('--filter', action='append', default=[], help="column=value or column=v1,v2 (repeatable)")
+    parser.add_argument('--columns', default="", help="Comma-separated columns (default: all)")
+    parser.add_argument('--repeat', type=int, default=1, help="Run the query N times to show cache hits")
+    args = parser.parse_args()
+
+    engine = get_db_engine()
+    if engine is None:
+        sys.exit(1)
+
+    if args.status or not args.mart:
+        for mart, version in sorted(current_versions(engine).items()):
+            print(f"[*] {mart}: Delta version {version} ({version_table(mart, version)})")
+
+    if args.mart:
+        columns = [c.strip() for c in args.columns.split(",") if c.strip()]
+        for i in range(args.repeat):
+            started = time.perf_counter()
+            df = query_mart(args.mart, parse_filters(args.filter), columns, engine)
+            print(f"[QUERY] {args.mart}: {len(df)} rows in {(time.perf_counter() - started) * 1000:.1f} ms")
+        print(df.to_string(index=False))
+
+    close_db_engine()
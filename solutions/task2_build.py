@@ -1,140 +1,658 @@
 import os; import sys
 import argparse
 import glob
-import hashlib
+import json
+import queue
+import shutil
+import threading
+from collections import defaultdict
 from datetime import datetime
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 sys.path.insert(0, "/opt/airflow")
-from db_utils import get_db_engine
+from db_utils import get_db_engine, close_db_engine, copy_load, copy_insert_new, CopyLoader
+from pipeline_metrics import stage, emit_summary
+from vault_keys import hub_keys, link_keys, row_hashes
+from vault_io import (
+    clear_flat, clear_increments, clear_partitioned, increment_path, new_rows, partition_path, read_vault_table,
+    scan_vault_table, vault_table_files,
+)
 
 def write_outputs(engine, df: pd.DataFrame, table_name: str, out_dir: str):
     """Write to Postgres (best-effort) and ALWAYS write Parquet."""
     if engine is not None:
         try:
-            df.to_sql(table_name, engine, if_exists="replace", index=False)
-            print(f"[DB LOAD] Wrote {len(df)} rows to PostgreSQL table: {table_name}")
+            copy_load(engine, df, table_name)
         except Exception as e:
             print(f"[DB ERROR] Failed to write to PostgreSQL: {e}")
 
     parquet_path = os.path.join(out_dir, f"{table_name}.parquet")
     df.to_parquet(parquet_path, index=False)
+    # A full load replaces history, so earlier incremental parts must not be read alongside it
+    clear_increments(out_dir, table_name)
     print(f"[FILE LOAD] Wrote {len(df)} rows to Parquet: {parquet_path}")
 
 
-def md5(val) -> str:
-    return hashlib.md5(str(val).encode("utf-8")).hexdigest()
+def append_outputs(engine, df: pd.DataFrame, table_name: str, out_dir: str, stamp: str, key_columns, null_safe=False):
+    """Insert-only load: each sink gets only the rows it does not hold yet (see vault_io.new_rows)."""
+    if engine is not None:
+        try:
+            copy_insert_new(engine, df, table_name, key_columns, null_safe=null_safe)
+        except Exception as e:
+            print(f"[DB ERROR] Failed to write to PostgreSQL: {e}")
+
+    existing = read_vault_table(out_dir, table_name, columns=key_columns)
+    fresh = new_rows(existing, df, key_columns)
+
+    if fresh.empty:
+        print(f"[FILE LOAD] {table_name}: no new rows")
+        return
+
+    if existing is None:
+        parquet_path = os.path.join(out_dir, f"{table_name}.parquet")
+    else:
+        parquet_path = increment_path(out_dir, table_name, stamp)
+    fresh.to_parquet(parquet_path, index=False)
+    print(f"[FILE LOAD] Appended {len(fresh)} new rows to Parquet: {parquet_path}")
+
+
+SEISMIC_COLUMNS = ["survey_id", "well_id", "depth", "amplitude", "quality_flag"]
+SAT_SEISMIC_KEYS = ["link_survey_well_key", "source_hash"]
+DEFAULT_BATCH_SIZE = 500_000
+# Optional hive partitioning of sat_seismic_data (--partition-by); rows are sorted by SEISMIC_SORT_KEYS inside each part
+SEISMIC_PARTITION_COLUMNS = ["survey_id", "ingest_date"]
+SEISMIC_SORT_KEYS = ["link_survey_well_key", "depth"]
+# Partitioned rows are buffered (up to this many over all partitions) and sorted across batches before they are
+# written, in row groups of SEISMIC_ROW_GROUP_ROWS; each row group then spans only one or two wells
+PARTITION_BUFFER_ROWS = 4_000_000
+SEISMIC_ROW_GROUP_ROWS = 64 * 1024
+
+# Sharded loads (--phase): "metadata" loads the hubs from the master CSVs, each "shard" streams its own --files
+# and stages its links, "merge" loads the staged links once. Shards only ever append, so they can run concurrently.
+PHASES = ["all", "metadata", "shard", "merge"]
+LINK_STAGING_DIR = "_staging"
+# Surveys are packed into shards of roughly this much reconstructed Parquet; a bigger survey gets a shard of its own
+DEFAULT_SHARD_BYTES = 256 * 1024 * 1024
+
+# Fused mode (--from-sgx) decodes the .sgx surveys with the Ghost Format reader instead of re-reading reconstructed Parquet
+GHOST_FORMAT_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "The Ghost Format")
+# Batches decoded and hashed ahead of the writers; bounds memory to about this many batches in flight
+DEFAULT_QUEUE_DEPTH = 4
+
+
+def _standard_type(col_type):
+    """Compact-profile reconstructed files (dictionary / uint32 / uint8 / float32 columns) read back as int64/float64,
+    so keys and row hashes are the same whichever profile wrote the file."""
+    if pa.types.is_dictionary(col_type):
+        col_type = col_type.value_type
+    if pa.types.is_integer(col_type):
+        return pa.int64()
+    if pa.types.is_floating(col_type):
+        return pa.float64()
+    return col_type
+
+
+def seismic_dataset(files):
+    """Dataset over the reconstructed files, projected to the required columns.
+
+    Types follow what pd.concat of the whole files used to produce (int columns missing from some
+    files become float64), so hash keys do not depend on how the data is batched."""
+    schemas = [pq.read_schema(f) for f in files]
+    found = sorted({name for schema in schemas for name in schema.names})
+
+    missing = [c for c in SEISMIC_COLUMNS if c not in found]
+    if missing:
+        raise RuntimeError(f"Missing columns in reconstructed parquet: {missing}. Found: {found}")
+
+    fields = []
+    for col in SEISMIC_COLUMNS:
+        types = {_standard_type(schema.field(col).type) for schema in schemas if col in schema.names}
+        col_type = types.pop() if len(types) == 1 else pa.float64()
+        present_everywhere = all(col in schema.names for schema in schemas)
+        if pa.types.is_integer(col_type) and not present_everywhere:
+            col_type = pa.float64()
+        fields.append(pa.field(col, col_type))
+
+    return ds.dataset(files, format="parquet", schema=pa.schema(fields))
+
+
+def sgx_files(data_dir: str) -> list:
+    return sorted(glob.glob(os.path.join(data_dir, "**", "*.sgx"), recursive=True))
+
+
+def sgx_batches(files, batch_size, reconstructed_dir=None):
+    """Trace batches decoded straight from .sgx files, with the columns and types of the standard reconstructed Parquet
+    (so keys and row hashes match the two-step path). With reconstructed_dir the same batches are also written
+    there as <name>_reconstructed.parquet, identical to a streaming CaspianPetro conversion."""
+    if GHOST_FORMAT_DIR not in sys.path:
+        sys.path.insert(0, GHOST_FORMAT_DIR)
+    from CaspianPetro import CaspianSGX, RECONSTRUCTED_SCHEMA, parquet_options, reconstructed_path
+
+    for path in files:
+        loader = CaspianSGX(path)
+        if not loader.read():
+            print(f"[-] Skipping {path}: not a CPETRO01 survey")
+            continue
+
+        writer = out_path = None
+        if reconstructed_dir:
+            os.makedirs(reconstructed_dir, exist_ok=True)
+            out_path = reconstructed_path(path, reconstructed_dir)
+            writer = pq.ParquetWriter(out_path + ".tmp", RECONSTRUCTED_SCHEMA, write_statistics=True,
+                                      **parquet_options("standard"))
+        try:
+            for batch in loader.iter_batches(batch_size):
+                if writer is not None:
+                    writer.write_batch(batch, row_group_size=batch_size)
+                yield batch.select(SEISMIC_COLUMNS)
+        finally:
+            loader.close()
+            if writer is not None:
+                writer.close()
+        if writer is not None:
+            os.replace(out_path + ".tmp", out_path)
+            print(f"[FILE LOAD] Side output: {out_path}")
+
+
+def prefetch(items, depth=DEFAULT_QUEUE_DEPTH):
+    """Iterates items on a background thread, at most depth items ahead of the consumer (a bounded queue).
+    The producer's work (decoding, hashing) overlaps with the consumer's writes; depth=0 runs inline."""
+    if depth <= 0:
+        yield from items
+        return
+
+    q = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(message):
+        while not stop.is_set():
+            try:
+                q.put(message, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for item in items:
+                if not put(("item", item)):
+                    return
+            put(("done", None))
+        except BaseException as e:
+            put(("error", e))
+
+    thread = threading.Thread(target=produce, name="vault-prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = q.get()
+            if kind == "done":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        # Also unblocks a producer stuck on a full queue when the consumer fails
+        stop.set()
+        thread.join()
+
+
+def vault_frames(batch, now, partition_by):
+    """Keys, link candidates and satellite rows for one record batch of traces."""
+    full_df = batch.to_pandas()
+
+    # Add required sat metadata fields (THIS fixes your KeyError)
+    full_df["ingest_source"] = "sgx_reconstruction"
+    full_df["ingest_timestamp"] = now
+
+    # Column-wise hashing; identical MD5 hex to the old per-row "_".join + md5
+    full_df["source_hash"] = row_hashes(full_df, ["depth", "amplitude", "quality_flag"])
+
+    # Keys & link (hashed once per distinct survey / well / pair)
+    full_df["hub_survey_key"] = hub_keys(full_df["survey_id"])
+    full_df["hub_well_key"] = hub_keys(full_df["well_id"])
+    full_df["link_survey_well_key"] = link_keys(full_df["survey_id"], full_df["well_id"])
+
+    # LINK: dedup within the batch (the caller dedups across batches)
+    links = full_df[["link_survey_well_key", "hub_survey_key", "hub_well_key"]].drop_duplicates()
+
+    # SAT
+    sat_seismic = full_df[
+        ["link_survey_well_key", "depth", "amplitude", "quality_flag", "ingest_source", "source_hash", "ingest_timestamp"]
+    ].copy()
+    sat_seismic["load_date"] = now
+    # Partition values travel with the batch and are stripped again before anything is stored
+    if "survey_id" in partition_by:
+        sat_seismic["survey_id"] = full_df["survey_id"]
+    if "ingest_date" in partition_by:
+        sat_seismic["ingest_date"] = now[:10]
+    return links, sat_seismic
+
+
+class SatelliteSink:
+    """Streams sat_seismic_data batches to Parquet and (best-effort) Postgres, one batch in memory at a time.
+
+    With partition_by the Parquet side becomes a hive-partitioned directory: one writer per partition. Rows of a
+    partition are buffered across batches and sorted by SEISMIC_SORT_KEYS before they are written, so every row group
+    covers a narrow link key range and min/max statistics skip row groups of other wells."""
+
+    def __init__(self, engine, out_dir, stamp, incremental, partition_by=None, append_only=False):
+        self.table_name = "sat_seismic_data"
+        self.engine = engine
+        self.out_dir = out_dir
+        self.stamp = stamp
+        self.incremental = incremental
+        self.partition_by = list(partition_by or [])
+        self.loader = None
+        self.writer = None
+        self.writers = {}
+        self.buffers = defaultdict(list)
+        self.buffered = defaultdict(int)
+        self.schema = None
+        self.rows = 0
+
+        self.final_path = os.path.join(out_dir, f"{self.table_name}.parquet")
+        self.has_history = False
+        if incremental:
+            # Stored keys are looked up per batch, for that batch's links only (see _stored_keys)
+            self.has_history = bool(vault_table_files(out_dir, self.table_name))
+            # Concurrent shards never write the base file, each one adds its own part
+            if self.has_history or append_only:
+                self.final_path = increment_path(out_dir, self.table_name, stamp)
+        self.tmp_path = self.final_path + ".tmp"
+
+        # Partitioned: incremental parts go straight into the live directory, a full load is built aside and swapped in
+        self.dataset_dir = os.path.join(out_dir, self.table_name)
+        self.write_dir = self.dataset_dir if incremental else self.dataset_dir + ".tmp"
+
+    def _write_db(self, df):
+        if self.engine is None:
+            return
+        try:
+            if self.incremental:
+                copy_insert_new(self.engine, df, self.table_name, SAT_SEISMIC_KEYS)
+            else:
+                if self.loader is None:
+                    self.loader = CopyLoader(self.engine, self.table_name, pa.Schema.from_pandas(df, preserve_index=False))
+                self.loader.write(df)
+        except Exception as e:
+            print(f"[DB ERROR] Failed to write to PostgreSQL: {e}")
+            if self.loader is not None:
+                self.loader.abort()
+            # Keep going with Parquet only
+            self.engine = None
+            self.loader = None
+
+    def _stored_keys(self, df):
+        """Stored (link, source_hash) pairs of the links in df. Reads only matching rows (row groups are skipped on
+        their link key statistics, partitions on survey_id), so the cost follows the batch, not the vault history."""
+        if not self.has_history:
+            return None
+        links = df["link_survey_well_key"].unique().tolist()
+        partition_filter = None
+        if "survey_id" in df.columns:
+            partition_filter = ds.field("survey_id").isin(df["survey_id"].dropna().unique().tolist())
+        table = scan_vault_table(self.out_dir, self.table_name, SAT_SEISMIC_KEYS,
+                                 filter=ds.field("link_survey_well_key").isin(links), partition_filter=partition_filter)
+        return None if table is None else table.to_pandas()
+
+    def _write_partitioned(self, df):
+        for values, part in df.groupby(self.partition_by, sort=False, dropna=False):
+            values = values if isinstance(values, tuple) else (values,)
+            part_dir = partition_path(dict(zip(self.partition_by, values)))
+            table = pa.Table.from_pandas(part.drop(columns=self.partition_by), preserve_index=False)
+            if self.schema is None:
+                self.schema = table.schema
+            self.buffers[part_dir].append(table.cast(self.schema))
+            self.buffered[part_dir] += table.num_rows
+
+        # Over the budget: write out the biggest partitions first, they gain least from more buffering
+        while sum(self.buffered.values()) > PARTITION_BUFFER_ROWS:
+            self._flush_partition(max(self.buffered, key=self.buffered.get))
+
+    def _flush_partition(self, part_dir):
+        table = pa.concat_tables(self.buffers.pop(part_dir)).sort_by([(k, "ascending") for k in SEISMIC_SORT_KEYS])
+        del self.buffered[part_dir]
+        writer = self.writers.get(part_dir)
+        if writer is None:
+            os.makedirs(os.path.join(self.write_dir, part_dir), exist_ok=True)
+            writer = pq.ParquetWriter(self._part_file(part_dir) + ".tmp", self.schema)
+            self.writers[part_dir] = writer
+        writer.write_table(table, row_group_size=SEISMIC_ROW_GROUP_ROWS)
+        self.rows += table.num_rows
+
+    def _part_file(self, part_dir):
+        return os.path.join(self.write_dir, part_dir, f"part-{self.stamp}.parquet")
+
+    def write(self, df: pd.DataFrame):
+        self._write_db(df.drop(columns=self.partition_by))
+
+        if self.incremental:
+            df = new_rows(self._stored_keys(df), df, SAT_SEISMIC_KEYS)
+        if df.empty:
+            return
+
+        if self.partition_by:
+            self._write_partitioned(df)
+            return
+
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        if self.writer is None:
+            self.schema = table.schema
+            self.writer = pq.ParquetWriter(self.tmp_path, self.schema)
+        self.writer.write_table(table.cast(self.schema))
+        self.rows += table.num_rows
+
+    def _close_partitioned(self):
+        for part_dir in list(self.buffers):
+            self._flush_partition(part_dir)
+        for part_dir, writer in self.writers.items():
+            writer.close()
+            os.replace(self._part_file(part_dir) + ".tmp", self._part_file(part_dir))
+
+        if not self.incremental:
+            # A full load replaces history in whichever layout it was stored
+            old_dir = self.dataset_dir + ".old"
+            if os.path.isdir(self.dataset_dir):
+                os.replace(self.dataset_dir, old_dir)
+            os.replace(self.write_dir, self.dataset_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+            clear_flat(self.out_dir, self.table_name)
+
+        print(f"[FILE LOAD] Wrote {self.rows} rows to {len(self.writers)} Parquet partitions "
+              f"({', '.join(self.partition_by)}): {self.dataset_dir}")
+
+    def close(self):
+        if self.loader is not None:
+            try:
+                self.loader.close()
+            except Exception as e:
+                print(f"[DB ERROR] Failed to write to PostgreSQL: {e}")
+
+        if self.writer is None and not self.writers and not self.buffers:
+            print(f"[FILE LOAD] {self.table_name}: no new rows")
+            return
+
+        if self.partition_by:
+            self._close_partitioned()
+            return
+
+        self.writer.close()
+        # Swap in only once every batch is written, so a failed run never leaves half a table
+        os.replace(self.tmp_path, self.final_path)
+        if not self.incremental:
+            clear_increments(self.out_dir, self.table_name)
+            clear_partitioned(self.out_dir, self.table_name)
+        print(f"[FILE LOAD] Wrote {self.rows} rows to Parquet: {self.final_path}")
+
+
+def reconstructed_files(data_dir: str) -> list:
+    return sorted(glob.glob(os.path.join(data_dir, "**", "*_reconstructed.parquet"), recursive=True))
+
+
+def file_survey(path):
+    """survey_id of a reconstructed file from its footer statistics, or None if it holds several (or has no stats)."""
+    metadata = pq.ParquetFile(path).metadata
+    names = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+    if "survey_id" not in names:
+        return None
+    lo = hi = None
+    for rg in range(metadata.num_row_groups):
+        stats = metadata.row_group(rg).column(names.index("survey_id")).statistics
+        if stats is None or not stats.has_min_max:
+            return None
+        lo = stats.min if lo is None else min(lo, stats.min)
+        hi = stats.max if hi is None else max(hi, stats.max)
+    return lo if lo is not None and lo == hi else None
+
+
+def plan_shards(data_dir: str, target_bytes: int = DEFAULT_SHARD_BYTES) -> list:
+    """Groups the reconstructed files by survey and packs the surveys into shards of about target_bytes (largest first)."""
+    groups = defaultdict(list)
+    for path in reconstructed_files(data_dir):
+        survey = file_survey(path)
+        groups[survey if survey is not None else os.path.basename(path)].append(path)
+
+    sized = sorted(((sum(os.path.getsize(p) for p in files), key, files) for key, files in groups.items()),
+                   key=lambda item: (-item[0], str(item[1])))
+    shards = []
+    for size, key, files in sized:
+        # First fit: the first shard with room, else a new one
+        target = next((shard for shard in shards if shard["bytes"] + size <= target_bytes), None)
+        if target is None:
+            target = {"files": [], "surveys": [], "bytes": 0}
+            shards.append(target)
+        target["files"] += files
+        target["surveys"].append(key)
+        target["bytes"] += size
+
+    for i, shard in enumerate(shards):
+        shard["shard_id"] = f"shard-{i:03d}"
+    return shards
+
+
+def stage_links(links: pd.DataFrame, processed_dir: str, shard_id: str):
+    """One staged link file per shard; a retried shard overwrites its own file instead of adding a second one."""
+    staging_dir = os.path.join(processed_dir, LINK_STAGING_DIR)
+    os.makedirs(staging_dir, exist_ok=True)
+    path = os.path.join(staging_dir, f"links-{shard_id}.parquet")
+    links.to_parquet(path + ".tmp", index=False)
+    os.replace(path + ".tmp", path)
+    print(f"[FILE LOAD] Staged {len(links)} links for the merge: {path}")
 
 
-def build_vault(data_dir: str):
+def staged_link_files(processed_dir: str) -> list:
+    return sorted(glob.glob(os.path.join(processed_dir, LINK_STAGING_DIR, "links-*.parquet")))
+
+
+def build_vault(data_dir: str, incremental: bool = False, batch_size: int = DEFAULT_BATCH_SIZE, partition_by=None,
+                phase: str = "all", files=None, shard_id: str = None, from_sgx: bool = False, reconstructed_dir: str = None,
+                queue_depth: int = DEFAULT_QUEUE_DEPTH):
     # output under /opt/airflow/processed_data/raw_vault in container
     processed_dir = os.path.join(os.getcwd(), "processed_data", "raw_vault")
     os.makedirs(processed_dir, exist_ok=True)
 
+    if phase not in PHASES:
+        raise ValueError(f"Unknown phase {phase}. Choose from {PHASES}")
+    if phase != "all" and not incremental:
+        # A full load swaps whole tables, which would drop what the other shards wrote
+        print(f"[*] Phase '{phase}' loads insert-only (--incremental).")
+        incremental = True
+
     engine = get_db_engine()
 
-    print(f"\n{'='*50}\n{'BUILDING RAW DATA VAULT':^50}\n{'='*50}\n")
+    title = 'BUILDING RAW DATA VAULT' if phase == "all" else f'RAW DATA VAULT: {phase.upper()} {shard_id or ""}'.strip()
+    print(f"\n{'='*50}\n{title:^50}\n{'='*50}\n")
 
     now = datetime.now().isoformat()
+    stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+    if shard_id:
+        # Shards running in the same second must not share part file names
+        stamp = f"{stamp}-{shard_id}"
+
+    def load(df, table_name, key_columns, null_safe=False):
+        if incremental:
+            append_outputs(engine, df, table_name, processed_dir, stamp, key_columns, null_safe)
+        else:
+            write_outputs(engine, df, table_name, processed_dir)
+
+    def finish():
+        if engine is not None:
+            close_db_engine()
+        emit_summary()
+
+    if phase == "merge":
+        with stage("vault_links") as st:
+            staged = staged_link_files(processed_dir)
+            if staged:
+                link_sw = pd.concat([pd.read_parquet(p) for p in staged], ignore_index=True)
+                link_sw = link_sw.drop_duplicates("link_survey_well_key")
+                link_sw["load_date"] = now
+                link_sw["record_source"] = "sgx_reconstruction"
+                load(link_sw, "link_survey_well", ["link_survey_well_key"])
+                st.rows = len(link_sw)
+                for path in staged:
+                    os.remove(path)
+            else:
+                print("[*] No staged links to merge.")
+        print("\nRAW VAULT LINK MERGE COMPLETE")
+        finish()
+        return
 
     # 1) LOAD METADATA (CSVs)
-    surveys_path = os.path.join(data_dir, "master_surveys.csv")
-    wells_path = os.path.join(data_dir, "master_wells.csv")
+    # Shards skip it: the hubs are loaded once by the metadata phase
+    if phase != "shard":
+        with stage("vault_metadata"):
+            surveys_path = os.path.join(data_dir, "master_surveys.csv")
+            wells_path = os.path.join(data_dir, "master_wells.csv")
 
-    if os.path.exists(surveys_path):
-        df = pd.read_csv(surveys_path)
-        df["hub_survey_key"] = df["survey_type_id"].astype(str).map(md5)
+            if os.path.exists(surveys_path):
+                df = pd.read_csv(surveys_path)
+                df["hub_survey_key"] = hub_keys(df["survey_type_id"])
 
-        hub_survey = df[["hub_survey_key", "survey_type_id"]].drop_duplicates().copy()
-        hub_survey["load_date"] = now
-        hub_survey["record_source"] = "master_surveys.csv"
-        write_outputs(engine, hub_survey, "hub_survey", processed_dir)
+                hub_survey = df[["hub_survey_key", "survey_type_id"]].drop_duplicates().copy()
+                hub_survey["load_date"] = now
+                hub_survey["record_source"] = "master_surveys.csv"
+                load(hub_survey, "hub_survey", ["hub_survey_key"])
 
-        sat_survey = df[["hub_survey_key", "survey_type", "survey_type_id"]].copy()
+                sat_survey = df[["hub_survey_key", "survey_type", "survey_type_id"]].copy()
         
-        if "source_format" in df.columns:
-            sat_survey["source_format"] = df["source_format"]
-        elif "file_format" in df.columns:
-            sat_survey["source_format"] = df["file_format"]
-        elif "format" in df.columns:
-            sat_survey["source_format"] = df["format"]
-        else:
-    # default for your metadata CSV
-            sat_survey["source_format"] = "csv"
+                if "source_format" in df.columns:
+                    sat_survey["source_format"] = df["source_format"]
+                elif "file_format" in df.columns:
+                    sat_survey["source_format"] = df["file_format"]
+                elif "format" in df.columns:
+                    sat_survey["source_format"] = df["format"]
+                else:
+            # default for your metadata CSV
+                    sat_survey["source_format"] = "csv"
 
-        sat_survey["load_date"] = now
-        write_outputs(engine, sat_survey, "sat_survey_details", processed_dir)
+                sat_survey["load_date"] = now
+                load(sat_survey, "sat_survey_details", ["hub_survey_key", "survey_type", "survey_type_id", "source_format"], null_safe=True)
 
-    if os.path.exists(wells_path):
-        df = pd.read_csv(wells_path)
-        df["hub_well_key"] = df["well_id"].astype(str).map(md5)
+            if os.path.exists(wells_path):
+                df = pd.read_csv(wells_path)
+                df["hub_well_key"] = hub_keys(df["well_id"])
 
-        hub_well = df[["hub_well_key", "well_id"]].drop_duplicates().copy()
-        hub_well["load_date"] = now
-        hub_well["record_source"] = "master_wells.csv"
-        write_outputs(engine, hub_well, "hub_well", processed_dir)
+                hub_well = df[["hub_well_key", "well_id"]].drop_duplicates().copy()
+                hub_well["load_date"] = now
+                hub_well["record_source"] = "master_wells.csv"
+                load(hub_well, "hub_well", ["hub_well_key"])
 
-        sat_well = df[["hub_well_key", "well_name", "operator", "location_lat", "location_long"]].copy()
-        sat_well["load_date"] = now
-        write_outputs(engine, sat_well, "sat_well_details", processed_dir)
+                sat_well = df[["hub_well_key", "well_name", "operator", "location_lat", "location_long"]].copy()
+                sat_well["load_date"] = now
+                load(sat_well, "sat_well_details", ["hub_well_key", "well_name", "operator", "location_lat", "location_long"], null_safe=True)
+
+    if phase == "metadata":
+        print("\nRAW VAULT METADATA COMPLETE")
+        finish()
+        return
 
-    # 2) PROCESS RECONSTRUCTED SEISMIC DATA
-    search_pattern = os.path.join(data_dir, "**", "*_reconstructed.parquet")
-    files = glob.glob(search_pattern, recursive=True)
+    # 2) PROCESS RECONSTRUCTED SEISMIC DATA (or, fused, the .sgx surveys themselves)
+    if from_sgx:
+        files = list(files) if files else sgx_files(data_dir)
+    else:
+        files = list(files) if files else reconstructed_files(data_dir)
 
     if not files:
-        print("[-] ERROR: No reconstructed parquet files found.")
+        print("[-] ERROR: No .sgx surveys found." if from_sgx else "[-] ERROR: No reconstructed parquet files found.")
         if engine is not None:
-            engine.dispose()
+            close_db_engine()
         return
 
-    print(f"[*] Found {len(files)} seismic reconstruction files. Ingesting traces...")
-    full_df = pd.concat([pd.read_parquet(f) for f in files], ignore_index=True)
+    partition_by = list(partition_by or [])
+    unknown = [c for c in partition_by if c not in SEISMIC_PARTITION_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unsupported sat_seismic_data partition columns: {unknown}. Choose from {SEISMIC_PARTITION_COLUMNS}")
 
-    # Ensure required columns exist
-    required = ["survey_id", "well_id", "depth", "amplitude", "quality_flag"]
-    missing = [c for c in required if c not in full_df.columns]
-    if missing:
-        raise RuntimeError(f"Missing columns in reconstructed parquet: {missing}. Found: {list(full_df.columns)}")
+    if from_sgx:
+        print(f"[*] Found {len(files)} SGX surveys. Decoding traces straight into the vault...")
+        batches = sgx_batches(files, batch_size, reconstructed_dir)
+    else:
+        print(f"[*] Found {len(files)} seismic reconstruction files. Ingesting traces...")
+        # One record batch at a time: only the required columns are read and memory stays flat
+        batches = seismic_dataset(files).to_batches(columns=SEISMIC_COLUMNS, batch_size=batch_size)
 
-    # Add required sat metadata fields (THIS fixes your KeyError)
-    full_df["ingest_source"] = "sgx_reconstruction"
-    full_df["ingest_timestamp"] = now
+    def frames():
+        for batch in batches:
+            if batch.num_rows:
+                yield batch.num_rows, batch.nbytes, vault_frames(batch, now, partition_by)
 
-    full_df["source_hash"] = (
-        full_df[["depth", "amplitude", "quality_flag"]]
-        .astype(str)
-        .agg("_".join, axis=1)
-        .map(md5)
-    )
-
-    # Keys & link
-    full_df["hub_survey_key"] = full_df["survey_id"].astype(str).map(md5)
-    full_df["hub_well_key"] = full_df["well_id"].astype(str).map(md5)
-    full_df["link_survey_well_key"] = (
-        full_df["survey_id"].astype(str) + "_" + full_df["well_id"].astype(str)
-    ).map(md5)
-
-    # LINK
-    link_sw = full_df[["link_survey_well_key", "hub_survey_key", "hub_well_key"]].drop_duplicates().copy()
-    link_sw["load_date"] = now
-    link_sw["record_source"] = "sgx_reconstruction"
-    write_outputs(engine, link_sw, "link_survey_well", processed_dir)
+    sat_sink = SatelliteSink(engine, processed_dir, stamp, incremental, partition_by, append_only=phase == "shard")
+    link_parts = []
+    seen_links = set()
+    with stage("vault_seismic", batch_size=batch_size, source="sgx" if from_sgx else "parquet", queue_depth=queue_depth) as st:
+        total_rows = 0
 
-    # SAT
-    sat_seismic = full_df[
-        ["link_survey_well_key", "depth", "amplitude", "quality_flag", "ingest_source", "source_hash", "ingest_timestamp"]
-    ].copy()
-    sat_seismic["load_date"] = now
-    write_outputs(engine, sat_seismic, "sat_seismic_data", processed_dir)
+        # Decoding and hashing run ahead on a producer thread; this loop only writes
+        for rows, nbytes, (links, sat_seismic) in prefetch(frames(), queue_depth):
+            total_rows += rows
+            st.rows = total_rows
+            st.bytes += nbytes
 
-    if engine is not None:
-        engine.dispose()
+            # Links already seen in earlier batches are dropped
+            links = links[~links["link_survey_well_key"].isin(seen_links)]
+            seen_links.update(links["link_survey_well_key"])
+            link_parts.append(links)
 
-    print("\nRAW VAULT INGESTION COMPLETE")
+            sat_sink.write(sat_seismic)
+
+    print(f"[*] Streamed {total_rows} traces in batches of up to {batch_size} rows.")
+
+    with stage("vault_links") as st:
+        if link_parts:
+            link_sw = pd.concat(link_parts, ignore_index=True)
+            if phase == "shard":
+                # Shards share surveys/wells, so links are deduplicated and loaded once by the merge phase
+                stage_links(link_sw, processed_dir, shard_id)
+            else:
+                link_sw["load_date"] = now
+                link_sw["record_source"] = "sgx_reconstruction"
+                load(link_sw, "link_survey_well", ["link_survey_well_key"])
+            st.rows = len(link_sw)
+
+    # Hash diff: a trace is stored again only if its source_hash is new for that link
+    with stage("vault_seismic_finalize") as st:
+        sat_sink.close()
+        st.rows = sat_sink.rows
+
+    print("\nRAW VAULT INGESTION COMPLETE" if phase == "all" else f"\nRAW VAULT SHARD {shard_id} COMPLETE")
+    finish()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--data-dir", required=True, help="Path to input data directory")
+    parser.add_argument("--incremental", action="store_true", help="Insert-only load: keep history, add only new keys / changed satellite rows")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE, help="Traces per record batch when streaming reconstructed files")
+    parser.add_argument("--partition-by", default="",
+                        help=f"Comma-separated hive partition columns for raw_vault/sat_seismic_data, from {','.join(SEISMIC_PARTITION_COLUMNS)} (default: one file)")
+    parser.add_argument("--phase", choices=PHASES, default="all",
+                        help="Sharded load: metadata (hubs), shard (one --files batch), merge (staged links); implies --incremental")
+    parser.add_argument("--files", default="", help="Comma-separated reconstructed (or, with --from-sgx, .sgx) files (default: all under --data-dir)")
+    parser.add_argument("--shard-id", default=None, help="Shard name, used in part file names and the staged link file")
+    parser.add_argument("--plan-shards", action="store_true", help="Print the shard plan for --data-dir as JSON and exit")
+    parser.add_argument("--shard-bytes", type=int, default=DEFAULT_SHARD_BYTES, help="Target reconstructed bytes per shard")
+    parser.add_argument("--from-sgx", action="store_true",
+                        help="Fused mode: decode the .sgx surveys under --data-dir directly instead of reading reconstructed Parquet")
+    parser.add_argument("--reconstructed-dir", default=None,
+                        help="With --from-sgx, also write the *_reconstructed.parquet side outputs here")
+    parser.add_argument("--queue-depth", type=int, default=DEFAULT_QUEUE_DEPTH,
+                        help="Batches decoded/hashed ahead of the writers (0 = no background thread)")
     args = parser.parse_args()
-    build_vault(args.data_dir)
+
+    if args.plan_shards:
+        print(json.dumps(plan_shards(args.data_dir, args.shard_bytes), indent=2, default=str))
+        sys.exit(0)
+
+    if args.phase == "shard" and not args.shard_id:
+        parser.error("--phase shard needs --shard-id")
+
+    partition_by = [c.strip() for c in args.partition_by.split(",") if c.strip()]
+    files = [f.strip() for f in args.files.split(",") if f.strip()]
+    build_vault(args.data_dir, incremental=args.incremental, batch_size=args.batch_size, partition_by=partition_by,
+                phase=args.phase, files=files, shard_id=args.shard_id, from_sgx=args.from_sgx,
+                reconstructed_dir=args.reconstructed_dir, queue_depth=args.queue_depth)
@@ -1,80 +1,43 @@
 import os; import sys
+import time
 import argparse
-import pandas as pd
-import psycopg2
 sys.path.insert(0, "/opt/airflow")
-from db_utils import get_db_engine
+from db_utils import get_db_engine, close_db_engine
+from vault_checks import VAULT_CHECKS, print_results, run_parquet, run_postgres
 
-def connect_and_query(query, engine):
-    """Connects to DB using the SQLAlchemy Engine, runs query, and returns DataFrame."""
-    if not engine:
-        return pd.DataFrame()
-        
-    try:
-        # FIX 2: Use SQLAlchemy engine with pd.read_sql
-        df = pd.read_sql(query, engine)
-        return df
-    except Exception as e:
-        # Note: Some validation failure might cause SQL errors if the table wasn't created
-        print(f"[DB QUERY ERROR] Query failed: {e}")
-        return pd.DataFrame()
-
-def validate_vault():
+def validate_vault(source="postgres", raw_vault_dir=None, checks=VAULT_CHECKS):
+    """Runs the declarative vault checks against PostgreSQL or the raw-vault Parquet files. Returns the failure count."""
     print(f"\n{'='*50}\n{'RUNNING DATA VAULT VALIDATION':^50}\n{'='*50}")
+    started = time.perf_counter()
 
-    # Initialize Engine
-    engine = get_db_engine()
-    if not engine:
-        print("[FAIL] Cannot proceed without database connection.")
-        return
-
-    # TEST 1: Hub Key Uniqueness
-    query_hub_uniqueness = "SELECT COUNT(DISTINCT hub_survey_key) AS unique_count, COUNT(hub_survey_key) AS total_count FROM hub_survey;"
-    df_hub_survey = connect_and_query(query_hub_uniqueness, engine)
-    
-    # FIX: Check if dataframe is empty before indexing, and handle connection failure gracefully
-    if df_hub_survey.empty:
-         print("[FAIL] Hub Uniqueness: Query returned empty result, table likely missing or inaccessible.")
-    elif df_hub_survey['unique_count'][0] == df_hub_survey['total_count'][0]:
-        print("[PASS] Hub Uniqueness: Hub Survey keys are unique.")
-    else:
-        print("[FAIL] Hub Uniqueness: Duplicate Hub Survey keys found!")
-
-    # TEST 2: Link Integrity (Ensure all keys in the link are valid foreign keys)
-    query_integrity = """
-        SELECT COUNT(l.hub_well_key) 
-        FROM link_survey_well l 
-        LEFT JOIN hub_well h ON l.hub_well_key = h.hub_well_key
-        WHERE h.hub_well_key IS NULL;
-    """
-    df_integrity = connect_and_query(query_integrity, engine)
-    
-    if df_integrity.empty:
-        print("[FAIL] Link Integrity: Query returned empty result, tables likely missing or inaccessible.")
-    elif df_integrity.iloc[0, 0] == 0:
-        print("[PASS] Link Integrity: No orphaned Well Keys found in Link.")
+    if source == "parquet":
+        raw_vault_dir = raw_vault_dir or os.path.join(os.getcwd(), "processed_data", "raw_vault")
+        print(f"[*] Validating raw vault Parquet in {raw_vault_dir}...")
+        results = run_parquet(checks, raw_vault_dir)
     else:
-        # The IndexError is fixed by the earlier checks, now the value is safe to read
-        print(f"[FAIL] Link Integrity: Found {df_integrity.iloc[0, 0]} orphaned Well Keys!")
+        # Initialize Engine
+        engine = get_db_engine()
+        if not engine:
+            print("[FAIL] Cannot proceed without database connection.")
+            return len(checks)
+        results = run_postgres(checks, engine)
+        # Dispose of the engine connection pool
+        close_db_engine()
 
-    # TEST 3: Physics Constraint (Depth > 0)
-    query_physics = "SELECT COUNT(*) FROM sat_seismic_data WHERE depth < 0;"
-    df_physics = connect_and_query(query_physics, engine)
-    
-    if df_physics.empty:
-        print("[FAIL] Physics Constraint: Query returned empty result, table likely missing or inaccessible.")
-    elif df_physics.iloc[0, 0] == 0:
-        print("[PASS] Physics Constraint: All depths are non-negative.")
-    else:
-        print(f"[FAIL] Physics Constraint: Found {df_physics.iloc[0, 0]} records with negative depth!")
-        
-    # Dispose of the engine connection pool
-    engine.dispose()
-    print(f"\nVALIDATION COMPLETE")
+    failed = print_results(results)
+    print(f"\nVALIDATION COMPLETE in {time.perf_counter() - started:.2f}s")
+    return failed
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument('--data-dir', required=True, help="Path to input data directory (required by spec)")
+    parser.add_argument('--source', choices=['postgres', 'parquet'], default='postgres',
+                        help="Validate the PostgreSQL vault, or the raw_vault Parquet files")
+    parser.add_argument('--raw-vault-dir', default=None,
+                        help="Raw vault Parquet directory for --source parquet (default: ./processed_data/raw_vault)")
+    parser.add_argument('--strict', action='store_true', help="Exit with status 1 if any check fails")
     args = parser.parse_args()
     
-    validate_vault()
+    failed = validate_vault(args.source, args.raw_vault_dir)
+    if args.strict and failed:
+        sys.exit(1)
@@ -0,0 +1,253 @@
+from collections import namedtuple, defaultdict
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from vault_io import vault_table_files
+
+# Declarative vault checks. Every backend evaluates all checks of a table in one scan of that table
+# (Postgres: one aggregate query per table; Parquet: column statistics first, then one projected read).
+
+Check = namedtuple("Check", ["kind", "table", "column", "args"])
+CheckResult = namedtuple("CheckResult", ["check", "passed", "detail", "method"])
+
+UNIQUE = "unique"
+REFERENCES = "references"
+RANGE = "range"
+NULL_RATE = "null_rate"
+
+# Sanity bound for amplitudes; real traces sit within a few dozen units
+AMPLITUDE_LIMIT = 1000.0
+
+
+def unique(table, column):
+    return Check(UNIQUE, table, column, {})
+
+
+def references(table, column, parent, parent_column=None):
+    return Check(REFERENCES, table, column, {"parent": parent, "parent_column": parent_column or column})
+
+
+def value_range(table, column, lo=None, hi=None):
+    """Non-null, non-NaN values must lie in [lo, hi]; nulls are the business of null_rate."""
+    return Check(RANGE, table, column, {"lo": lo, "hi": hi})
+
+
+def null_rate(table, column, max_rate=0.0):
+    return Check(NULL_RATE, table, column, {"max_rate": max_rate})
+
+
+VAULT_CHECKS = [
+    # Hubs and links: one row per business key
+    unique("hub_survey", "hub_survey_key"),
+    unique("hub_well", "hub_well_key"),
+    unique("link_survey_well", "link_survey_well_key"),
+    # Referential integrity: every link / satellite key resolves to its parent
+    references("link_survey_well", "hub_survey_key", "hub_survey"),
+    references("link_survey_well", "hub_well_key", "hub_well"),
+    references("sat_seismic_data", "link_survey_well_key", "link_survey_well"),
+    references("sat_survey_details", "hub_survey_key", "hub_survey"),
+    references("sat_well_details", "hub_well_key", "hub_well"),
+    # Physics and flag domains
+    value_range("sat_seismic_data", "depth", lo=0),
+    value_range("sat_seismic_data", "amplitude", lo=-AMPLITUDE_LIMIT, hi=AMPLITUDE_LIMIT),
+    value_range("sat_seismic_data", "quality_flag", lo=0, hi=1),
+    # Completeness
+    null_rate("sat_seismic_data", "link_survey_well_key"),
+    null_rate("sat_seismic_data", "depth", max_rate=0.01),
+    null_rate("sat_seismic_data", "amplitude", max_rate=0.01),
+    null_rate("sat_seismic_data", "quality_flag", max_rate=0.01),
+]
+
+
+def check_label(check):
+    if check.kind == REFERENCES:
+        return f"references({check.table}.{check.column} -> {check.args['parent']}.{check.args['parent_column']})"
+    return f"{check.kind}({check.table}.{check.column})"
+
+
+def by_table(checks):
+    grouped = defaultdict(list)
+    for check in checks:
+        grouped[check.table].append(check)
+    return grouped
+
+
+def _judge(check, total, value, method):
+    """Turns the per-check aggregate (duplicates / orphans / violations / nulls) into a result."""
+    if check.kind == UNIQUE:
+        return CheckResult(check, value == 0, f"{value} duplicate keys in {total} rows", method)
+    if check.kind == REFERENCES:
+        return CheckResult(check, value == 0, f"{value} orphaned keys in {total} rows", method)
+    if check.kind == RANGE:
+        bounds = f"[{check.args['lo']}, {check.args['hi']}]"
+        return CheckResult(check, value == 0, f"{value} values outside {bounds}", method)
+    rate = value / total if total else 0.0
+    return CheckResult(check, rate <= check.args["max_rate"],
+                       f"null rate {rate:.4%} ({value}/{total}), max {check.args['max_rate']:.2%}", method)
+
+
+# --- PostgreSQL: one aggregate query per table, all tables in parallel ---
+
+def _sql_literal(value):
+    return repr(float(value))
+
+
+def table_query(table, checks):
+    selects = ["COUNT(*) AS total_rows"]
+    joins = []
+    for i, check in enumerate(checks):
+        col = f't."{check.column}"'
+        if check.kind == UNIQUE:
+            selects.append(f"COUNT({col}) - COUNT(DISTINCT {col}) AS c{i}")
+        elif check.kind == REFERENCES:
+            # Distinct parent keys, so the join never multiplies rows of the scanned table
+            joins.append(
+                f'LEFT JOIN (SELECT DISTINCT "{check.args["parent_column"]}" AS k FROM "{check.args["parent"]}") r{i} '
+                f"ON r{i}.k = {col}"
+            )
+            selects.append(f"COUNT(*) FILTER (WHERE {col} IS NOT NULL AND r{i}.k IS NULL) AS c{i}")
+        elif check.kind == RANGE:
+            bounds = []
+            if check.args["lo"] is not None:
+                bounds.append(f"{col} < {_sql_literal(check.args['lo'])}")
+            if check.args["hi"] is not None:
+                bounds.append(f"{col} > {_sql_literal(check.args['hi'])}")
+            selects.append(f"COUNT(*) FILTER (WHERE {col}::float8 <> 'NaN' AND ({' OR '.join(bounds) or 'false'})) AS c{i}")
+        elif check.kind == NULL_RATE:
+            selects.append(f"COUNT(*) - COUNT({col}) AS c{i}")
+    return f'SELECT {", ".join(selects)} FROM "{table}" t {" ".join(joins)}'
+
+
+def run_postgres(checks, engine):
+    from db_utils import run_queries
+
+    grouped = by_table(checks)
+    frames = run_queries({table: table_query(table, tchecks) for table, tchecks in grouped.items()}, engine, parallel=True)
+
+    results = []
+    for table, tchecks in grouped.items():
+        df = frames.get(table)
+        if df is None or df.empty:
+            results.extend(CheckResult(c, False, "query failed (table missing or inaccessible)", "scan") for c in tchecks)
+            continue
+        row = df.iloc[0]
+        total = int(row["total_rows"])
+        results.extend(_judge(c, total, int(row[f"c{i}"]), "scan") for i, c in enumerate(tchecks))
+    return results
+
+
+# --- Parquet raw vault: footer statistics first, one projected read for whatever they cannot prove ---
+
+def column_statistics(files, columns):
+    """{column: (min, max, null_count)} over every row group, or None for a column if any row group lacks stats."""
+    found = {col: [None, None, 0] for col in columns}
+    missing = set()
+    rows = 0
+    for path in files:
+        metadata = pq.ParquetFile(path).metadata
+        rows += metadata.num_rows
+        names = [metadata.schema.column(i).path for i in range(metadata.num_columns)]
+        for rg in range(metadata.num_row_groups):
+            row_group = metadata.row_group(rg)
+            for col in columns:
+                if col not in names:
+                    missing.add(col)
+                    continue
+                stats = row_group.column(names.index(col)).statistics
+                if stats is None or not stats.has_null_count:
+                    missing.add(col)
+                    continue
+                acc = found[col]
+                acc[2] += stats.null_count
+                if stats.has_min_max:
+                    acc[0] = stats.min if acc[0] is None else min(acc[0], stats.min)
+                    acc[1] = stats.max if acc[1] is None else max(acc[1], stats.max)
+                elif stats.null_count != row_group.num_rows:
+                    missing.add(col)
+    return rows, {col: (None if col in missing else tuple(acc)) for col, acc in found.items()}
+
+
+def _range_from_stats(check, stats):
+    """PASS/FAIL straight from min/max, or None when the statistics cannot decide."""
+    if stats is None:
+        return None
+    lo, hi = check.args["lo"], check.args["hi"]
+    col_min, col_max, _ = stats
+    if col_min is None:
+        # Only nulls
+        return CheckResult(check, True, "no non-null values", "statistics")
+    if (lo is not None and col_min < lo) or (hi is not None and col_max > hi):
+        return CheckResult(check, False, f"min {col_min} / max {col_max} outside [{lo}, {hi}]", "statistics")
+    return CheckResult(check, True, f"min {col_min} / max {col_max} within [{lo}, {hi}]", "statistics")
+
+
+def _count_outside(values, lo, hi):
+    values = values.filter(pc.invert(pc.is_nan(values))) if pa.types.is_floating(values.type) else values
+    outside = None
+    if lo is not None:
+        outside = pc.less(values, lo)
+    if hi is not None:
+        above = pc.greater(values, hi)
+        outside = above if outside is None else pc.or_(outside, above)
+    return 0 if outside is None else int(pc.sum(outside).as_py() or 0)
+
+
+def run_parquet(checks, raw_vault_dir):
+    results = []
+    parent_keys = {}
+
+    def keys_of(table, column):
+        if (table, column) not in parent_keys:
+            files = vault_table_files(raw_vault_dir, table)
+            keys = ds.dataset(files, format="parquet").to_table(columns=[column])[column] if files else pa.chunked_array([], pa.string())
+            parent_keys[(table, column)] = pc.unique(keys.combine_chunks())
+        return parent_keys[(table, column)]
+
+    for table, tchecks in by_table(checks).items():
+        files = vault_table_files(raw_vault_dir, table)
+        if not files:
+            results.extend(CheckResult(c, False, f"{table} not found in {raw_vault_dir}", "scan") for c in tchecks)
+            continue
+
+        total, stats = column_statistics(files, sorted({c.column for c in tchecks if c.kind in (RANGE, NULL_RATE)}))
+
+        pending = []
+        for check in tchecks:
+            if check.kind == NULL_RATE and stats.get(check.column) is not None:
+                results.append(_judge(check, total, stats[check.column][2], "statistics"))
+            elif check.kind == RANGE and (decided := _range_from_stats(check, stats.get(check.column))) is not None:
+                results.append(decided)
+            else:
+                pending.append(check)
+
+        if not pending:
+            continue
+
+        # One read of just the columns the statistics could not settle
+        data = ds.dataset(files, format="parquet").to_table(columns=sorted({c.column for c in pending}))
+        for check in pending:
+            values = data[check.column].combine_chunks()
+            if check.kind == UNIQUE:
+                value = (len(values) - values.null_count) - len(pc.unique(values.drop_null()))
+            elif check.kind == REFERENCES:
+                present = values.drop_null()
+                known = pc.is_in(present, value_set=keys_of(check.args["parent"], check.args["parent_column"]))
+                value = len(present) - int(pc.sum(known).as_py() or 0)
+            elif check.kind == RANGE:
+                value = _count_outside(values, check.args["lo"], check.args["hi"])
+            else:
+                value = values.null_count
+            results.append(_judge(check, data.num_rows, value, "scan"))
+
+    return results
+
+
+def print_results(results):
+    for result in results:
+        status = "PASS" if result.passed else "FAIL"
+        print(f"[{status}] {check_label(result.check)}: {result.detail} ({result.method})")
+    failed = sum(not r.passed for r in results)
+    from_stats = sum(r.method == "statistics" for r in results)
+    print(f"\n[*] {len(results) - failed}/{len(results)} checks passed, {from_stats} settled from column statistics.")
+    return failed
@@ -0,0 +1,97 @@
+import os
+import glob
+import shutil
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+# Raw-vault Parquet layout: a full load writes <table>.parquet, every incremental load
+# appends <table>.<stamp>.parquet next to it. A partitioned table is a hive-style directory
+# <table>/<col>=<value>/.../part-<stamp>.parquet instead. Readers take the union.
+
+
+def partitioned_files(out_dir: str, table_name: str) -> list:
+    return sorted(glob.glob(os.path.join(out_dir, table_name, "**", "*.parquet"), recursive=True))
+
+
+def flat_files(out_dir: str, table_name: str) -> list:
+    base = os.path.join(out_dir, f"{table_name}.parquet")
+    increments = sorted(glob.glob(os.path.join(out_dir, f"{table_name}.*.parquet")))
+    return ([base] if os.path.exists(base) else []) + increments
+
+
+def vault_table_files(out_dir: str, table_name: str) -> list:
+    return flat_files(out_dir, table_name) + partitioned_files(out_dir, table_name)
+
+
+def scan_vault_table(out_dir: str, table_name: str, columns, filter=None, partition_filter=None):
+    """Arrow table of `columns` over both layouts of a raw-vault table, or None if it was never written.
+
+    filter applies to every file and skips row groups on their min/max statistics. partition_filter only
+    applies to the hive-partitioned files, where it skips whole directories (flat files carry no partition values)."""
+    tables = []
+    flat = flat_files(out_dir, table_name)
+    if flat:
+        tables.append(ds.dataset(flat, format="parquet").to_table(columns=columns, filter=filter))
+    parts = partitioned_files(out_dir, table_name)
+    if parts:
+        dataset = ds.dataset(parts, format="parquet", partitioning="hive",
+                             partition_base_dir=os.path.join(out_dir, table_name))
+        if partition_filter is not None:
+            filter = partition_filter if filter is None else filter & partition_filter
+        tables.append(dataset.to_table(columns=columns, filter=filter))
+    if not tables:
+        return None
+    return pa.concat_tables(tables, promote_options="permissive")
+
+
+def clear_increments(out_dir: str, table_name: str):
+    for path in glob.glob(os.path.join(out_dir, f"{table_name}.*.parquet")):
+        os.remove(path)
+
+
+def clear_flat(out_dir: str, table_name: str):
+    """Removes the single-file layout (base + increments), e.g. after a full partitioned load."""
+    base = os.path.join(out_dir, f"{table_name}.parquet")
+    if os.path.exists(base):
+        os.remove(base)
+    clear_increments(out_dir, table_name)
+
+
+def clear_partitioned(out_dir: str, table_name: str):
+    shutil.rmtree(os.path.join(out_dir, table_name), ignore_errors=True)
+
+
+def partition_path(values: dict) -> str:
+    """Hive-style relative directory for one partition, e.g. survey_id=101/ingest_date=2025-01-01."""
+    parts = []
+    for col, value in values.items():
+        if value is None or pd.isna(value):
+            value = "__HIVE_DEFAULT_PARTITION__"
+        elif isinstance(value, float) and value.is_integer():
+            # int columns promoted to float64 (see seismic_dataset) keep their integer directory names
+            value = int(value)
+        parts.append(f"{col}={value}")
+    return os.path.join(*parts)
+
+
+def increment_path(out_dir: str, table_name: str, stamp: str) -> str:
+    return os.path.join(out_dir, f"{table_name}.{stamp}.parquet")
+
+
+def read_vault_table(out_dir: str, table_name: str, columns=None):
+    """Union of the base file and all increments, or None if the table was never written."""
+    files = vault_table_files(out_dir, table_name)
+    if not files:
+        return None
+    return pd.concat([pd.read_parquet(f, columns=columns) for f in files], ignore_index=True)
+
+
+def new_rows(existing, df: pd.DataFrame, key_columns) -> pd.DataFrame:
+    """Rows of df whose key columns are not stored yet (anti-join against the existing table)."""
+    if existing is None or existing.empty or df.empty:
+        return df
+
+    stored = existing[key_columns].drop_duplicates()
+    merged = df.merge(stored, on=key_columns, how="left", indicator=True)
+    return df[(merged["_merge"] == "left_only").to_numpy()]
@@ -0,0 +1,66 @@
+import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Row hashes above this size are spread over worker processes (MD5 of short strings holds the GIL,
+# so threads would not help)
+PARALLEL_THRESHOLD = 2_000_000
+DEFAULT_WORKERS = min(8, os.cpu_count() or 1)
+
+
+def md5(val) -> str:
+    return hashlib.md5(str(val).encode("utf-8")).hexdigest()
+
+
+def _md5_many(values):
+    _md5 = hashlib.md5
+    return [_md5(v.encode("utf-8")).hexdigest() for v in values]
+
+
+def _as_str(values) -> pd.Series:
+    # Same conversion build_vault always used (Series.astype(str)), so keys stay byte-identical
+    return pd.Series(values).astype(str)
+
+
+def hub_keys(values: pd.Series) -> np.ndarray:
+    """MD5 hex of str(value), hashed once per distinct value and broadcast back to every row."""
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    unique_keys = np.array(_md5_many(_as_str(uniques)), dtype=object)
+    return unique_keys[codes]
+
+
+def link_keys(left: pd.Series, right: pd.Series, sep: str = "_") -> np.ndarray:
+    """MD5 hex of "<left><sep><right>", hashed once per distinct pair."""
+    left_codes, left_uniques = pd.factorize(left, use_na_sentinel=False)
+    right_codes, right_uniques = pd.factorize(right, use_na_sentinel=False)
+
+    n_right = max(len(right_uniques), 1)
+    pair_codes, pairs = pd.factorize(left_codes.astype(np.int64) * n_right + right_codes)
+
+    left_str = _as_str(left_uniques).to_numpy()
+    right_str = _as_str(right_uniques).to_numpy()
+    pair_strings = [f"{left_str[p // n_right]}{sep}{right_str[p % n_right]}" for p in pairs]
+
+    unique_keys = np.array(_md5_many(pair_strings), dtype=object)
+    return unique_keys[pair_codes]
+
+
+def row_hashes(df: pd.DataFrame, columns, sep: str = "_", workers: int = None) -> np.ndarray:
+    """MD5 hex of the columns' string forms joined by sep, built column-wise instead of one Python call per row."""
+    joined = None
+    for col in columns:
+        part = df[col].astype(str)
+        joined = part if joined is None else joined + sep + part
+
+    values = joined.tolist()
+
+    workers = DEFAULT_WORKERS if workers is None else workers
+    if workers <= 1 or len(values) < PARALLEL_THRESHOLD:
+        return np.array(_md5_many(values), dtype=object)
+
+    chunk = -(-len(values) // workers)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parts = pool.map(_md5_many, [values[i:i + chunk] for i in range(0, len(values), chunk)])
+        return np.array([key for part in parts for key in part], dtype=object)